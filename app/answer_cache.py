@@ -0,0 +1,159 @@
+"""
+Semantic cache of `/v1/text_conversation` answers.
+
+A question is looked up by the cosine distance of its embedding to the
+questions answered before. Within `ANSWER_CACHE_MAX_DISTANCE` the stored
+answer is returned, which saves both chat completions and the CoinGecko
+lookups of a near-identical question.
+
+Answers expire after `ANSWER_CACHE_TTL_S`. An answer written with market
+data quotes it, e.g. the current price, so it expires after the shorter
+`ANSWER_CACHE_MARKET_TTL_S` instead: it is returned together with the market
+data it was written from, never with newer data that contradicts its text.
+"""
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    related_answers: List[Dict[str, Any]]
+    top_k: int
+    coin_name: Optional[str]
+    market_data: Optional[Dict[str, Any]]
+    # How long answering the question took, saved by every hit
+    latency: float
+    created_at: float = field(default_factory=time.monotonic)
+    hits: int = 0
+
+    @property
+    def quotes_market_data(self) -> bool:
+        """Whether the answer was written from market data, which the prompt only includes without errors."""
+        return bool(self.market_data) and not self.market_data.get("error")
+
+
+class SemanticAnswerCache:
+
+    def __init__(
+        self,
+        max_distance: Optional[float] = None,
+        ttl: Optional[float] = None,
+        market_ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ):
+        self.max_distance = max_distance if max_distance is not None else float(os.environ.get("ANSWER_CACHE_MAX_DISTANCE", "0.05"))
+        self.ttl = ttl if ttl is not None else float(os.environ.get("ANSWER_CACHE_TTL_S", "3600"))
+        self.market_ttl = market_ttl if market_ttl is not None else float(os.environ.get("ANSWER_CACHE_MARKET_TTL_S", "60"))
+        self.max_entries = max_entries if max_entries is not None else int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._embeddings: Dict[int, np.ndarray] = {}
+        self._next_key = 0
+        # Stacked embeddings of all entries, rebuilt lazily after changes
+        self._keys: List[int] = []
+        self._matrix: Optional[np.ndarray] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.market_expirations = 0
+        self.saved_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def lookup(self, embedding: List[float], top_k: int) -> Optional[CachedAnswer]:
+        """Closest cached answer within the distance threshold, with at least `top_k` related answers."""
+        if not self.enabled:
+            return None
+        self._expire()
+        matrix = self._stacked()
+        if matrix is None:
+            self.misses += 1
+            return None
+
+        distances = 1.0 - matrix @ _normalize(embedding)
+        for position in np.argsort(distances):
+            if distances[position] > self.max_distance:
+                break
+            key = self._keys[position]
+            entry = self._entries[key]
+            if entry.top_k >= top_k:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                entry.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def add(self, embedding: List[float], entry: CachedAnswer):
+        if not self.enabled:
+            return
+        key = self._next_key
+        self._next_key += 1
+        self._entries[key] = entry
+        self._embeddings[key] = _normalize(embedding)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+        self._matrix = None
+
+    def record_hit(self, entry: CachedAnswer, latency: float):
+        """Account the time a hit that took `latency` saved compared to answering the question."""
+        self.saved_seconds += max(entry.latency - latency, 0.0)
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if now - entry.created_at > self._ttl(entry)]
+        for key in expired:
+            if self._ttl(self._entries[key]) < self.ttl:
+                self.market_expirations += 1
+            self._remove(key)
+        if expired:
+            self._matrix = None
+
+    def _ttl(self, entry: CachedAnswer) -> float:
+        return min(self.ttl, self.market_ttl) if entry.quotes_market_data else self.ttl
+
+    def _remove(self, key: int):
+        del self._entries[key]
+        del self._embeddings[key]
+
+    def _stacked(self) -> Optional[np.ndarray]:
+        if self._matrix is None and self._entries:
+            self._keys = list(self._embeddings)
+            self._matrix = np.vstack([self._embeddings[key] for key in self._keys])
+        return self._matrix if self._entries else None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "market_expirations": self.market_expirations,
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
+
+
+def _normalize(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+_answer_cache: Optional[SemanticAnswerCache] = None
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = SemanticAnswerCache()
+    return _answer_cache
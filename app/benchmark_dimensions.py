@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Recall and search latency of shortened embeddings on the data.yaml corpus.
+
+    python -m app.benchmark_dimensions --dimensions 256 512 1024 1536 --k 5
+
+The corpus chunks (as `chunk_coin` stores them) and a set of questions about
+every coin are embedded once at the model's native size, through the
+embedding cache, so a rerun needs no API calls. Each dimension is evaluated
+with the shortened embeddings, which are what the API returns for it:
+
+- recall@k: share of the native top k found in the top k at the dimension,
+  by exact cosine search over float16 vectors like the `halfvec` column
+- the same recall over the corpus grown to `--size` vectors with perturbed
+  copies of its chunks, where neighbours are harder to tell apart
+- search latency p50/p95 per question over the grown corpus
+- bytes stored per vector
+
+`--api-samples` also times the embeddings API for every dimension.
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import yaml
+from dotenv import load_dotenv
+
+from app.embed_crypto_data import DEFAULT_DATA_PATH, chunk_coin
+from app.embedding_cache import get_embedding_cache
+from app.embeddings import EMBEDDING_MODEL, NATIVE_DIMENSIONS, EmbeddingBatcher
+from app.ingest import Document
+from app.openai_client import create_openai_client
+
+QUESTION_TEMPLATES = (
+    "What is {name}?",
+    "Who created {name} and when?",
+    "How does {name} reach consensus?",
+    "What is the history of {name}?",
+    "What are the main use cases of {name}?",
+    "What problems does {name} try to solve?",
+)
+
+
+def load_corpus(path: str):
+    """(chunk texts, questions) of the coins in data.yaml."""
+    with open(path, "r") as file:
+        coins = yaml.safe_load(file)["cryptocurrencies"]
+    texts, questions = [], []
+    for coin in coins:
+        document = Document(id=coin["name"], fields={"name": coin["name"], "history": coin["history"]})
+        texts.extend(text for _, text in chunk_coin(document))
+        questions.extend(template.format(name=coin["name"]) for template in QUESTION_TEMPLATES)
+    return texts, questions
+
+
+def shorten(matrix: np.ndarray, dimensions: int) -> np.ndarray:
+    """Rows shortened like `shorten_embedding` and rounded to float16 like the stored vectors."""
+    prefix = matrix[:, :dimensions]
+    norms = np.linalg.norm(prefix, axis=1, keepdims=True)
+    prefix = np.divide(prefix, norms, out=np.zeros_like(prefix), where=norms > 0)
+    return prefix.astype(np.float16).astype(np.float32)
+
+
+def grow(matrix: np.ndarray, size: int, noise: float, seed: int = 0) -> np.ndarray:
+    """
+    The rows and perturbed copies of them up to `size` rows. The perturbation of a component follows its spread
+    in the rows, so the copies keep the leading components as informative as they are in real embeddings; `noise`
+    is its expected norm.
+    """
+    rng = np.random.default_rng(seed)
+    spread = matrix.std(axis=0)
+    spread = spread / (np.linalg.norm(spread) or 1.0)
+    copies = matrix[rng.integers(0, len(matrix), max(0, size - len(matrix)))]
+    copies = copies + rng.normal(size=copies.shape).astype(np.float32) * (noise * spread)
+    return np.vstack([matrix, copies]).astype(np.float32)
+
+
+def top_k(matrix: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    similarities = matrix @ query
+    k = min(k, len(similarities))
+    top = np.argpartition(-similarities, k - 1)[:k]
+    return top[np.argsort(-similarities[top])]
+
+
+def recall(matrix: np.ndarray, queries: np.ndarray, truth: List[np.ndarray], k: int) -> float:
+    found = sum(len(set(top_k(matrix, query, k)) & set(expected)) for query, expected in zip(queries, truth))
+    return found / sum(len(expected) for expected in truth)
+
+
+def percentile_ms(durations: List[float], percentile: float) -> float:
+    return float(np.percentile(durations, percentile)) * 1000
+
+
+async def embed_all(client, texts: List[str]) -> np.ndarray:
+    batcher = EmbeddingBatcher(client, cache=get_embedding_cache(), dimensions=NATIVE_DIMENSIONS[EMBEDDING_MODEL])
+    return np.asarray(await batcher.embed_many(texts), dtype=np.float32)
+
+
+async def time_api(client, question: str, dimensions: int, samples: int) -> float:
+    """p50 in milliseconds of embedding one question at the dimension."""
+    extra = {} if dimensions == NATIVE_DIMENSIONS[EMBEDDING_MODEL] else {"dimensions": dimensions}
+    durations = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        await client.embeddings.create(model=EMBEDDING_MODEL, input=[question], **extra)
+        durations.append(time.perf_counter() - start)
+    return percentile_ms(durations, 50)
+
+
+async def benchmark(args) -> List[Dict[str, Optional[float]]]:
+    native = NATIVE_DIMENSIONS[EMBEDDING_MODEL]
+    texts, questions = load_corpus(args.data)
+    print(f"Embedding {len(texts)} chunks and {len(questions)} questions at {native} dimensions...")
+    client = create_openai_client()
+    try:
+        corpus = await embed_all(client, texts)
+        queries = await embed_all(client, questions)
+        grown = grow(corpus, args.size, args.noise)
+
+        full_corpus, full_grown, full_queries = shorten(corpus, native), shorten(grown, native), shorten(queries, native)
+        truth = [top_k(full_corpus, query, args.k) for query in full_queries]
+        grown_truth = [top_k(full_grown, query, args.k) for query in full_queries]
+
+        rows = []
+        for dimensions in args.dimensions:
+            corpus_d, grown_d, queries_d = shorten(corpus, dimensions), shorten(grown, dimensions), shorten(queries, dimensions)
+            durations = []
+            for _ in range(args.repeat):
+                for query in queries_d:
+                    start = time.perf_counter()
+                    top_k(grown_d, query, args.k)
+                    durations.append(time.perf_counter() - start)
+            rows.append({
+                "dimensions": dimensions,
+                "recall": recall(corpus_d, queries_d, truth, args.k),
+                "grown_recall": recall(grown_d, queries_d, grown_truth, args.k),
+                "p50_ms": percentile_ms(durations, 50),
+                "p95_ms": percentile_ms(durations, 95),
+                "bytes": dimensions * 2,
+                "api_p50_ms": await time_api(client, questions[0], dimensions, args.api_samples) if args.api_samples else None,
+            })
+        return rows
+    finally:
+        await client.close()
+        get_embedding_cache().close()
+
+
+def print_report(rows: List[Dict[str, Optional[float]]], k: int, size: int):
+    header = f"{'dims':>5} {f'recall@{k}':>9} {f'recall@{k} ({size})':>18} {'search p50 ms':>13} {'p95 ms':>7} {'bytes/vector':>12} {'api p50 ms':>10}"
+    print(header)
+    for row in rows:
+        api = f"{row['api_p50_ms']:.0f}" if row["api_p50_ms"] is not None else "-"
+        print(
+            f"{row['dimensions']:>5} {row['recall']:>9.3f} {row['grown_recall']:>18.3f} "
+            f"{row['p50_ms']:>13.3f} {row['p95_ms']:>7.3f} {row['bytes']:>12} {api:>10}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare recall and search latency of embedding dimensions")
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH, help="Path to data.yaml")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[256, 512, 1024, NATIVE_DIMENSIONS[EMBEDDING_MODEL]])
+    parser.add_argument("--k", type=int, default=5, help="Results per search")
+    parser.add_argument("--size", type=int, default=20000, help="Vectors in the grown corpus used for latency")
+    parser.add_argument("--noise", type=float, default=1.0, help="Norm of the perturbation of the grown corpus copies")
+    parser.add_argument("--repeat", type=int, default=5, help="Times every question is searched for latency")
+    parser.add_argument("--api-samples", type=int, default=0, help="Embeddings API calls timed per dimension")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = parse_args()
+    print_report(asyncio.run(benchmark(args)), args.k, args.size)
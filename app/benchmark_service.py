@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency, throughput and recall of the API, offline.
+
+    python -m app.benchmark_service --concurrency 1 8 32 --requests 200 --size 5000 --k 5
+
+The API is started with uvicorn in a subprocess, with OpenAI, CoinGecko and
+the Chromia node replaced by the stand-ins of `app.stub_apis` and
+`app.stub_node`, each answering after its configured latency. The node holds
+the chunks of data.yaml, grown to `--size` vectors with perturbed copies like
+in `app.benchmark_dimensions`, and their embeddings are in the API's
+embedding cache like after ingestion. A workload of questions about the
+coins is replayed against `/v1/text_search` and `/v1/text_conversation` at
+every concurrency, and reported per endpoint:
+
+- throughput and failed requests, with the most common errors
+- p50/p95/p99 of the whole request, and of every stage of a conversation as
+  reported in its `timings`
+- recall@k of the searches: share of the exact top k found in the results,
+  the exact top k by brute force over the float32 embeddings
+
+The API is configured by the environment as usual, so settings are compared
+by running again with e.g. `VECTOR_INDEX=1` or `RERANK_FACTOR=1`. Its caches,
+database and coin list are kept in a temporary directory. The answer cache is
+disabled unless `--answer-cache` is given, and `--unique` makes every
+question distinct, so no request is answered from the caches. The end of the
+API's log is printed when a run fails completely, and the benchmark then
+exits with status 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+import yaml
+
+from app.benchmark_dimensions import QUESTION_TEMPLATES, grow, percentile_ms, top_k
+from app.embed_crypto_data import DEFAULT_DATA_PATH, chunk_coin
+from app.embedding_cache import EmbeddingCache
+from app.embeddings import EMBEDDING_MODEL, embedding_cache_key, embedding_dimensions
+from app.ingest import Document
+from app.stub_apis import StubCoinGecko, StubOpenAI, load_stub_coins, start_stub_app
+from app.stub_node import StubNode, start_stub_node
+from app.vectors import pack_vector
+
+REPOSITORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+ENDPOINTS = {
+    "search": "/v1/text_search",
+    "conversation": "/v1/text_conversation",
+}
+
+# Distinct errors reported per run
+ERRORS_SHOWN = 3
+
+
+def load_messages(path: str) -> Tuple[List[Tuple[str, str, str]], List[str]]:
+    """((text, coin, chunk type) of the chunks, questions) of the coins in data.yaml."""
+    with open(path, "r") as file:
+        coins = yaml.safe_load(file)["cryptocurrencies"]
+    messages, questions = [], []
+    for coin in coins:
+        document = Document(id=coin["name"], fields={"name": coin["name"], "history": coin["history"]}, coin=coin["name"])
+        messages.extend((text, coin["name"], chunk_type) for chunk_type, text in chunk_coin(document))
+        questions.extend(template.format(name=coin["name"]) for template in QUESTION_TEMPLATES)
+    return messages, questions
+
+
+def build_corpus(messages: List[Tuple[str, str, str]], embedder: StubOpenAI, dimensions: int, size: int, noise: float):
+    """(tagged messages, float32 matrix of their embeddings), the chunks followed by perturbed copies of them."""
+    matrix = np.asarray([embedder.embed(text, EMBEDDING_MODEL, dimensions) for text, _, _ in messages], dtype=np.float32)
+    matrix = grow(matrix, size, noise)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    tagged = list(messages)
+    for n in range(len(messages), len(matrix)):
+        # Copies of the same chunk need distinct texts, messages are deleted and cached by text
+        text, coin, chunk_type = messages[n % len(messages)]
+        tagged.append((f"{text} [{n}]", coin, chunk_type))
+    return tagged, matrix
+
+
+class Standins:
+    """The stand-in node and APIs, served by an event loop of their own so the load generator does not slow them."""
+
+    def __init__(self, node: StubNode, openai: StubOpenAI, coingecko: StubCoinGecko):
+        self.node = node
+        self.ports = {name: _free_port() for name in ("node", "openai", "coingecko")}
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        for start in (
+            start_stub_node(node, port=self.ports["node"]),
+            start_stub_app(openai.make_app(), port=self.ports["openai"]),
+            start_stub_app(coingecko.make_app(), port=self.ports["coingecko"]),
+        ):
+            asyncio.run_coroutine_threadsafe(start, self._loop).result()
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ApiServer:
+    """`uvicorn main:app` in a subprocess, pointed at the stand-ins."""
+
+    def __init__(self, standins: Standins, directory: str, answer_cache: bool):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log_path = os.path.join(directory, "api.log")
+        env = {
+            # The stand-in CoinGecko has no rate limit to respect
+            "COINGECKO_REQUESTS_PER_MINUTE": "60000",
+            "COINGECKO_BURST": "100",
+            **({} if answer_cache else {"ANSWER_CACHE_MAX_DISTANCE": "-1"}),
+            **os.environ,
+            "OPENAI_API_KEY": "benchmark",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{standins.ports['openai']}/v1",
+            "COINGECKO_BASE_URL": f"http://127.0.0.1:{standins.ports['coingecko']}/api/v3",
+            "CHROMIA_NODE_URL": f"http://127.0.0.1:{standins.ports['node']}",
+            "VECTOR_BRID": standins.node.vector_brid.hex().upper(),
+            "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(directory, 'conversations.sqlite3')}",
+            "EMBEDDING_CACHE_PATH": os.path.join(directory, "embeddings.sqlite3"),
+            "COINGECKO_COIN_LIST_PATH": os.path.join(directory, "coingecko_coins.json"),
+        }
+        self._log = open(self.log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning"],
+            cwd=REPOSITORY_PATH,
+            env=env,
+            stdout=self._log,
+            stderr=subprocess.STDOUT,
+        )
+
+    async def wait_ready(self, timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    break
+                try:
+                    if (await client.get(f"{self.url}/health")).status_code == 200:
+                        return
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError(f"The API did not start:\n{self.log_tail()}")
+
+    def log_tail(self, lines: int = 30) -> str:
+        """The end of the API's output, which is deleted with the temporary directory."""
+        self._log.flush()
+        with open(self.log_path, "r") as file:
+            return "".join(file.readlines()[-lines:])
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._log.close()
+
+
+def workload(questions: List[str], count: int, unique: bool, offset: int = 0) -> List[str]:
+    """`count` questions, cycling through the list; numbered when they should all be distinct."""
+    replay = [questions[i % len(questions)] for i in range(count)]
+    return [f"{question} ({offset + i})" for i, question in enumerate(replay)] if unique else replay
+
+
+def _request_body(endpoint: str, question: str, k: int) -> Dict[str, Any]:
+    if endpoint == "search":
+        return {"text": question, "max_results": k}
+    return {"question": question, "top_k": k}
+
+
+def _error(response: httpx.Response) -> str:
+    """Status and `detail` of a failed request, as raised with HTTPException by the API."""
+    try:
+        detail = response.json().get("detail")
+    except ValueError:
+        detail = None
+    return f"{response.status_code}: {detail if detail is not None else response.text[:200]}"
+
+
+async def replay(client: httpx.AsyncClient, endpoint: str, questions: List[str], concurrency: int, k: int):
+    """
+    (wall time, samples) of the questions sent by `concurrency` workers; a sample is (question, seconds, response,
+    error), with either the response or the error None.
+    """
+    pending = iter(questions)
+    samples: List[Tuple[str, float, Optional[Dict[str, Any]], Optional[str]]] = []
+
+    async def worker():
+        for question in pending:
+            start = time.perf_counter()
+            body = error = None
+            try:
+                response = await client.post(ENDPOINTS[endpoint], json=_request_body(endpoint, question, k))
+                if response.status_code == 200:
+                    body = response.json()
+                else:
+                    error = _error(response)
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            samples.append((question, time.perf_counter() - start, body, error))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, samples
+
+
+class GroundTruth:
+    """Exact top k of the questions by brute force over the corpus embeddings."""
+
+    def __init__(self, texts: List[str], matrix: np.ndarray, embedder: StubOpenAI, dimensions: int, k: int):
+        self.texts = texts
+        self.matrix = matrix
+        self.embedder = embedder
+        self.dimensions = dimensions
+        self.k = k
+
+    def top_texts(self, question: str) -> List[str]:
+        query = np.asarray(self.embedder.embed(question, EMBEDDING_MODEL, self.dimensions), dtype=np.float32)
+        # The API only returns results within a cosine distance of 1
+        return [self.texts[i] for i in top_k(self.matrix, query, self.k) if self.matrix[i] @ query >= 0]
+
+    def recall(self, samples) -> Optional[float]:
+        found = expected = 0
+        for question, _, body, _ in samples:
+            truth = set(self.top_texts(question))
+            results = {result["text"] for result in body["results"]} if body is not None else set()
+            found += len(truth & results)
+            expected += len(truth)
+        return found / expected if expected else None
+
+
+def summarize(endpoint: str, concurrency: int, wall: float, samples, truth: Optional[GroundTruth]) -> Dict[str, Any]:
+    succeeded = [sample for sample in samples if sample[2] is not None]
+    durations: Dict[str, List[float]] = {"request": [seconds for _, seconds, _, _ in succeeded]}
+    for _, _, body, _ in succeeded:
+        for stage, milliseconds in body.get("timings", {}).items():
+            durations.setdefault(stage, []).append(milliseconds / 1000)
+    return {
+        "endpoint": ENDPOINTS[endpoint],
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": len(samples) - len(succeeded),
+        "error_counts": dict(Counter(error for _, _, _, error in samples if error is not None).most_common(ERRORS_SHOWN)),
+        "degraded": sum(1 for _, _, body, _ in succeeded if body.get("degraded")),
+        "throughput": len(succeeded) / wall if wall > 0 else 0.0,
+        "recall": truth.recall(samples) if truth is not None else None,
+        "stages": {
+            stage: {f"p{p}_ms": percentile_ms(values, p) for p in (50, 95, 99)}
+            for stage, values in durations.items() if values
+        },
+    }
+
+
+async def benchmark(args) -> List[Dict[str, Any]]:
+    dimensions = embedding_dimensions()
+    messages, questions = load_messages(args.data)
+    embedder = StubOpenAI(args.embedding_latency, args.completion_latency)
+    tagged, matrix = build_corpus(messages, embedder, dimensions, args.size, args.noise)
+    print(f"Corpus of {len(tagged)} vectors with {dimensions} dimensions, {len(questions)} questions")
+
+    node = StubNode(dimensions)
+    node.operations["add_tagged_messages"]([
+        [text, pack_vector(vector.tolist(), "float16"), coin, chunk_type] for (text, coin, chunk_type), vector in zip(tagged, matrix)
+    ])
+    standins = Standins(node, embedder, StubCoinGecko(load_stub_coins(args.data), args.coingecko_latency))
+    truth = GroundTruth([text for text, _, _ in tagged], matrix, embedder, dimensions, args.k)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Ingestion leaves the full-precision embeddings of the stored texts in the cache
+        cache = EmbeddingCache(path=os.path.join(directory, "embeddings.sqlite3"))
+        cache.put_many(embedding_cache_key(), [(text, vector.tolist()) for (text, _, _), vector in zip(tagged, matrix)])
+        cache.close()
+
+        server = ApiServer(standins, directory, args.answer_cache)
+        try:
+            await server.wait_ready()
+            limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+            async with httpx.AsyncClient(base_url=server.url, limits=limits, timeout=args.timeout) as client:
+                rows = []
+                offset = 0
+                for endpoint in args.endpoints:
+                    # Opens connections and fills the caches that are warm in a running API
+                    await replay(client, endpoint, workload(questions, args.warmup, args.unique, offset), 1, args.k)
+                    offset += args.warmup
+                    for concurrency in args.concurrency:
+                        replayed = workload(questions, args.requests, args.unique, offset)
+                        offset += args.requests
+                        wall, samples = await replay(client, endpoint, replayed, concurrency, args.k)
+                        rows.append(summarize(endpoint, concurrency, wall, samples, truth if endpoint == "search" else None))
+                        print_row(rows[-1], args.k)
+                if any(failed(row) for row in rows):
+                    print(f"\nEnd of the API log:\n{server.log_tail()}")
+                return rows
+        finally:
+            server.close()
+            standins.close()
+
+
+def failed(row: Dict[str, Any]) -> bool:
+    """Whether every request of the run failed."""
+    return row["requests"] > 0 and row["errors"] == row["requests"]
+
+
+def print_row(row: Dict[str, Any], k: int):
+    recall = f", recall@{k} {row['recall']:.3f}" if row["recall"] is not None else ""
+    print(
+        f"\n{row['endpoint']} at concurrency {row['concurrency']}: {row['requests']} requests, {row['errors']} failed, "
+        f"{row['degraded']} degraded, {row['throughput']:.1f} req/s{recall}"
+    )
+    if row["stages"]:
+        print(f"  {'stage':<20} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, latency in row["stages"].items():
+        print(f"  {stage:<20} {latency['p50_ms']:>9.1f} {latency['p95_ms']:>9.1f} {latency['p99_ms']:>9.1f}")
+    for error, count in row["error_counts"].items():
+        print(f"  {count} failed with {error}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the API end to end against local stand-ins")
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH, help="Path to data.yaml")
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent requests, one run each")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per run")
+    parser.add_argument("--warmup", type=int, default=10, help="Requests sent before the runs of an endpoint")
+    parser.add_argument("--k", type=int, default=5, help="Results per search, context size of a conversation")
+    parser.add_argument("--size", type=int, default=5000, help="Vectors stored in the node")
+    parser.add_argument("--noise", type=float, default=1.0, help="Norm of the perturbation of the copied vectors")
+    parser.add_argument("--unique", action="store_true", help="Make every question distinct, so none is answered from a cache")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the answer cache of the API enabled")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds every embeddings request takes")
+    parser.add_argument("--completion-latency", type=float, default=0.5, help="Seconds every chat completion takes")
+    parser.add_argument("--coingecko-latency", type=float, default=0.1, help="Seconds every CoinGecko request takes")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds before a request counts as failed")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    rows = asyncio.run(benchmark(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(rows, file, indent=2)
+    if any(failed(row) for row in rows):
+        sys.exit(1)
@@ -0,0 +1,89 @@
+"""
+Process wide, cached resolution of the vector blockchain RID.
+
+The RID is taken from the `VECTOR_BRID` environment variable exported by
+`start_vector_db.sh`, or looked up in the directory chain once. It is only
+looked up again when the node reports the chain as unknown, and concurrent
+callers share a single in-flight lookup.
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from app.chromia_client import (
+    ChromiaNodeClient,
+    ChromiaNodeError,
+    VECTOR_BLOCKCHAIN_NAME,
+    get_node_client,
+)
+
+T = TypeVar("T")
+
+
+class BlockchainRidNotFound(Exception):
+    pass
+
+
+class BlockchainRidResolver:
+
+    def __init__(
+        self,
+        client: ChromiaNodeClient,
+        name: str = VECTOR_BLOCKCHAIN_NAME,
+        env_var: str = "VECTOR_BRID",
+    ):
+        self.client = client
+        self.name = name
+        self._brid: Optional[str] = os.environ.get(env_var) or None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    @property
+    def cached(self) -> Optional[str]:
+        return self._brid
+
+    async def get(self) -> str:
+        """Cached RID, waiting for the lookup if none has completed yet."""
+        if self._brid is not None:
+            return self._brid
+        return await self.refresh()
+
+    def refresh(self) -> "asyncio.Future[str]":
+        """Start a lookup unless one is already running; all callers await the same one."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._lookup())
+        return asyncio.shield(self._refresh_task)
+
+    async def _lookup(self) -> str:
+        brid = await self.client.get_blockchain_rid(self.name)
+        if not brid:
+            raise BlockchainRidNotFound(f"Could not find blockchain '{self.name}'")
+        self._brid = brid
+        return brid
+
+    async def run(self, call: Callable[[str], Awaitable[T]]) -> T:
+        """
+        Run `call(brid)`, re-resolving the RID and retrying once if the node
+        does not know the chain (e.g. the dapp was redeployed).
+        """
+        brid = await self.get()
+        try:
+            return await call(brid)
+        except ChromiaNodeError as e:
+            if not e.unknown_chain:
+                raise
+            # Another caller may already have replaced the stale RID
+            new_brid = await (self.refresh() if self._brid == brid else self.get())
+            if new_brid == brid:
+                raise
+            return await call(new_brid)
+
+
+_default_resolver: Optional[BlockchainRidResolver] = None
+
+
+def get_rid_resolver() -> BlockchainRidResolver:
+    """Process wide resolver on top of the shared node client."""
+    global _default_resolver
+    if _default_resolver is None:
+        _default_resolver = BlockchainRidResolver(get_node_client())
+    return _default_resolver
@@ -0,0 +1,140 @@
+"""
+Base of the in-process mirrors of the `message` texts of the vector database.
+
+A mirror is warmed from the chain by paging through the extension's
+`get_vectors` query with a query template that maps the vectors to their
+messages (or through another paged query, see `_fetch_page`), and kept fresh by tailing the ids above the last one seen.
+Deletions are picked up by a periodic full resync. Local writes mark the
+mirror dirty, which wakes up the tailing task at once. Ids only mean
+something on one chain: when the RID resolver moves to another chain, the
+mirror is stale and the next sync is a full one.
+
+Subclasses load the synced rows into their own structures.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from app.blockchain_rid import BlockchainRidResolver
+from app.chromia_client import ChromiaNodeClient
+
+
+class ChainMirror:
+
+    # The query template mapping a page of vectors to rows with at least `id` and `text`
+    query_template: Dict[str, Any] = {"type": "get_messages_with_ids"}
+    name = "chain mirror"
+
+    def __init__(
+        self,
+        node_client: ChromiaNodeClient,
+        rid_resolver: BlockchainRidResolver,
+        env_prefix: str,
+        context: int = 0,
+        refresh_interval: Optional[float] = None,
+        max_staleness: Optional[float] = None,
+        full_sync_interval: Optional[float] = None,
+        page_size: int = 1000,
+    ):
+        self.node_client = node_client
+        self.rid_resolver = rid_resolver
+        self.context = context
+        self.refresh_interval = refresh_interval if refresh_interval is not None else float(os.environ.get(f"{env_prefix}_REFRESH_S", "2"))
+        self.max_staleness = max_staleness if max_staleness is not None else float(os.environ.get(f"{env_prefix}_MAX_STALENESS_S", "10"))
+        self.full_sync_interval = full_sync_interval if full_sync_interval is not None else float(os.environ.get(f"{env_prefix}_FULL_SYNC_S", "300"))
+        self.page_size = page_size
+
+        self._last_id = -1
+        # The chain of the synced rows
+        self._brid: Optional[str] = None
+        self._synced_at: Optional[float] = None
+        self._dirty = False
+        self._sync_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def fresh(self) -> bool:
+        return (
+            self._synced_at is not None
+            and not self._dirty
+            and self._brid == self.rid_resolver.cached
+            and time.monotonic() - self._synced_at <= self.max_staleness
+        )
+
+    async def start(self):
+        """Warm the mirror from the chain and start tailing new messages."""
+        try:
+            await self.sync(full=True)
+        except Exception as e:
+            # Searches fall back to the node until the tailing task has synced
+            print(f"Could not warm the {self.name}: {str(e)}")
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._tail())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def mark_dirty(self):
+        """Called after a local write, the mirror is stale until the write has been synced."""
+        self._dirty = True
+        self._wakeup.set()
+
+    async def sync(self, full: bool = False):
+        async with self._sync_lock:
+            self._dirty = False
+            try:
+                await self._sync(full)
+            except BaseException:
+                self._dirty = True
+                raise
+
+    async def _sync(self, full: bool):
+        brid = await self.rid_resolver.get()
+        if brid != self._brid:
+            full = True
+        after_id = -1 if full else self._last_id
+        rows: List[Dict[str, Any]] = []
+        while True:
+            page = await self.rid_resolver.run(lambda brid: self._fetch_page(brid, after_id))
+            # A vector without a message can not be returned by the node either
+            rows.extend(row for row in page if row["text"] is not None)
+            if page:
+                after_id = page[-1]["id"]
+            if len(page) < self.page_size:
+                break
+        if self.rid_resolver.cached != brid:
+            # The resolver moved to another chain while paging, the rows may come from both
+            return await self._sync(True)
+
+        self._load(rows, full)
+        self._brid = brid
+        self._last_id = after_id
+        self._synced_at = time.monotonic()
+
+    async def _fetch_page(self, brid: str, after_id: int) -> List[Dict[str, Any]]:
+        """The rows of the vectors above `after_id`, mapped by the query template."""
+        return await self.node_client.get_vectors(brid, after_id, self.page_size, self.context, self.query_template)
+
+    def _load(self, rows: List[Dict[str, Any]], full: bool):
+        """Replace the contents with the rows (full) or append them."""
+        raise NotImplementedError
+
+    async def _tail(self):
+        last_full_sync = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            full = time.monotonic() - last_full_sync >= self.full_sync_interval
+            try:
+                await self.sync(full)
+                if full:
+                    last_full_sync = time.monotonic()
+            except Exception as e:
+                print(f"Error syncing the {self.name}: {str(e)}")
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Async client for the Chromia node REST API.
+
+Talks to the node directly over HTTP instead of spawning the `chr`/`pmc` CLIs.
+Queries and transactions are sent as GTV/GTX payloads over a single pooled
+aiohttp session, so connections are kept alive across requests.
+"""
+import aiohttp
+import asyncio
+import os
+import secrets
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from app import gtv
+
+DEFAULT_NODE_URL = "http://localhost:7740"
+VECTOR_BLOCKCHAIN_NAME = "vector_blockchain"
+
+GTV_CONTENT_TYPE = "application/octet-stream"
+
+TX_STATUS_CONFIRMED = "confirmed"
+TX_STATUS_REJECTED = "rejected"
+TX_STATUS_UNKNOWN = "unknown"
+TX_STATUS_WAITING = "waiting"
+
+Operation = Tuple[str, Sequence[Any]]
+# A vector as text ("[0.1,0.2,...]") or packed little-endian floats, see app.vectors
+Vector = Union[str, bytes]
+# (text, vector, coin, chunk type) of `add_tagged_messages`
+TaggedMessage = Tuple[str, Vector, str, str]
+
+# The context every message of the vector_example dapp is stored in, CONTEXT_MESSAGE in its module.rell
+CONTEXT_MESSAGE = 0
+
+
+class ChromiaNodeError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def unknown_chain(self) -> bool:
+        """True if the node does not run the addressed blockchain."""
+        return self.status == 404 or "Can't find blockchain" in str(self)
+
+
+class ChromiaNodeClient:
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        pool_size: int = 100,
+        timeout: float = 30.0,
+        poll_interval: float = 0.25,
+    ):
+        self.base_url = (base_url or os.environ.get("CHROMIA_NODE_URL", DEFAULT_NODE_URL)).rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def start(self) -> aiohttp.ClientSession:
+        return self.session
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Shared session, created on first use so the connection pool survives across requests."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _post_gtv(self, path: str, payload: Any) -> bytes:
+        url = f"{self.base_url}/{path}"
+        async with self.session.post(
+            url, data=gtv.encode(payload), headers={"Content-Type": GTV_CONTENT_TYPE, "Accept": GTV_CONTENT_TYPE}
+        ) as response:
+            body = await response.read()
+            if response.status != 200:
+                raise _node_error(url, response.status, body)
+            return body
+
+    async def query(
+        self,
+        brid: str,
+        name: str,
+        args: Optional[Dict[str, Any]] = None,
+        decoder: Callable[[bytes], Any] = gtv.decode,
+    ) -> Any:
+        """Run a query against the blockchain and return the result decoded by `decoder`."""
+        body = await self._post_gtv(f"query_gtv/{brid}", [name, args or {}])
+        return decoder(body)
+
+    def build_transaction(self, brid: str, operations: List[Operation]) -> Tuple[bytes, bytes]:
+        """
+        Build an unsigned GTX transaction, returning (tx_rid, encoded_tx).
+
+        A `nop` operation with a random nonce is appended so that identical
+        operations still produce unique transactions.
+        """
+        ops = [[name, list(args)] for name, args in operations]
+        ops.append(["nop", [secrets.token_hex(16)]])
+        body = [bytes.fromhex(brid), ops, []]
+        return gtv.merkle_hash(body), gtv.encode([body, []])
+
+    async def send_transaction(self, brid: str, operations: List[Operation]) -> str:
+        """Submit a transaction without waiting for it; returns the tx RID as hex."""
+        tx_rid, tx = self.build_transaction(brid, operations)
+        url = f"{self.base_url}/tx/{brid}"
+        async with self.session.post(url, data=tx, headers={"Content-Type": GTV_CONTENT_TYPE}) as response:
+            if response.status != 200:
+                body = await response.read()
+                raise _node_error(url, response.status, body)
+        return tx_rid.hex()
+
+    async def get_transaction_status(self, brid: str, tx_rid: str) -> Dict[str, Any]:
+        url = f"{self.base_url}/tx/{brid}/{tx_rid}/status"
+        async with self.session.get(url) as response:
+            if response.status != 200:
+                body = await response.read()
+                raise _node_error(url, response.status, body)
+            return await response.json(content_type=None)
+
+    async def wait_for_transaction(self, brid: str, tx_rid: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Poll the transaction status until it is confirmed, rejected or the timeout expires."""
+        deadline = asyncio.get_running_loop().time() + (timeout or self.timeout)
+        while True:
+            status = await self.get_transaction_status(brid, tx_rid)
+            if status.get("status") in (TX_STATUS_CONFIRMED, TX_STATUS_REJECTED):
+                return status
+            if asyncio.get_running_loop().time() >= deadline:
+                return status
+            await asyncio.sleep(self.poll_interval)
+
+    async def send_transaction_and_wait(self, brid: str, operations: List[Operation]) -> Dict[str, Any]:
+        tx_rid = await self.send_transaction(brid, operations)
+        status = await self.wait_for_transaction(brid, tx_rid)
+        status["tx_rid"] = tx_rid
+        return status
+
+    async def add_message(self, brid: str, text: str, vector: Vector) -> Dict[str, Any]:
+        """Store a text and its vector with `add_message`, or `add_message_binary` for a packed vector."""
+        operation = "add_message_binary" if isinstance(vector, bytes) else "add_message"
+        return await self.send_transaction_and_wait(brid, [(operation, [text, vector])])
+
+    async def add_messages(self, brid: str, messages: List[Tuple[str, Vector]]) -> Dict[str, Any]:
+        """Store several texts and vectors in one transaction with `add_messages(_binary)`."""
+        return await self.send_transaction_and_wait(brid, [add_messages_operation(messages)])
+
+    async def add_tagged_messages(self, brid: str, messages: List[TaggedMessage]) -> Dict[str, Any]:
+        """
+        Store texts and vectors tagged with their coin and chunk type with `add_tagged_messages(_binary)`. The
+        vectors are also stored in the context of their coin, see `get_coin_context`.
+        """
+        return await self.send_transaction_and_wait(brid, [add_tagged_messages_operation(messages)])
+
+    async def get_coin_context(self, brid: str, coin: str) -> Optional[int]:
+        """Context of the vectors tagged with a coin, None if no message about the coin was tagged."""
+        return await self.query(brid, "get_coin_context", {"coin": coin})
+
+    async def query_closest_objects(
+        self,
+        brid: str,
+        vector: Vector,
+        max_results: int,
+        max_distance: float = 1.0,
+        context: int = CONTEXT_MESSAGE,
+        query_template: Optional[Dict[str, Any]] = None,
+        decoder: Callable[[bytes], Any] = gtv.decode,
+    ) -> Any:
+        args = {
+            "context": context,
+            "q_vector": vector,
+            "max_distance": str(max_distance),
+            "max_vectors": max_results,
+        }
+        if query_template is not None:
+            args["query_template"] = query_template
+        return await self.query(brid, "query_closest_objects", args, decoder)
+
+    async def get_vectors(
+        self,
+        brid: str,
+        after_id: int = -1,
+        max_vectors: int = 1000,
+        context: int = CONTEXT_MESSAGE,
+        query_template: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """Page through the stored vectors of a context in id order, as little-endian float32 bytes."""
+        args = {"context": context, "after_id": after_id, "max_vectors": max_vectors}
+        if query_template is not None:
+            args["query_template"] = query_template
+        return await self.query(brid, "get_vectors", args)
+
+    async def get_message_texts(self, brid: str, after_id: int = -1, max_messages: int = 1000) -> List[Dict[str, Any]]:
+        """Page through the messages in id order as `{id, text, coin, chunk_type}`, without reading any vectors."""
+        return await self.query(brid, "get_message_texts", {"after_id": after_id, "max_messages": max_messages})
+
+    async def get_chain_rid(self, iid: int) -> str:
+        """Blockchain RID of the chain with the given IID on this node, e.g. 0 for the directory chain."""
+        url = f"{self.base_url}/brid/iid_{iid}"
+        async with self.session.get(url) as response:
+            body = await response.read()
+            if response.status != 200:
+                raise _node_error(url, response.status, body)
+            return body.decode().strip()
+
+    async def get_blockchain_rid(self, name: str = VECTOR_BLOCKCHAIN_NAME) -> Optional[str]:
+        """Look up a blockchain RID by name in the directory chain, like `pmc blockchains`."""
+        directory_brid = await self.get_chain_rid(0)
+        blockchains = await self.query(directory_brid, "get_blockchains", {"include_inactive": False})
+        for blockchain in blockchains:
+            if blockchain.get("name") == name:
+                rid = blockchain.get("rid")
+                return rid.hex().upper() if isinstance(rid, bytes) else str(rid).upper()
+        return None
+
+
+def _binary_operation(name: str, messages: Sequence[Sequence[Any]]) -> str:
+    binary = [isinstance(message[1], bytes) for message in messages]
+    if any(binary) and not all(binary):
+        raise ValueError(f"Cannot mix text and binary vectors in one {name} operation")
+    return f"{name}_binary" if all(binary) and messages else name
+
+
+def add_messages_operation(messages: List[Tuple[str, Vector]]) -> Operation:
+    return _binary_operation("add_messages", messages), [[[text, vector] for text, vector in messages]]
+
+
+def add_tagged_messages_operation(messages: List[TaggedMessage]) -> Operation:
+    return _binary_operation("add_tagged_messages", messages), [[list(message) for message in messages]]
+
+
+def _node_error(url: str, status: int, body: bytes) -> ChromiaNodeError:
+    try:
+        message = str(gtv.decode(body))
+    except gtv.GtvError:
+        message = body.decode(errors="replace")
+    return ChromiaNodeError(f"Node error ({status}) for {url}: {message}", status)
+
+
+_default_client: Optional[ChromiaNodeClient] = None
+
+
+def get_node_client() -> ChromiaNodeClient:
+    """Process wide client so all handlers share one connection pool."""
+    global _default_client
+    if _default_client is None:
+        _default_client = ChromiaNodeClient()
+    return _default_client
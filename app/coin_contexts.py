@@ -0,0 +1,75 @@
+"""
+Vector contexts of coins, for searches limited to the messages about one coin.
+
+Messages stored with `add_tagged_messages` have their vector stored a second
+time in a context of their coin, so `query_closest_objects` in that context
+only looks at the vectors of the coin instead of filtering the results of a
+search over all of them. The context of a coin never changes once created
+and is cached for as long as the RID of the chain stays the same; contexts
+are row ids of the chain, so they are all looked up again when the resolver
+moves to another chain. A coin without one is looked up again after
+`COIN_CONTEXT_MISS_TTL_S`, it gets one when a message about it is ingested.
+"""
+import os
+import time
+from typing import Dict, Optional
+
+from app.blockchain_rid import BlockchainRidResolver, get_rid_resolver
+from app.chromia_client import ChromiaNodeClient, get_node_client
+
+
+class CoinContexts:
+
+    def __init__(
+        self,
+        node_client: ChromiaNodeClient,
+        rid_resolver: BlockchainRidResolver,
+        miss_ttl: Optional[float] = None,
+    ):
+        self.node_client = node_client
+        self.rid_resolver = rid_resolver
+        self.miss_ttl = miss_ttl if miss_ttl is not None else float(os.environ.get("COIN_CONTEXT_MISS_TTL_S", "60"))
+        self._contexts: Dict[str, int] = {}
+        self._missed_at: Dict[str, float] = {}
+        # The chain the cached contexts belong to
+        self._brid: Optional[str] = None
+
+    async def get(self, coin: str) -> Optional[int]:
+        """The context of the coin's vectors, None if no message about the coin is tagged."""
+        key = coin.lower()
+        brid = await self.rid_resolver.get()
+        if brid != self._brid:
+            self._contexts.clear()
+            self._missed_at.clear()
+            self._brid = brid
+        if key in self._contexts:
+            return self._contexts[key]
+        missed_at = self._missed_at.get(key)
+        if missed_at is not None and time.monotonic() - missed_at < self.miss_ttl:
+            return None
+
+        try:
+            context = await self.rid_resolver.run(lambda brid: self.node_client.get_coin_context(brid, key))
+        except Exception as e:
+            # E.g. a dapp deployed before messages were tagged
+            print(f"Could not look up the context of {coin}: {str(e)}")
+            context = None
+        if self.rid_resolver.cached != brid:
+            # The resolver moved to another chain meanwhile, the next call clears the cache for it
+            return context
+        if context is None:
+            self._missed_at[key] = time.monotonic()
+        else:
+            self._contexts[key] = context
+            self._missed_at.pop(key, None)
+        return context
+
+
+_coin_contexts: Optional[CoinContexts] = None
+
+
+def get_coin_contexts() -> CoinContexts:
+    global _coin_contexts
+    if _coin_contexts is None:
+        _coin_contexts = CoinContexts(get_node_client(), get_rid_resolver())
+    return _coin_contexts
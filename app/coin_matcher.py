@@ -0,0 +1,288 @@
+"""
+Local detection of the coins mentioned in a question.
+
+An Aho-Corasick automaton finds all known coin names and symbols in one pass
+over the text, so most questions need no model call to find their coin. The
+automaton is built from
+
+- the coins of `data.yaml` (the knowledge base) and their symbols,
+- a curated table of common symbols,
+- the names and symbols of the top ranked coins of the CoinGecko registry.
+
+Curated names and symbols match in any case ("btc price"), except the
+curated symbols that are also ordinary words ("near", "link", "dot"). Those,
+registry names and registry symbols only match when written like a coin:
+registry names capitalized, symbols in upper case (optionally with a `$`
+prefix), because many of them are ordinary words ("near", "link", "Just").
+
+Coins of the knowledge base and the curated tables come before registry
+coins. A capitalized registry name is still often just a word: at the start
+of a sentence, or when the name is a single word ("Core features of
+Bitcoin?", "Gas fees on Ethereum are high, why?", "Status of the Ethereum
+merge?"). Such names are not taken as coins but listed in `words`, and the
+model decides.
+
+The text is ambiguous, and the caller falls back to the model, when a matched
+symbol belongs to several ranked coins, when a registry name may be a word,
+or when nothing matched but the text contains unknown upper case tokens, `$`
+tickers or curated word symbols in lower case that may be coins. Only a text
+without anything coin-like gets the default coin.
+"""
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import yaml
+
+from app.coin_registry import CoinRegistry
+
+DEFAULT_DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data.yaml")
+
+# Used when a question mentions no coin, as the knowledge base is about Chromia
+DEFAULT_COIN = "Chromia"
+
+# Common symbols, mapped to names CoinGecko resolves
+SYMBOL_TO_NAME = {
+    "BTC": "Bitcoin",
+    "ETH": "Ethereum",
+    "SOL": "Solana",
+    "CHR": "Chromia",
+    "NEAR": "NEAR Protocol",
+    "DOT": "Polkadot",
+    "ADA": "Cardano",
+    "XRP": "XRP",
+    "DOGE": "Dogecoin",
+    "SHIB": "Shiba Inu",
+    "AVAX": "Avalanche",
+    "TON": "Toncoin",
+    "MATIC": "Polygon",
+    "LINK": "Chainlink",
+    "UNI": "Uniswap",
+    "BCH": "Bitcoin Cash",
+    "LTC": "Litecoin",
+    "XLM": "Stellar",
+    "XMR": "Monero",
+}
+
+# Curated symbols that are also ordinary words, only taken for coins in upper case
+WORD_SYMBOLS = {"NEAR", "LINK", "DOT", "UNI", "TON"}
+
+# Other names of curated coins
+NAME_ALIASES = {
+    "ether": "Ethereum",
+    "ripple": "XRP",
+}
+
+# Upper case tokens that are not coins, so they do not make a question ambiguous
+_NON_COIN_TOKENS = {
+    "I", "A", "AI", "API", "USD", "EUR", "US", "UK", "EU", "CEO", "NFT", "NFTS", "DEFI", "DAO", "DEX", "CEX",
+    "ICO", "IPO", "ETF", "TVL", "APY", "APR", "ATH", "ATL", "KYC", "AML", "SEC", "FUD", "FOMO", "HODL",
+    "POW", "POS", "L1", "L2", "WHAT", "WHY", "HOW", "WHO", "IS", "THE", "OK",
+}
+
+_SENTENCE_START = re.compile(r"(^|[.!?:;])[\s\"'(\[]*$")
+_CANDIDATE_TOKEN = re.compile(r"\$[A-Za-z][A-Za-z0-9]{1,9}\b|\b[A-Z][A-Z0-9]{1,9}\b")
+_SYMBOL_IN_HISTORY = re.compile(r"\s*.+?\s*\(([A-Za-z0-9]+)\)")
+
+
+@dataclass(frozen=True)
+class _Pattern:
+    name: str
+    # "any": any case, "capitalized": first letter upper case, "upper": all upper case,
+    # "word": all upper case, in other cases the text may or may not be about the coin
+    case: str
+    # Other coins with the same symbol, for ambiguity detection
+    alternatives: Tuple[str, ...] = ()
+    # From the CoinGecko registry rather than the knowledge base or the curated tables
+    registry: bool = False
+
+
+class AhoCorasick:
+    """Multi-pattern matcher over lowercased text, reporting whole-word matches only."""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, object]]] = [[]]
+
+    def add(self, pattern: str, value: object):
+        state = 0
+        for char in pattern.lower():
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((len(pattern), value))
+
+    def build(self):
+        """Compute the failure links, breadth first; call after adding all patterns."""
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, object]]:
+        """(start, end, value) of every pattern occurring in text as a whole word."""
+        lowered = text.lower()
+        state = 0
+        for position, char in enumerate(lowered):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, value in self._output[state]:
+                start, end = position + 1 - length, position + 1
+                if _word_boundary(lowered, start - 1) and _word_boundary(lowered, end):
+                    yield start, end, value
+
+
+def _word_boundary(text: str, index: int) -> bool:
+    return index < 0 or index >= len(text) or not (text[index].isalnum() or text[index] == "_")
+
+
+@dataclass
+class CoinMatch:
+    coins: List[str] = field(default_factory=list)
+    # A matched symbol belongs to several coins, or unknown tokens may be coins
+    unclear: bool = False
+    # Registry names that may be ordinary words ("Core", "Gas"), not in `coins`
+    words: List[str] = field(default_factory=list)
+    # No coin was found in the text and `coins` is the default coin
+    default: bool = False
+
+    @property
+    def ambiguous(self) -> bool:
+        """Whether the model should decide which coins the text is about."""
+        return self.unclear or bool(self.words)
+
+
+class CoinMatcher:
+
+    def __init__(self, registry: Optional[CoinRegistry] = None, data_path: Optional[str] = None, max_rank: Optional[int] = None):
+        self.registry = registry
+        self.data_path = data_path or os.environ.get("COIN_DATA_PATH", DEFAULT_DATA_PATH)
+        self.max_rank = max_rank if max_rank is not None else int(os.environ.get("COIN_MATCHER_MAX_RANK", "500"))
+        self._automaton: Optional[AhoCorasick] = None
+        self._built_for: Optional[float] = None
+
+    def _curated(self) -> Dict[str, _Pattern]:
+        """Lowercased pattern -> pattern of the knowledge base coins and the curated tables."""
+        names = {name: name for name in SYMBOL_TO_NAME.values()}
+        names.update(NAME_ALIASES)
+        symbols = dict(SYMBOL_TO_NAME)
+        try:
+            with open(self.data_path, "r") as file:
+                data = yaml.safe_load(file) or {}
+        except FileNotFoundError:
+            data = {}
+        for coin in data.get("cryptocurrencies", []):
+            name = coin.get("name")
+            if not name:
+                continue
+            names[name] = name
+            # Histories start like "Bitcoin (BTC) emerged in 2008..."
+            symbol = _SYMBOL_IN_HISTORY.match(coin.get("history") or "")
+            if symbol:
+                symbols[symbol.group(1).upper()] = name
+
+        # Some symbols are ordinary words ("near", "link", "dot"), names are not
+        patterns = {
+            symbol.lower(): _Pattern(name, "word" if symbol in WORD_SYMBOLS else "any") for symbol, name in symbols.items()
+        }
+        patterns.update({alias.lower(): _Pattern(name, "any") for alias, name in names.items()})
+        return patterns
+
+    def _build(self) -> AhoCorasick:
+        automaton = AhoCorasick()
+        curated = self._curated()
+        covered = set(curated)
+        for pattern, value in curated.items():
+            automaton.add(pattern, value)
+
+        if self.registry is not None:
+            ranked = self.registry.ranked(self.max_rank)
+            by_symbol: Dict[str, List[str]] = {}
+            for coin in ranked:
+                by_symbol.setdefault(coin["symbol"].lower(), []).append(coin["name"])
+            for coin in ranked:
+                name = coin["name"]
+                if name.lower() not in covered:
+                    covered.add(name.lower())
+                    automaton.add(name, _Pattern(name, "capitalized", registry=True))
+            for symbol, names in by_symbol.items():
+                if symbol not in covered and len(symbol) >= 2:
+                    # Ranked best first, the others make the symbol ambiguous
+                    automaton.add(symbol, _Pattern(names[0], "upper", tuple(names[1:]), registry=True))
+        automaton.build()
+        return automaton
+
+    @property
+    def automaton(self) -> AhoCorasick:
+        loaded_at = self.registry.loaded_at if self.registry is not None else None
+        if self._automaton is None or loaded_at != self._built_for:
+            self._automaton = self._build()
+            self._built_for = loaded_at
+        return self._automaton
+
+    def match(self, text: str) -> CoinMatch:
+        result = CoinMatch()
+        # Longest match first where matches overlap, e.g. "Bitcoin Cash" over "Bitcoin"
+        matches = sorted(self.automaton.finditer(text), key=lambda match: (match[0], -(match[1] - match[0])))
+        covered_until = 0
+        maybe_coin = False
+        registry_coins: List[str] = []
+        for start, end, pattern in matches:
+            if start < covered_until:
+                continue
+            original = text[start:end]
+            if pattern.case == "word" and not original.isupper():
+                maybe_coin = True
+                continue
+            if pattern.case == "upper" and not original.isupper():
+                continue
+            if pattern.case == "capitalized" and not original[0].isupper():
+                continue
+            covered_until = end
+            if pattern.case == "capitalized" and (" " not in pattern.name or _SENTENCE_START.search(text[:start])):
+                if pattern.name not in result.words:
+                    result.words.append(pattern.name)
+                continue
+            if pattern.alternatives:
+                result.unclear = True
+            coins = registry_coins if pattern.registry else result.coins
+            if pattern.name not in coins:
+                coins.append(pattern.name)
+        # The knowledge base and curated coins first, callers take the first coin for market data
+        result.coins.extend(coin for coin in registry_coins if coin not in result.coins)
+
+        if not result.coins and not result.words:
+            # Unknown tickers or upper case words may be coins we do not know
+            candidates = [
+                token for token in _CANDIDATE_TOKEN.findall(text)
+                if token.lstrip("$").upper() not in _NON_COIN_TOKENS
+            ]
+            if candidates or maybe_coin:
+                result.unclear = True
+            else:
+                result.coins = [DEFAULT_COIN]
+                result.default = True
+        return result
+
+
+_coin_matcher: Optional[CoinMatcher] = None
+
+
+def get_coin_matcher(registry: Optional[CoinRegistry] = None) -> CoinMatcher:
+    global _coin_matcher
+    if _coin_matcher is None:
+        _coin_matcher = CoinMatcher(registry)
+    return _coin_matcher
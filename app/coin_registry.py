@@ -0,0 +1,156 @@
+"""
+Registry of the coins known to CoinGecko, to resolve names and symbols to coin ids.
+
+The `coins/list` payload (more than 15k coins) is downloaded once, indexed
+by lowercased id, name and symbol, and persisted to disk so a cold start can
+answer from the previous copy while a fresh one is downloaded in the
+background. Symbols (and some names) are shared by many coins; those resolve
+to the coin with the best market cap rank.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_REGISTRY_PATH = ".cache/coingecko_coins.json"
+
+# Loads (coins/list entries, {coin id: market cap rank})
+RegistryLoader = Callable[[], Awaitable[Tuple[List[Dict[str, Any]], Dict[str, int]]]]
+
+# Delay before retrying a failed background refresh
+_RETRY_DELAY = 300.0
+
+
+class CoinRegistry:
+
+    def __init__(
+        self,
+        loader: RegistryLoader,
+        path: Optional[str] = None,
+        refresh_interval: Optional[float] = None,
+    ):
+        self.loader = loader
+        self.path = path if path is not None else os.environ.get("COINGECKO_COIN_LIST_PATH", DEFAULT_REGISTRY_PATH)
+        self.refresh_interval = refresh_interval if refresh_interval is not None else float(os.environ.get("COINGECKO_COIN_LIST_REFRESH_S", "86400"))
+
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._by_name: Dict[str, List[str]] = {}
+        self._by_symbol: Dict[str, List[str]] = {}
+        self.loaded_at: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._background_task: Optional[asyncio.Task] = None
+
+        if self.path:
+            self._load_from_disk()
+
+    @property
+    def size(self) -> int:
+        return len(self._by_id)
+
+    @property
+    def stale(self) -> bool:
+        return self.loaded_at is None or time.time() - self.loaded_at > self.refresh_interval
+
+    async def resolve(self, name: str) -> Optional[str]:
+        """Coin id for a name, symbol or id (case insensitive), preferring name matches."""
+        if self.loaded_at is None:
+            await self.refresh()
+        key = name.strip().lower()
+        for index in (self._by_name, self._by_symbol):
+            ids = index.get(key)
+            if ids:
+                return ids[0]
+        return key if key in self._by_id else None
+
+    def get(self, coin_id: str) -> Optional[Dict[str, Any]]:
+        return self._by_id.get(coin_id)
+
+    def ranked(self, max_rank: int) -> List[Dict[str, Any]]:
+        """Coins with a market cap rank up to max_rank, best first."""
+        coins = []
+        # The index is ordered by rank, with the unranked coins last
+        for coin in self._by_id.values():
+            if coin["rank"] is None or coin["rank"] > max_rank:
+                break
+            coins.append(coin)
+        return coins
+
+    def refresh(self) -> "asyncio.Future[None]":
+        """Start a download unless one is already running; all callers await the same one."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+        return asyncio.shield(self._refresh_task)
+
+    async def _refresh(self):
+        coins, ranks = await self.loader()
+        self._index(
+            [
+                {"id": coin["id"], "symbol": coin.get("symbol", ""), "name": coin.get("name", ""), "rank": ranks.get(coin["id"])}
+                for coin in coins
+            ],
+            time.time(),
+        )
+        if self.path:
+            await asyncio.to_thread(self._save)
+
+    def start(self):
+        """Keep the registry fresh in the background."""
+        if self._background_task is None:
+            self._background_task = asyncio.ensure_future(self._refresh_periodically())
+
+    async def close(self):
+        if self._background_task is not None:
+            self._background_task.cancel()
+            self._background_task = None
+
+    async def _refresh_periodically(self):
+        while True:
+            if self.stale:
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    print(f"Error refreshing the CoinGecko coin list: {str(e)}")
+                    await asyncio.sleep(_RETRY_DELAY)
+                    continue
+            await asyncio.sleep(max(self.loaded_at + self.refresh_interval - time.time(), 1.0))
+
+    def _index(self, coins: List[Dict[str, Any]], loaded_at: float):
+        # Ranked coins first, by rank; unranked ones keep the order of the list
+        ordered = sorted(coins, key=lambda coin: coin["rank"] if coin["rank"] is not None else float("inf"))
+        by_id: Dict[str, Dict[str, Any]] = {}
+        by_name: Dict[str, List[str]] = {}
+        by_symbol: Dict[str, List[str]] = {}
+        for coin in ordered:
+            by_id[coin["id"].lower()] = coin
+            by_name.setdefault(coin["name"].lower(), []).append(coin["id"])
+            by_symbol.setdefault(coin["symbol"].lower(), []).append(coin["id"])
+        # Swapped in at once, lookups never see a partial index
+        self._by_id, self._by_name, self._by_symbol = by_id, by_name, by_symbol
+        self.loaded_at = loaded_at
+
+    def _load_from_disk(self):
+        try:
+            with open(self.path, "r") as file:
+                stored = json.load(file)
+            self._index(stored["coins"], stored["loaded_at"])
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable CoinGecko coin list {self.path}: {str(e)}")
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Written to a temporary file first, so a crash never leaves a truncated registry
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump({"loaded_at": self.loaded_at, "coins": list(self._by_id.values())}, file)
+        os.replace(temporary, self.path)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "coins": self.size,
+            "age_seconds": round(time.time() - self.loaded_at) if self.loaded_at is not None else None,
+        }
@@ -1,65 +1,118 @@
 #!/usr/bin/env python3
 import aiohttp
 import asyncio
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import json
-import time
+import random
 import os
 
+from app.coin_registry import CoinRegistry
+from app.market_cache import MarketDataCache
+from app.rate_limit import TokenBucket
+
 class CoinGeckoAPI:
 
     BASE_URL = "https://pro-api.coingecko.com/api/v3"
     
-    def __init__(self, api_key=None):
-        self.session = None
-        self.last_request_time = 0
-        self.rate_limit_delay = 1.5  # 1.5 seconds between requests for free API
+    def __init__(
+        self,
+        api_key=None,
+        requests_per_minute: Optional[float] = None,
+        burst: Optional[int] = None,
+        max_retries: int = 4,
+        retry_base_delay: float = 1.0,
+        pool_size: int = 20,
+        timeout: float = 30.0,
+        base_url: Optional[str] = None,
+    ):
+        # COINGECKO_BASE_URL points the client at another server, e.g. the stand-in of app.stub_apis
+        self.base_url = (base_url or os.environ.get("COINGECKO_BASE_URL", self.BASE_URL)).rstrip("/")
         self.api_key = api_key or os.environ.get("COINGECKO_API_KEY", "CG-ghyzjei74rKdPAv8m3WkedcY")
+        requests_per_minute = requests_per_minute or float(os.environ.get("COINGECKO_REQUESTS_PER_MINUTE", "30"))
+        burst = burst or int(os.environ.get("COINGECKO_BURST", "5"))
+        # Shared by every request made through this client
+        self.rate_limiter = TokenBucket(requests_per_minute / 60.0, burst)
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        # Prices change by the second, coin details rarely, charts somewhere in between
+        self.price_ttl = float(os.environ.get("COINGECKO_PRICE_TTL_S", "30"))
+        self.coin_ttl = float(os.environ.get("COINGECKO_COIN_TTL_S", "21600"))
+        self.chart_ttl = float(os.environ.get("COINGECKO_CHART_TTL_S", "600"))
+        self.cache = MarketDataCache(stale_factor=float(os.environ.get("COINGECKO_STALE_FACTOR", "10")))
     
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
+        await self.close()
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Pooled session, created on first use and kept for the lifetime of the client."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"x-cg-pro-api-key": self.api_key},
+            )
+        return self._session
     
+    def _retry_delay(self, attempt: int, retry_after: Optional[str]) -> float:
+        """Exponential backoff with full jitter, at least as long as a Retry-After header asks for."""
+        delay = random.uniform(0, self.retry_base_delay * 2 ** attempt)
+        try:
+            return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            return delay
+
     async def _make_request(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        url = f"{self.BASE_URL}/{endpoint}"
-        headers = {"x-cg-pro-api-key": self.api_key}
+        url = f"{self.base_url}/{endpoint}"
         
         try:
-            # Respect rate limiting
-            current_time = time.time()
-            time_since_last_request = current_time - self.last_request_time
-            if time_since_last_request < self.rate_limit_delay:
-                await asyncio.sleep(self.rate_limit_delay - time_since_last_request)
-            
-            self.last_request_time = time.time()
-            
-            async with self.session.get(url, params=params, headers=headers) as response:
-                if response.status == 200:
-                    return await response.json()
-                elif response.status == 429:
-                    raise Exception("Rate limit exceeded. Try again later.")
-                else:
-                    error_text = await response.text()
-                    raise Exception(f"API Error ({response.status}): {error_text}")
+            for attempt in range(self.max_retries + 1):
+                await self.rate_limiter.acquire()
+                async with self.session.get(url, params=params) as response:
+                    if response.status == 200:
+                        return await response.json()
+                    elif response.status == 429 and attempt < self.max_retries:
+                        # The backoff is taken from the shared bucket, so it slows down every request of this
+                        # client and the retry waits for it in acquire()
+                        self.rate_limiter.penalize(self._retry_delay(attempt, response.headers.get("Retry-After")))
+                    elif response.status == 429:
+                        raise Exception("Rate limit exceeded. Try again later.")
+                    else:
+                        error_text = await response.text()
+                        raise Exception(f"API Error ({response.status}): {error_text}")
         except Exception as e:
             raise Exception(f"Error making request to {url}: {str(e)}")
     
     async def get_coin_list(self) -> List[Dict[str, Any]]:
         return await self._make_request("coins/list")
     
+    async def get_coins_markets(self, page: int = 1, per_page: int = 250) -> List[Dict[str, Any]]:
+        return await self._make_request(
+            "coins/markets",
+            {"vs_currency": "usd", "order": "market_cap_desc", "per_page": str(per_page), "page": str(page)}
+        )
+
     async def get_coin_id(self, name: str) -> Optional[str]:
-        coins = await self.get_coin_list()
-        for coin in coins:
-            if coin["name"].lower() == name.lower() or coin["symbol"].lower() == name.lower():
-                return coin["id"]
-        return None
+        return await get_coin_registry().resolve(name)
     
+    async def _cached_request(self, endpoint: str, params: Dict[str, Any], ttl: float) -> Dict[str, Any]:
+        key = (endpoint, tuple(sorted(params.items())))
+        return await self.cache.get(key, lambda: self._make_request(endpoint, params), ttl)
+
     async def get_price(self, coin_id: str, vs_currencies: List[str] = ["usd"]) -> Dict[str, Any]:
-        return await self._make_request(
+        return await self._cached_request(
             "simple/price",
             {
                 "ids": coin_id,
@@ -68,61 +121,103 @@ class CoinGeckoAPI:
                 "include_24hr_vol": "true",
                 "include_24hr_change": "true",
                 "include_last_updated_at": "true"
-            }
+            },
+            self.price_ttl,
         )
     
     async def get_coin_data(self, coin_id: str) -> Dict[str, Any]:
-        return await self._make_request(f"coins/{coin_id}", {"localization": "false"})
+        return await self._cached_request(f"coins/{coin_id}", {"localization": "false"}, self.coin_ttl)
     
     async def get_coin_market_chart(self, coin_id: str, days: int = 30) -> Dict[str, Any]:
-        return await self._make_request(
+        return await self._cached_request(
             f"coins/{coin_id}/market_chart",
-            {"vs_currency": "usd", "days": str(days)}
+            {"vs_currency": "usd", "days": str(days)},
+            self.chart_ttl,
         )
 
+async def load_coin_registry() -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """The full coin list, with the market cap ranks of the top coins to resolve ambiguous symbols."""
+    ranked_pages = int(os.environ.get("COINGECKO_RANKED_PAGES", "4"))
+    api = get_coingecko_client()
+    coins, *pages = await asyncio.gather(
+        api.get_coin_list(),
+        *(api.get_coins_markets(page) for page in range(1, ranked_pages + 1)),
+        return_exceptions=True,
+    )
+    if isinstance(coins, Exception):
+        raise coins
+    ranks = {}
+    for page in pages:
+        if isinstance(page, Exception):
+            # Without ranks ambiguous symbols resolve in list order
+            print(f"Error fetching CoinGecko market cap ranks: {str(page)}")
+            continue
+        for coin in page:
+            if coin.get("market_cap_rank") is not None:
+                ranks[coin["id"]] = coin["market_cap_rank"]
+    return coins, ranks
+
+
+_coingecko_client: Optional[CoinGeckoAPI] = None
+_coin_registry: Optional[CoinRegistry] = None
+
+
+def get_coingecko_client() -> CoinGeckoAPI:
+    """Process wide client, so all requests share one connection pool and one rate limit."""
+    global _coingecko_client
+    if _coingecko_client is None:
+        _coingecko_client = CoinGeckoAPI()
+    return _coingecko_client
+
+
+def get_coin_registry() -> CoinRegistry:
+    global _coin_registry
+    if _coin_registry is None:
+        _coin_registry = CoinRegistry(load_coin_registry)
+    return _coin_registry
+
+
 async def get_coin_info(coin_name: str) -> Dict[str, Any]:
-    async with CoinGeckoAPI() as api:
-        try:
-            # Get the coin ID
-            coin_id = await api.get_coin_id(coin_name)
-            if not coin_id:
-                return {"error": f"Coin '{coin_name}' not found"}
-            
-            # Get current price data
-            price_data = await api.get_price(coin_id, ["usd", "btc", "eth"])
-            
-            # Get detailed coin information
-            coin_details = await api.get_coin_data(coin_id)
-            
-            # Get market chart data (last 30 days)
-            market_data = await api.get_coin_market_chart(coin_id, 30)
-            
-            # Format the response
-            result = {
-                "name": coin_details.get("name", coin_name),
-                "symbol": coin_details.get("symbol", "").upper(),
-                "current_price": price_data.get(coin_id, {}).get("usd", "Unknown"),
-                "market_cap": price_data.get(coin_id, {}).get("usd_market_cap", "Unknown"),
-                "price_change_24h": price_data.get(coin_id, {}).get("usd_24h_change", "Unknown"),
-                "current_btc_price": price_data.get(coin_id, {}).get("btc", "Unknown"),
-                "current_eth_price": price_data.get(coin_id, {}).get("eth", "Unknown"),
-                "market_rank": coin_details.get("market_cap_rank", "Unknown"),
-                "description": coin_details.get("description", {}).get("en", "No description available").replace("<a href=", "<a "),
-                "blockchain": coin_details.get("asset_platform_id", "Native"),
-                "genesis_date": coin_details.get("genesis_date", "Unknown"),
-                "homepage": coin_details.get("links", {}).get("homepage", [""])[0] if coin_details.get("links", {}).get("homepage") else "",
-                "github": coin_details.get("links", {}).get("repos_url", {}).get("github", []) if coin_details.get("links", {}).get("repos_url") else [],
-                "sentiment": coin_details.get("sentiment_votes_up_percentage", 0),
-                "last_updated": price_data.get(coin_id, {}).get("last_updated_at", 0),
-                "price_history": {
-                    "prices": market_data.get("prices", [])[-7:],  # Last 7 days of prices
-                    "last_updated": "Last 7 days (USD)"
-                }
+    api = get_coingecko_client()
+    try:
+        # Get the coin ID
+        coin_id = await api.get_coin_id(coin_name)
+        if not coin_id:
+            return {"error": f"Coin '{coin_name}' not found"}
+
+        # Current price, detailed coin information and market chart (last 30 days) are independent
+        price_data, coin_details, market_data = await asyncio.gather(
+            api.get_price(coin_id, ["usd", "btc", "eth"]),
+            api.get_coin_data(coin_id),
+            api.get_coin_market_chart(coin_id, 30),
+        )
+
+        # Format the response
+        result = {
+            "name": coin_details.get("name", coin_name),
+            "symbol": coin_details.get("symbol", "").upper(),
+            "current_price": price_data.get(coin_id, {}).get("usd", "Unknown"),
+            "market_cap": price_data.get(coin_id, {}).get("usd_market_cap", "Unknown"),
+            "price_change_24h": price_data.get(coin_id, {}).get("usd_24h_change", "Unknown"),
+            "current_btc_price": price_data.get(coin_id, {}).get("btc", "Unknown"),
+            "current_eth_price": price_data.get(coin_id, {}).get("eth", "Unknown"),
+            "market_rank": coin_details.get("market_cap_rank", "Unknown"),
+            "description": coin_details.get("description", {}).get("en", "No description available").replace("<a href=", "<a "),
+            "blockchain": coin_details.get("asset_platform_id", "Native"),
+            "genesis_date": coin_details.get("genesis_date", "Unknown"),
+            "homepage": coin_details.get("links", {}).get("homepage", [""])[0] if coin_details.get("links", {}).get("homepage") else "",
+            "github": coin_details.get("links", {}).get("repos_url", {}).get("github", []) if coin_details.get("links", {}).get("repos_url") else [],
+            "sentiment": coin_details.get("sentiment_votes_up_percentage", 0),
+            "last_updated": price_data.get(coin_id, {}).get("last_updated_at", 0),
+            "price_history": {
+                "prices": market_data.get("prices", [])[-7:],  # Last 7 days of prices
+                "last_updated": "Last 7 days (USD)"
             }
-            
-            return result
-        except Exception as e:
-            return {"error": f"Error fetching data: {str(e)}"}
+        }
+
+        return result
+    except Exception as e:
+        return {"error": f"Error fetching data: {str(e)}"}
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+"""
+Assembly of the retrieved texts that go into the answer prompt.
+
+The stored texts of a coin overlap heavily (its name, its full history and
+chunks of the same history), so the top results of a search are often
+near-duplicates. Results are taken in order of relevance and a result is
+dropped when most of its word shingles are already in the selected ones.
+The selection is then cut to a token budget, counted with tiktoken when it
+is installed and estimated from the word pieces of the text otherwise.
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional, Set
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Encoding of the gpt-4o model family
+TIKTOKEN_ENCODING = "o200k_base"
+
+SHINGLE_SIZE = 3
+
+_WORD = re.compile(r"\w+")
+# Words and punctuation, the units of the token estimate
+_PIECE = re.compile(r"\w+|[^\w\s]")
+
+# Results cut to fit the budget are dropped instead when less than this many tokens would remain
+_MIN_TRUNCATED_TOKENS = 32
+
+
+class Tokenizer:
+
+    def __init__(self, encoding: str = TIKTOKEN_ENCODING):
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.get_encoding(encoding)
+            except Exception as e:
+                # The encoding is downloaded on first use, which can fail offline
+                print(f"Estimating token counts, tiktoken encoding {encoding} is not available: {str(e)}")
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return sum(_estimate(piece) for piece in _PIECE.findall(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self._encoding is not None:
+            return self._encoding.decode(self._encoding.encode(text)[:max_tokens])
+        used = 0
+        for piece in _PIECE.finditer(text):
+            used += _estimate(piece.group())
+            if used > max_tokens:
+                return text[:piece.start()].rstrip()
+        return text
+
+
+def _estimate(piece: str) -> int:
+    # Common words and punctuation are one token, long words are split about every 8 characters
+    return 1 + (len(piece) - 1) // 8
+
+
+def _shingles(text: str) -> Set[str]:
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _normalized(text: str) -> str:
+    return " ".join(_WORD.findall(text.lower()))
+
+
+class ContextAssembler:
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        max_overlap: Optional[float] = None,
+        tokenizer: Optional[Tokenizer] = None,
+    ):
+        self.max_tokens = max_tokens if max_tokens is not None else int(os.environ.get("CONTEXT_MAX_TOKENS", "1500"))
+        self.max_overlap = max_overlap if max_overlap is not None else float(os.environ.get("CONTEXT_MAX_OVERLAP", "0.8"))
+        self.tokenizer = tokenizer or Tokenizer()
+
+    def deduplicate(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Results (closest first) that add enough text not already in the closer ones."""
+        selected: List[Dict[str, Any]] = []
+        selected_texts: List[str] = []
+        seen: Set[str] = set()
+        for result in results:
+            normalized = _normalized(result["text"])
+            # Short texts, e.g. a coin name, have few shingles but are redundant when contained in a selected text
+            if any(normalized in text for text in selected_texts):
+                continue
+            shingles = _shingles(result["text"])
+            if shingles and len(shingles & seen) / len(shingles) > self.max_overlap:
+                continue
+            selected.append(result)
+            selected_texts.append(normalized)
+            seen |= shingles
+        return selected
+
+    def fit(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The leading results that fit the token budget; the last one may be cut short."""
+        fitted = []
+        remaining = self.max_tokens
+        for result in results:
+            tokens = self.tokenizer.count(result["text"])
+            if tokens <= remaining:
+                fitted.append(result)
+                remaining -= tokens
+                continue
+            if remaining >= _MIN_TRUNCATED_TOKENS:
+                fitted.append({**result, "text": self.tokenizer.truncate(result["text"], remaining)})
+            break
+        return fitted
+
+    def assemble(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return self.fit(self.deduplicate(sorted(results, key=lambda result: result["distance"])))
+
+
+_context_assembler: Optional[ContextAssembler] = None
+
+
+def get_context_assembler() -> ContextAssembler:
+    global _context_assembler
+    if _context_assembler is None:
+        _context_assembler = ContextAssembler()
+    return _context_assembler
@@ -0,0 +1,333 @@
+"""
+SQLite persistence of embedded texts and conversations.
+
+The database is used through async SQLAlchemy on aiosqlite, in WAL mode so
+reads are not blocked by the writer. Writes do not happen in the request
+path: `store_embedding` and `store_conversation` put the rows on a
+write-behind queue, and a single background task commits whatever is queued
+in one transaction per batch, so requests never wait for an fsync and many
+rows share one.
+"""
+import asyncio
+import base64
+import os
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import JSON, DateTime, Float, ForeignKey, Index, Integer, String, Text, event, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+
+DEFAULT_DATABASE_URL = "sqlite+aiosqlite:///.cache/conversations.sqlite3"
+
+
+def _utcnow() -> datetime:
+    # SQLite stores naive datetimes; all of them are UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Embedding(Base):
+    __tablename__ = "embeddings"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    text: Mapped[str] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=_utcnow, index=True)
+
+
+class Conversation(Base):
+    __tablename__ = "conversations"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    embedding_id: Mapped[Optional[int]] = mapped_column(ForeignKey("embeddings.id"))
+    question: Mapped[str] = mapped_column(Text)
+    answer: Mapped[str] = mapped_column(Text)
+    related_answers: Mapped[List[Dict[str, Any]]] = mapped_column(JSON, default=list)
+    coin_symbol: Mapped[Optional[str]] = mapped_column(String(32), index=True)
+    coin_price: Mapped[Optional[float]] = mapped_column(Float)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=_utcnow, index=True)
+
+    embedding: Mapped[Optional[Embedding]] = relationship()
+
+    # History filtered by coin, in created_at order
+    __table_args__ = (Index("ix_conversations_coin_symbol_created_at", "coin_symbol", "created_at"),)
+
+
+class WriteBehindQueue:
+    """Commits queued ORM objects in batches from a background task."""
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        batch_size: Optional[int] = None,
+        max_delay: Optional[float] = None,
+        max_pending: Optional[int] = None,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size or int(os.environ.get("DATABASE_WRITE_BATCH_SIZE", "200"))
+        self.max_delay = max_delay if max_delay is not None else float(os.environ.get("DATABASE_WRITE_DELAY_S", "0.5"))
+        # Bounded, so a stalled disk slows requests down instead of growing memory
+        self._queue: asyncio.Queue = asyncio.Queue(
+            max_pending or int(os.environ.get("DATABASE_WRITE_MAX_PENDING", "10000"))
+        )
+        self._task: Optional[asyncio.Task] = None
+
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_batch_ms: Optional[float] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def put(self, obj: Base):
+        self.start()
+        await self._queue.put(obj)
+
+    async def flush(self):
+        """Wait until everything queued so far is committed."""
+        self.start()
+        # A future in the queue ends the batch being collected; it is resolved once that batch is written
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put(done)
+        await done
+
+    async def close(self):
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.batch_size and not isinstance(batch[-1], asyncio.Future):
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            objects = [item for item in batch if not isinstance(item, asyncio.Future)]
+            if objects:
+                await self._write(objects)
+            for item in batch:
+                if isinstance(item, asyncio.Future) and not item.done():
+                    item.set_result(None)
+
+    async def _write(self, objects: List[Base]):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            # Sessions do not expire on commit, so the objects stay usable afterwards, e.g. an
+            # embedding referenced by a conversation of a later batch
+            async with self.session_factory() as session:
+                session.add_all(objects)
+                await session.commit()
+            self.written += len(objects)
+            self.batches += 1
+        except Exception as e:
+            # The request that produced these rows is long gone; there is nobody to report to
+            self.errors += 1
+            print(f"Error writing {len(objects)} rows to the database: {str(e)}")
+        self.last_batch_ms = round((loop.time() - start) * 1000, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "errors": self.errors,
+            "last_batch_ms": self.last_batch_ms,
+        }
+
+
+_engine: Optional[AsyncEngine] = None
+_session_factory: Optional[async_sessionmaker] = None
+_write_queue: Optional[WriteBehindQueue] = None
+
+
+def get_engine() -> AsyncEngine:
+    global _engine
+    if _engine is None:
+        url = os.environ.get("DATABASE_URL", DEFAULT_DATABASE_URL)
+        _engine = create_async_engine(url)
+        if _engine.dialect.name == "sqlite":
+            event.listen(_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    return _engine
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # Readers do not block the writer and the writer does not block readers
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # In WAL mode, only checkpoints fsync; a crash can lose the last commits, never corrupt the database
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def get_session_factory() -> async_sessionmaker:
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = async_sessionmaker(get_engine(), expire_on_commit=False)
+    return _session_factory
+
+
+def get_write_queue() -> WriteBehindQueue:
+    global _write_queue
+    if _write_queue is None:
+        _write_queue = WriteBehindQueue(get_session_factory())
+    return _write_queue
+
+
+async def init_db():
+    engine = get_engine()
+    database = engine.url.database
+    if engine.dialect.name == "sqlite" and database and database != ":memory:":
+        directory = os.path.dirname(database)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        # create_all only indexes new tables; indexes added later are created on existing ones here
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                await connection.run_sync(index.create, checkfirst=True)
+    get_write_queue().start()
+
+
+async def close_db():
+    """Commit the queued writes and close the connections."""
+    global _engine, _session_factory, _write_queue
+    if _write_queue is not None:
+        await _write_queue.close()
+    if _engine is not None:
+        await _engine.dispose()
+    _engine, _session_factory, _write_queue = None, None, None
+
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    """Dependency with a session for reads."""
+    async with get_session_factory()() as session:
+        yield session
+
+
+async def store_embedding(text: str) -> Embedding:
+    embedding = Embedding(text=text, created_at=_utcnow())
+    await get_write_queue().put(embedding)
+    return embedding
+
+
+async def store_conversation(
+    question: str,
+    answer: str,
+    related_answers: List[Dict[str, Any]],
+    market_data: Optional[Dict[str, Any]] = None,
+    embedding: Optional[Embedding] = None,
+) -> Conversation:
+    conversation = Conversation(
+        embedding=embedding,
+        question=question,
+        answer=answer,
+        related_answers=related_answers,
+        coin_symbol=market_data.get("symbol") if market_data else None,
+        coin_price=market_data.get("current_price") if market_data else None,
+        created_at=_utcnow(),
+    )
+    await get_write_queue().put(conversation)
+    return conversation
+
+
+# Columns a history query can select; id and created_at are always selected, they are the cursor
+CONVERSATION_FIELDS = ("question", "answer", "related_answers", "coin_symbol", "coin_price", "embedding_id")
+
+# Position after a (created_at, id) of the newest first history
+Cursor = Tuple[datetime, int]
+
+
+def encode_cursor(created_at: datetime, conversation_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{conversation_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    try:
+        created_at, conversation_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split("|")
+        return datetime.fromisoformat(created_at), int(conversation_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _naive_utc(moment: datetime) -> datetime:
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _history_query(
+    fields: Sequence[str],
+    cursor: Optional[Cursor],
+    coin_symbol: Optional[str],
+    since: Optional[datetime],
+    until: Optional[datetime],
+):
+    table = Conversation.__table__
+    # Only the requested columns, as plain rows; large answers are not read unless asked for
+    query = select(*(table.c[name] for name in dict.fromkeys(("id", "created_at", *fields))))
+    if cursor is not None:
+        # Keyset pagination: a range scan of the created_at index from the cursor on, however deep the page
+        query = query.where(tuple_(table.c.created_at, table.c.id) < tuple_(*cursor))
+    if coin_symbol:
+        query = query.where(table.c.coin_symbol == coin_symbol.upper())
+    if since is not None:
+        query = query.where(table.c.created_at >= _naive_utc(since))
+    if until is not None:
+        query = query.where(table.c.created_at < _naive_utc(until))
+    return query.order_by(table.c.created_at.desc(), table.c.id.desc())
+
+
+async def get_conversations(
+    db: AsyncSession,
+    limit: int = 10,
+    cursor: Optional[Cursor] = None,
+    coin_symbol: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: Sequence[str] = CONVERSATION_FIELDS,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """A page of conversations, newest first, and the cursor of the next page if there is one."""
+    # Queued conversations are committed first, so a client sees the conversation it just had
+    await get_write_queue().flush()
+    result = await db.execute(_history_query(fields, cursor, coin_symbol, since, until).limit(limit + 1))
+    rows = [dict(row) for row in result.mappings()]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+
+
+async def stream_conversations(
+    db: AsyncSession,
+    cursor: Optional[Cursor] = None,
+    coin_symbol: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: Sequence[str] = CONVERSATION_FIELDS,
+    batch_size: int = 1000,
+) -> AsyncIterator[Dict[str, Any]]:
+    """All matching conversations, newest first, fetched `batch_size` rows at a time."""
+    await get_write_queue().flush()
+    query = _history_query(fields, cursor, coin_symbol, since, until).execution_options(yield_per=batch_size)
+    result = await db.stream(query)
+    async for row in result.mappings():
+        yield dict(row)
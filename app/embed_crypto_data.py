@@ -1,106 +1,54 @@
 #!/usr/bin/env python3
 import yaml
-import json
 import os
+import argparse
 import asyncio
-import subprocess
-from openai import OpenAI
 from dotenv import load_dotenv
+
+from app.chromia_client import get_node_client
+from app.blockchain_rid import get_rid_resolver
+from app.embeddings import EmbeddingBatcher
+from app.openai_client import create_openai_client
+from app.embedding_cache import get_embedding_cache
+from app.ingest import DEFAULT_CHECKPOINT_PATH, Checkpoint, Document, IngestionPipeline
 # Load environment variables
 load_dotenv()
 
-# Load OpenAI API key
-api_key = os.environ.get("OPENAI_API_KEY")
-if not api_key:
-    raise ValueError("OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.")
-
-client = OpenAI(api_key=api_key)
+DEFAULT_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data.yaml")
 
-async def get_blockchain_rid():
+async def get_blockchain_rid(rid_resolver):
     """Get the blockchain RID for the vector database."""
-    process = await asyncio.create_subprocess_shell(
-        "pmc blockchains | jq -r '.[] | select(.Name == \"vector_blockchain\") | .Rid'",
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        shell=True
-    )
-    stdout, stderr = await process.communicate()
-    
-    vector_brid = stdout.decode().strip()
-    if not vector_brid:
-        raise ValueError("Could not fetch blockchain RID. Make sure the blockchain is running.")
-    
-    return vector_brid
-
-def get_embedding(text):
-    """Generate embeddings for text using OpenAI's API."""
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text
-    )
-    return response.data[0].embedding
-
-async def store_in_vector_db(text, vector, brid):
-    """Store text and its vector embedding in the blockchain."""
-    vector_str = json.dumps(vector)
-    
-    # Escape quotes in the text
-    escaped_text = text.replace('"', '\\"')
-    
-    cmd = f'chr tx -brid {brid} add_message "{escaped_text}" \'{vector_str}\''
-    
-    process = await asyncio.create_subprocess_shell(
-        cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        shell=True
-    )
-    stdout, stderr = await process.communicate()
-    
-    result = stdout.decode()
-    if "CONFIRMED" not in result:
-        print(f"Error storing text: {result}")
-        return False
-    
-    print(f"Successfully stored: {text[:50]}...")
-    return True
+    try:
+        return await rid_resolver.get()
+    except Exception as e:
+        raise ValueError(f"Could not fetch blockchain RID. Make sure the blockchain is running. ({str(e)})")
 
-async def process_coin(name, history, brid):
-    """Process a single coin, embedding both its name and history."""
-    # Embed the coin name
-    name_text = f"Cryptocurrency name: {name}"
-    name_vector = get_embedding(name_text)
-    await store_in_vector_db(name_text, name_vector, brid)
-    
-    # Embed the full history
-    history_text = f"History of {name}: {history}"
-    history_vector = get_embedding(history_text)
-    await store_in_vector_db(history_text, history_vector, brid)
+def chunk_coin(document):
+    """(chunk type, text) stored for a coin: its name, its full history and smaller history chunks."""
+    name = document.fields["name"]
+    history = document.fields["history"]
+    texts = [
+        ("name", f"Cryptocurrency name: {name}"),
+        ("history", f"History of {name}: {history}"),
+    ]
     
     # Break down history into smaller chunks for better retrieval
     chunk_size = 512
     words = history.split()
     for i in range(0, len(words), chunk_size):
         chunk = " ".join(words[i:i+chunk_size])
-        chunk_text = f"{name} information: {chunk}"
-        chunk_vector = get_embedding(chunk_text)
-        await store_in_vector_db(chunk_text, chunk_vector, brid)
+        texts.append(("chunk", f"{name} information: {chunk}"))
+    return texts
 
-async def main():
-    """Main function to embed cryptocurrency data."""
-    print("Loading cryptocurrency data from data.yaml...")
-    with open("/root/vector-db-agent/data.yaml", "r") as file:
+async def load_coins(path):
+    """Stream the coins of data.yaml as pipeline documents."""
+    print(f"Loading cryptocurrency data from {path}...")
+    with open(path, "r") as file:
         data = yaml.safe_load(file)
     
     if not data or "cryptocurrencies" not in data:
         raise ValueError("Invalid data format in data.yaml")
     
-    # Get the blockchain RID
-    print("Getting blockchain RID...")
-    brid = await get_blockchain_rid()
-    print(f"Using blockchain RID: {brid}")
-    
-    # Process each cryptocurrency
     for coin in data["cryptocurrencies"]:
         name = coin.get("name")
         history = coin.get("history")
@@ -109,10 +57,58 @@ async def main():
             print(f"Skipping coin with missing data: {coin}")
             continue
         
-        print(f"Processing {name}...")
-        await process_coin(name, history, brid)
+        # Tagged with the coin, so questions about it can be searched in its context only
+        yield Document(id=name, fields={"name": name, "history": history}, coin=name)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Embed cryptocurrency data into the vector database")
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH, help="Path to data.yaml")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH, help="Checkpoint file used to resume interrupted runs")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and ingest everything again")
+    parser.add_argument("--embed-concurrency", type=int, default=4, help="Concurrent embedding batches")
+    parser.add_argument("--tx-concurrency", type=int, default=4, help="Concurrent transactions")
+    parser.add_argument("--tx-batch-size", type=int, default=32, help="Messages stored per transaction")
+    return parser.parse_args()
+
+async def main():
+    """Main function to embed cryptocurrency data."""
+    args = parse_args()
+    # Created here, the chunker and loader are imported by the benchmarks without an API key
+    client = create_openai_client()
+    embedding_batcher = EmbeddingBatcher(client, cache=get_embedding_cache())
+    node_client = get_node_client()
+    rid_resolver = get_rid_resolver()
+
+    # Get the blockchain RID
+    print("Getting blockchain RID...")
+    brid = await get_blockchain_rid(rid_resolver)
+    print(f"Using blockchain RID: {brid}")
+    print(f"Embedding with {embedding_batcher.dimensions} dimensions")
+
+    checkpoint = Checkpoint(args.checkpoint, brid)
+    if args.restart:
+        checkpoint.reset()
+    elif checkpoint.stored:
+        print(f"Resuming, {len(checkpoint.stored)} texts already stored")
+
+    pipeline = IngestionPipeline(
+        node_client,
+        rid_resolver,
+        embedding_batcher,
+        chunk_coin,
+        checkpoint=checkpoint,
+        embed_batch_size=embedding_batcher.max_batch_size,
+        embed_concurrency=args.embed_concurrency,
+        tx_batch_size=args.tx_batch_size,
+        tx_concurrency=args.tx_concurrency,
+    )
+    try:
+        stats = await pipeline.run(load_coins(args.data))
+    finally:
+        await node_client.close()
+        await client.close()
     
-    print("Data embedding complete!")
+    print(f"Data embedding complete! {stats.summary()}")
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
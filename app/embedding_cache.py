@@ -0,0 +1,206 @@
+"""
+Content addressed cache of embeddings, keyed by (model, sha256(text)).
+
+An in-memory LRU sits in front of an on-disk SQLite store that keeps the
+vectors as packed little-endian float32 (or float16) blobs. The disk store is
+trimmed by least recent use when it grows beyond its size limit.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.vectors import DTYPES, pack_vector, unpack_vector
+
+DEFAULT_CACHE_PATH = ".cache/embeddings.sqlite3"
+
+class EmbeddingCache:
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        memory_items: Optional[int] = None,
+        max_disk_bytes: Optional[int] = None,
+        dtype: Optional[str] = None,
+    ):
+        self.path = path if path is not None else os.environ.get("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.memory_items = memory_items if memory_items is not None else int(os.environ.get("EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+        self.max_disk_bytes = max_disk_bytes if max_disk_bytes is not None else int(os.environ.get("EMBEDDING_CACHE_MAX_MB", "512")) * 1024 * 1024
+        self.dtype = dtype or os.environ.get("EMBEDDING_CACHE_DTYPE", "float32")
+        if self.dtype not in DTYPES:
+            raise ValueError(f"Unsupported embedding cache dtype: {self.dtype}")
+
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.path:
+            self._open()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS embedding (
+                key TEXT PRIMARY KEY,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS embedding_last_access ON embedding (last_access)")
+        self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embedding").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, text: str) -> str:
+        return f"{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_memory(self, model: str, text: str, count: bool = True) -> Optional[List[float]]:
+        """
+        Lookup in the in-memory LRU only, cheap enough to call on the event loop. `count=False` leaves the hit
+        counters alone, for lookups of texts that are not about to be embedded.
+        """
+        key = self.key(model, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                if count:
+                    self.memory_hits += 1
+            return vector
+
+    def get(self, model: str, text: str, count: bool = True) -> Optional[List[float]]:
+        vector = self.get_memory(model, text, count)
+        if vector is not None:
+            return vector
+
+        key = self.key(model, text)
+        with self._lock:
+            if self._db is not None:
+                row = self._db.execute("SELECT dtype, vector FROM embedding WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE embedding SET last_access = ? WHERE key = ?", (time.time(), key))
+                    vector = unpack_vector(row[1], row[0])
+                    self._remember(key, vector)
+                    if count:
+                        self.disk_hits += 1
+                    return vector
+            if count:
+                self.misses += 1
+            return None
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, List[float]]]):
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in items:
+                key = self.key(model, text)
+                self._remember(key, list(vector))
+                rows.append((key, self.dtype, pack_vector(vector, self.dtype), now))
+
+            if self._db is None or not rows:
+                return
+            self._db.execute("BEGIN")
+            for row in rows:
+                previous = self._db.execute("SELECT LENGTH(vector) FROM embedding WHERE key = ?", (row[0],)).fetchone()
+                self._db.execute("INSERT OR REPLACE INTO embedding (key, dtype, vector, last_access) VALUES (?, ?, ?, ?)", row)
+                self._disk_bytes += len(row[2]) - (previous[0] if previous else 0)
+            self._db.execute("COMMIT")
+            self._evict()
+
+    def put(self, model: str, text: str, vector: List[float]):
+        self.put_many(model, [(text, vector)])
+
+    def _evict(self):
+        """Drop least recently used entries until the store is back under 90% of its limit."""
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        target = self.max_disk_bytes * 0.9
+        self._db.execute("BEGIN")
+        for key, size in self._db.execute("SELECT key, LENGTH(vector) FROM embedding ORDER BY last_access").fetchall():
+            if self._disk_bytes <= target:
+                break
+            self._db.execute("DELETE FROM embedding WHERE key = ?", (key,))
+            self._disk_bytes -= size
+            self.evictions += 1
+        self._db.execute("COMMIT")
+
+    async def aget(self, model: str, text: str) -> Optional[List[float]]:
+        """Memory lookup on the event loop, disk lookup in a worker thread."""
+        vector = self.get_memory(model, text)
+        if vector is not None or self._db is None:
+            if vector is None:
+                with self._lock:
+                    self.misses += 1
+            return vector
+        return await asyncio.to_thread(self.get, model, text)
+
+    async def aget_many(self, model: str, texts: List[str], count: bool = True) -> List[Optional[List[float]]]:
+        """Like `aget` for several texts, with a single worker thread for all the disk lookups."""
+        vectors = [self.get_memory(model, text, count) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if not missing:
+            return vectors
+        if self._db is None:
+            if count:
+                with self._lock:
+                    self.misses += len(missing)
+            return vectors
+        found = await asyncio.to_thread(lambda: [self.get(model, texts[i], count) for i in missing])
+        for i, vector in zip(missing, found):
+            vectors[i] = vector
+        return vectors
+
+    async def aput_many(self, model: str, items: List[Tuple[str, List[float]]]):
+        await asyncio.to_thread(self.put_many, model, items)
+
+    def stats(self) -> Dict[str, float]:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_items": len(self._memory),
+            "disk_bytes": self._disk_bytes,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+_default_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process wide cache shared by the API handlers."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EmbeddingCache()
+    return _default_cache
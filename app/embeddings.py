@@ -0,0 +1,153 @@
+"""
+Coalescing of concurrent embedding requests into batched OpenAI calls.
+
+Requests arriving within `max_delay` seconds of each other (or until
+`max_batch_size` inputs are queued) are sent as a single
+`embeddings.create(input=[...])` call, and each caller gets its own vector.
+Texts found in the embedding cache are answered without an API call.
+
+With `EMBEDDING_DIMENSIONS` below the model's native size, the API is asked
+for shortened embeddings with its `dimensions` parameter. The
+text-embedding-3 models put the most important components first, so a
+shortened embedding is the normalized prefix of the full one
+(`shorten_embedding`). The vector database must be configured with the same
+number of dimensions, see `app.reembed`.
+"""
+import asyncio
+import math
+import os
+from typing import List, Optional, Tuple
+
+from app.embedding_cache import EmbeddingCache, get_embedding_cache
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+NATIVE_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+# OpenAI accepts at most 2048 inputs per embeddings request
+MAX_INPUTS_PER_REQUEST = 2048
+
+
+def embedding_dimensions(model: str = EMBEDDING_MODEL) -> int:
+    """Dimensions of the embeddings used with the vector database, `EMBEDDING_DIMENSIONS` or the model's native size."""
+    native = NATIVE_DIMENSIONS.get(model)
+    dimensions = int(os.environ.get("EMBEDDING_DIMENSIONS", native or 0))
+    if dimensions <= 0 or (native is not None and dimensions > native):
+        raise ValueError(f"Unsupported embedding dimensions for {model}: {dimensions}")
+    return dimensions
+
+
+def shorten_embedding(vector: List[float], dimensions: int) -> List[float]:
+    """The embedding the API returns for `dimensions`, computed from a longer one: its normalized prefix."""
+    prefix = vector[:dimensions]
+    norm = math.sqrt(sum(x * x for x in prefix))
+    return [x / norm for x in prefix] if norm > 0 else prefix
+
+
+def embedding_cache_key(model: str = EMBEDDING_MODEL, dimensions: Optional[int] = None) -> str:
+    """The model key of the embeddings in the embedding cache; shortened ones are cached apart from full ones."""
+    dimensions = dimensions or embedding_dimensions(model)
+    return model if dimensions == NATIVE_DIMENSIONS.get(model) else f"{model}@{dimensions}"
+
+
+class EmbeddingBatcher:
+
+    def __init__(
+        self,
+        client,
+        model: str = EMBEDDING_MODEL,
+        max_batch_size: Optional[int] = None,
+        max_delay: Optional[float] = None,
+        cache: Optional[EmbeddingCache] = None,
+        dimensions: Optional[int] = None,
+    ):
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions or embedding_dimensions(model)
+        # Only shortened embeddings are requested with `dimensions`, requests for native ones stay as they were
+        self._shortened = self.dimensions != NATIVE_DIMENSIONS.get(model)
+        self.cache_key = embedding_cache_key(model, self.dimensions)
+        self.cache = cache
+        self.max_batch_size = min(
+            max_batch_size or int(os.environ.get("EMBEDDING_BATCH_SIZE", "64")),
+            MAX_INPUTS_PER_REQUEST,
+        )
+        self.max_delay = max_delay if max_delay is not None else float(os.environ.get("EMBEDDING_BATCH_DELAY_MS", "5")) / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._in_flight = set()
+
+    async def embed(self, text: str) -> List[float]:
+        if self.cache is not None:
+            vector = await self.cache.aget(self.cache_key, text)
+            if vector is not None:
+                return vector
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+
+        return await future
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """Embed several texts; they are coalesced with any other pending requests."""
+        return list(await asyncio.gather(*(self.embed(text) for text in texts)))
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            task = asyncio.ensure_future(self._send(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        # A text requested several times in the batch is embedded once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            if self._shortened:
+                response = await self.client.embeddings.create(model=self.model, input=texts, dimensions=self.dimensions)
+            else:
+                response = await self.client.embeddings.create(model=self.model, input=texts)
+            embeddings = {texts[item.index]: item.embedding for item in response.data}
+            for text, future in batch:
+                if future.done():
+                    continue
+                if text in embeddings:
+                    future.set_result(embeddings[text])
+                else:
+                    future.set_exception(ValueError(f"No embedding returned for input: {text[:50]}"))
+            if self.cache is not None:
+                await self.cache.aput_many(self.cache_key, list(embeddings.items()))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+_default_batcher: Optional[EmbeddingBatcher] = None
+
+
+def get_embedding_batcher(client) -> EmbeddingBatcher:
+    """
+    Process wide batcher, so concurrent requests from all handlers are coalesced. It sends with the client of the
+    latest caller, as the client of an app is closed with the app and a new app (or another one in the same process)
+    brings its own.
+    """
+    global _default_batcher
+    if _default_batcher is None:
+        _default_batcher = EmbeddingBatcher(client, cache=get_embedding_cache())
+    elif _default_batcher.client is not client:
+        _default_batcher.client = client
+    return _default_batcher
@@ -0,0 +1,193 @@
+"""
+GTV (Generic Transfer Value) encoding as used by the Chromia node REST API.
+
+Values are mapped to and from plain Python types:
+
+    None <-> null, bytes <-> byte_array, str <-> string, int/bool <-> integer,
+    dict <-> dict, list/tuple <-> array
+
+Decoded integers that do not fit in 64 bits come back as (big) ints as well.
+"""
+import hashlib
+from typing import Any, List, Tuple
+
+# Context specific, constructed tags of the GTV ASN.1 CHOICE
+TAG_NULL = 0xA0
+TAG_BYTE_ARRAY = 0xA1
+TAG_STRING = 0xA2
+TAG_INTEGER = 0xA3
+TAG_DICT = 0xA4
+TAG_ARRAY = 0xA5
+TAG_BIG_INTEGER = 0xA6
+
+# Universal ASN.1 tags wrapped by the GTV tags above
+ASN_INTEGER = 0x02
+ASN_OCTET_STRING = 0x04
+ASN_NULL = 0x05
+ASN_UTF8_STRING = 0x0C
+ASN_SEQUENCE = 0x30
+
+# Prefixes used by the merkle hash calculation (merkle hash version 1)
+_HASH_PREFIX_NODE = b"\x00"
+_HASH_PREFIX_LEAF = b"\x01"
+_HASH_PREFIX_NODE_ARRAY = b"\x07"
+_HASH_PREFIX_NODE_DICT = b"\x08"
+_EMPTY_HASH = bytes(32)
+
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+
+
+class GtvError(ValueError):
+    pass
+
+
+def _encode_length(length: int) -> bytes:
+    if length < 0x80:
+        return bytes((length,))
+    size = (length.bit_length() + 7) // 8
+    return bytes((0x80 | size,)) + length.to_bytes(size, "big")
+
+
+def _tlv(tag: int, content: bytes) -> bytes:
+    return bytes((tag,)) + _encode_length(len(content)) + content
+
+
+def _encode_integer(value: int) -> bytes:
+    size = ((value + (value < 0)).bit_length() + 8) // 8
+    return _tlv(ASN_INTEGER, value.to_bytes(size, "big", signed=True))
+
+
+def _encode_value(value: Any, out: List[bytes]) -> None:
+    if value is None:
+        out.append(_tlv(TAG_NULL, b"\x05\x00"))
+    elif isinstance(value, bool):
+        out.append(_tlv(TAG_INTEGER, _encode_integer(int(value))))
+    elif isinstance(value, int):
+        tag = TAG_INTEGER if _INT64_MIN <= value <= _INT64_MAX else TAG_BIG_INTEGER
+        out.append(_tlv(tag, _encode_integer(value)))
+    elif isinstance(value, str):
+        out.append(_tlv(TAG_STRING, _tlv(ASN_UTF8_STRING, value.encode("utf-8"))))
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(_tlv(TAG_BYTE_ARRAY, _tlv(ASN_OCTET_STRING, bytes(value))))
+    elif isinstance(value, dict):
+        pairs = []
+        for key in sorted(value):
+            if not isinstance(key, str):
+                raise GtvError(f"GTV dict keys must be strings, got {type(key).__name__}")
+            pair = [_tlv(ASN_UTF8_STRING, key.encode("utf-8"))]
+            _encode_value(value[key], pair)
+            pairs.append(_tlv(ASN_SEQUENCE, b"".join(pair)))
+        out.append(_tlv(TAG_DICT, _tlv(ASN_SEQUENCE, b"".join(pairs))))
+    elif isinstance(value, (list, tuple)):
+        items: List[bytes] = []
+        for item in value:
+            _encode_value(item, items)
+        out.append(_tlv(TAG_ARRAY, _tlv(ASN_SEQUENCE, b"".join(items))))
+    else:
+        raise GtvError(f"Cannot encode {type(value).__name__} as GTV")
+
+
+def encode(value: Any) -> bytes:
+    """Encode a Python value as DER encoded GTV."""
+    out: List[bytes] = []
+    _encode_value(value, out)
+    return b"".join(out)
+
+
+def read_header(data: memoryview, pos: int, expected_tag: int = None) -> Tuple[int, int, int]:
+    """Return (tag, content start, content end) of the TLV starting at pos."""
+    try:
+        tag = data[pos]
+        length = data[pos + 1]
+        pos += 2
+        if length & 0x80:
+            size = length & 0x7F
+            length = int.from_bytes(data[pos:pos + size], "big")
+            pos += size
+    except IndexError:
+        raise GtvError("Truncated GTV data") from None
+    end = pos + length
+    if end > len(data):
+        raise GtvError("Truncated GTV data")
+    if expected_tag is not None and tag != expected_tag:
+        raise GtvError(f"Expected ASN.1 tag 0x{expected_tag:02x}, got 0x{tag:02x}")
+    return tag, pos, end
+
+
+def decode_value(data: memoryview, pos: int) -> Tuple[Any, int]:
+    """Decode the GTV value starting at pos, returning (value, end of value)."""
+    tag, start, end = read_header(data, pos)
+
+    if tag == TAG_STRING:
+        _, s, e = read_header(data, start, ASN_UTF8_STRING)
+        return str(data[s:e], "utf-8"), end
+    if tag == TAG_INTEGER or tag == TAG_BIG_INTEGER:
+        _, s, e = read_header(data, start, ASN_INTEGER)
+        return int.from_bytes(data[s:e], "big", signed=True), end
+    if tag == TAG_ARRAY:
+        _, s, e = read_header(data, start, ASN_SEQUENCE)
+        items = []
+        while s < e:
+            item, s = decode_value(data, s)
+            items.append(item)
+        return items, end
+    if tag == TAG_DICT:
+        _, s, e = read_header(data, start, ASN_SEQUENCE)
+        result = {}
+        while s < e:
+            _, ps, pe = read_header(data, s, ASN_SEQUENCE)
+            _, ks, ke = read_header(data, ps, ASN_UTF8_STRING)
+            result[str(data[ks:ke], "utf-8")], _ = decode_value(data, ke)
+            s = pe
+        return result, end
+    if tag == TAG_BYTE_ARRAY:
+        _, s, e = read_header(data, start, ASN_OCTET_STRING)
+        return bytes(data[s:e]), end
+    if tag == TAG_NULL:
+        return None, end
+
+    raise GtvError(f"Unknown GTV tag 0x{tag:02x}")
+
+
+def decode(data: bytes) -> Any:
+    """Decode DER encoded GTV into Python values."""
+    value, end = decode_value(memoryview(data), 0)
+    if end != len(data):
+        raise GtvError("Trailing bytes after GTV value")
+    return value
+
+
+def _sha256(*parts: bytes) -> bytes:
+    return hashlib.sha256(b"".join(parts)).digest()
+
+
+def _tree_hash(hashes: List[bytes], head_prefix: bytes) -> bytes:
+    if not hashes:
+        return _sha256(head_prefix, _EMPTY_HASH, _EMPTY_HASH)
+    if len(hashes) == 1:
+        return _sha256(head_prefix, hashes[0], _EMPTY_HASH)
+
+    layer = hashes
+    while len(layer) > 2:
+        higher = [
+            _sha256(_HASH_PREFIX_NODE, layer[i], layer[i + 1])
+            for i in range(0, len(layer) - 1, 2)
+        ]
+        if len(layer) % 2:
+            higher.append(layer[-1])
+        layer = higher
+    return _sha256(head_prefix, layer[0], layer[1])
+
+
+def merkle_hash(value: Any) -> bytes:
+    """GTV merkle root hash, e.g. the transaction RID of a GTX body."""
+    if isinstance(value, dict):
+        hashes = []
+        for key in sorted(value):
+            hashes.append(_sha256(_HASH_PREFIX_LEAF, encode(key)))
+            hashes.append(merkle_hash(value[key]))
+        return _tree_hash(hashes, _HASH_PREFIX_NODE_DICT)
+    if isinstance(value, (list, tuple)):
+        return _tree_hash([merkle_hash(item) for item in value], _HASH_PREFIX_NODE_ARRAY)
+    return _sha256(_HASH_PREFIX_LEAF, encode(value))
@@ -0,0 +1,291 @@
+"""
+Streaming bulk ingestion into the vector database.
+
+Documents flow through four stages connected by bounded queues, so a slow
+stage applies backpressure to the ones before it:
+
+    load -> chunk -> embed (batched) -> submit (batched `add_(tagged_)messages` transactions)
+
+Chunks of a document about a coin are stored with `add_tagged_messages`,
+tagged with the coin and their chunk type, so searches can be limited to the
+context of one coin.
+
+Every stored chunk is appended to a checkpoint file by the hash of its text.
+An interrupted run can be restarted and skips everything already confirmed on
+chain instead of adding duplicates. The file names the chain it belongs to, so
+after a reset of the node, or with another `VECTOR_BRID`, everything is
+stored again instead of skipped.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.blockchain_rid import BlockchainRidResolver
+from app.chromia_client import TX_STATUS_CONFIRMED, ChromiaNodeClient, add_messages_operation, add_tagged_messages_operation
+from app.embeddings import EmbeddingBatcher
+from app.vectors import encode_vector
+
+DEFAULT_CHECKPOINT_PATH = ".cache/ingest_checkpoint.txt"
+CHECKPOINT_BRID_PREFIX = "brid: "
+
+# Marks the end of a stage's output in the queue to the next stage
+_DONE = object()
+
+
+@dataclass
+class Document:
+    id: str
+    fields: Dict[str, str]
+    # The coin the document is about, its chunks are tagged with it
+    coin: Optional[str] = None
+
+
+@dataclass
+class Chunk:
+    doc_id: str
+    text: str
+    chunk_type: str
+    coin: Optional[str] = None
+    vector: Optional[List[float]] = None
+
+    @property
+    def key(self) -> str:
+        return hashlib.sha256(self.text.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class IngestionStats:
+    started: float = field(default_factory=time.monotonic)
+    docs: int = 0
+    docs_skipped: int = 0
+    vectors: int = 0
+    vectors_skipped: int = 0
+    failed: int = 0
+    transactions: int = 0
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.monotonic() - self.started, 1e-9)
+
+    def summary(self) -> str:
+        return (
+            f"{self.docs} docs ({self.docs / self.elapsed:.2f} docs/sec), "
+            f"{self.vectors} vectors ({self.vectors / self.elapsed:.2f} vectors/sec) "
+            f"in {self.transactions} transactions, {self.elapsed:.1f}s; "
+            f"skipped {self.docs_skipped} docs / {self.vectors_skipped} vectors from checkpoint, "
+            f"{self.failed} vectors failed"
+        )
+
+
+class Checkpoint:
+    """
+    Append-only file of the hashes of chunks that are confirmed on chain, after a first line with the RID of the
+    chain. A checkpoint of another chain, or without a RID, is discarded when loaded for `brid`.
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_CHECKPOINT_PATH, brid: Optional[str] = None):
+        self.path = path
+        self.brid = brid.upper() if brid else None
+        self.stored: Set[str] = set()
+        if path and os.path.exists(path):
+            with open(path, "r") as file:
+                lines = [line.strip() for line in file]
+            header = lines[0] if lines else ""
+            stored_brid = header[len(CHECKPOINT_BRID_PREFIX):] if header.startswith(CHECKPOINT_BRID_PREFIX) else None
+            if self.brid is not None and stored_brid != self.brid:
+                print(f"Checkpoint {path} is of chain {stored_brid or 'unknown'}, not {self.brid}; starting over")
+                self.reset()
+            else:
+                # A partially written last line (interrupted run) is ignored
+                self.stored = {line for line in lines if len(line) == 64}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.stored
+
+    def add(self, keys: List[str]):
+        self.stored.update(keys)
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        header = f"{CHECKPOINT_BRID_PREFIX}{self.brid}\n" if self.brid and not os.path.exists(self.path) else ""
+        with open(self.path, "a") as file:
+            file.write(header + "".join(f"{key}\n" for key in keys))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def reset(self):
+        self.stored = set()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class IngestionPipeline:
+
+    def __init__(
+        self,
+        node_client: ChromiaNodeClient,
+        rid_resolver: BlockchainRidResolver,
+        batcher: EmbeddingBatcher,
+        chunker: Callable[[Document], Iterable[Tuple[str, str]]],
+        checkpoint: Optional[Checkpoint] = None,
+        embed_batch_size: int = 64,
+        embed_concurrency: int = 4,
+        tx_batch_size: int = 32,
+        tx_concurrency: int = 4,
+        queue_size: int = 256,
+        progress_interval: float = 5.0,
+    ):
+        self.node_client = node_client
+        self.rid_resolver = rid_resolver
+        self.batcher = batcher
+        self.chunker = chunker
+        self.checkpoint = checkpoint or Checkpoint(None)
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.tx_batch_size = tx_batch_size
+        self.tx_concurrency = tx_concurrency
+        self.queue_size = queue_size
+        self.progress_interval = progress_interval
+
+        self.stats = IngestionStats()
+        self._remaining_chunks: Dict[str, int] = {}
+
+    async def run(self, documents: AsyncIterator[Document]) -> IngestionStats:
+        self.stats = IngestionStats()
+        doc_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        chunk_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        vector_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+
+        progress = asyncio.ensure_future(self._report_progress())
+        try:
+            await asyncio.gather(
+                self._stage(self._load, 1, documents, doc_queue, 1),
+                self._stage(self._chunk, 1, doc_queue, chunk_queue, self.embed_concurrency),
+                self._stage(self._embed, self.embed_concurrency, chunk_queue, vector_queue, self.tx_concurrency),
+                self._stage(self._submit, self.tx_concurrency, vector_queue, None, 0),
+            )
+        finally:
+            progress.cancel()
+        return self.stats
+
+    async def _stage(self, worker, concurrency: int, source, target: Optional[asyncio.Queue], consumers: int):
+        """Run `concurrency` workers of a stage, then signal the end to each of the next stage's `consumers`."""
+        await asyncio.gather(*(worker(source, target) for _ in range(concurrency)))
+        for _ in range(consumers):
+            await target.put(_DONE)
+
+    async def _take(self, source: asyncio.Queue, limit: int) -> Tuple[List, bool]:
+        """Wait for one item, then take whatever else is ready, up to `limit` items."""
+        items = []
+        done = False
+        item = await source.get()
+        while True:
+            if item is _DONE:
+                done = True
+                break
+            items.append(item)
+            if len(items) >= limit:
+                break
+            try:
+                item = source.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+        return items, done
+
+    async def _load(self, documents: AsyncIterator[Document], target: asyncio.Queue):
+        async for document in documents:
+            await target.put(document)
+
+    async def _chunk(self, source: asyncio.Queue, target: asyncio.Queue):
+        while True:
+            document = await source.get()
+            if document is _DONE:
+                return
+            chunks = [Chunk(document.id, text, chunk_type, document.coin) for chunk_type, text in self.chunker(document)]
+            pending = [chunk for chunk in chunks if chunk.key not in self.checkpoint]
+            self.stats.vectors_skipped += len(chunks) - len(pending)
+            if not pending:
+                self.stats.docs_skipped += 1
+                continue
+            self._remaining_chunks[document.id] = self._remaining_chunks.get(document.id, 0) + len(pending)
+            for chunk in pending:
+                await target.put(chunk)
+
+    async def _embed(self, source: asyncio.Queue, target: asyncio.Queue):
+        while True:
+            chunks, done = await self._take(source, self.embed_batch_size)
+            if chunks:
+                try:
+                    vectors = await self.batcher.embed_many([chunk.text for chunk in chunks])
+                except Exception as e:
+                    print(f"Error embedding {len(chunks)} chunks: {str(e)}")
+                    self._failed(chunks)
+                else:
+                    for chunk, vector in zip(chunks, vectors):
+                        chunk.vector = vector
+                        await target.put(chunk)
+            if done:
+                return
+
+    async def _submit(self, source: asyncio.Queue, target: None):
+        while True:
+            chunks, done = await self._take(source, self.tx_batch_size)
+            if chunks:
+                await self._store(chunks)
+            if done:
+                return
+
+    async def _store(self, chunks: List[Chunk]):
+        try:
+            result = await self.rid_resolver.run(lambda brid: self._add_messages(brid, chunks))
+        except Exception as e:
+            result = {"status": "error", "rejectReason": str(e)}
+
+        if result.get("status") != TX_STATUS_CONFIRMED:
+            print(f"Error storing {len(chunks)} chunks: {result.get('rejectReason', result.get('status'))}")
+            self._failed(chunks)
+            return
+
+        self.checkpoint.add([chunk.key for chunk in chunks])
+        self.stats.transactions += 1
+        self.stats.vectors += len(chunks)
+        for chunk in chunks:
+            self._chunk_finished(chunk)
+
+    async def _add_messages(self, brid: str, chunks: List[Chunk]):
+        tagged = [chunk for chunk in chunks if chunk.coin]
+        untagged = [chunk for chunk in chunks if not chunk.coin]
+        operations = []
+        if tagged:
+            messages = [(chunk.text, encode_vector(chunk.vector), chunk.coin, chunk.chunk_type) for chunk in tagged]
+            operations.append(add_tagged_messages_operation(messages))
+        if untagged:
+            messages = [(chunk.text, encode_vector(chunk.vector)) for chunk in untagged]
+            operations.append(add_messages_operation(messages))
+        return await self.node_client.send_transaction_and_wait(brid, operations)
+
+    def _failed(self, chunks: List[Chunk]):
+        self.stats.failed += len(chunks)
+        for chunk in chunks:
+            # A document with failed chunks is not counted as ingested
+            self._remaining_chunks[chunk.doc_id] = -1
+
+    def _chunk_finished(self, chunk: Chunk):
+        remaining = self._remaining_chunks.get(chunk.doc_id, 0)
+        if remaining <= 0:
+            return
+        if remaining == 1:
+            del self._remaining_chunks[chunk.doc_id]
+            self.stats.docs += 1
+        else:
+            self._remaining_chunks[chunk.doc_id] = remaining - 1
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            print(f"Progress: {self.stats.summary()}")
@@ -0,0 +1,137 @@
+"""
+In-process BM25 index of the `message` texts of the vector database.
+
+Cosine distance of embeddings is weak on exact tokens: tickers, years and
+names ("CHR 2019 token swap"). This inverted index scores the mirrored
+messages with BM25 so such queries can be answered lexically, and its ranking
+is fused with the vector ranking by `fuse_rankings` in `app.results`.
+
+Texts are synced from the chain like every `ChainMirror`, but paged with the
+dapp's `get_message_texts` query instead of `get_vectors`, so the node never
+reads or serializes the vectors for it. It returns the coin tag of each
+message, so a search can be limited to one coin like the vector search in the
+coin's context. Like the vector index the mirror is opt-in, with
+`LEXICAL_INDEX=1`.
+"""
+import heapq
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from app.blockchain_rid import BlockchainRidResolver, get_rid_resolver
+from app.chain_mirror import ChainMirror
+from app.chromia_client import ChromiaNodeClient, get_node_client
+
+_TOKEN = re.compile(r"\w+")
+
+# Too common to say anything about a text; left out of the postings
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what when where "
+    "which who why will with how about".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class _InvertedIndex:
+
+    def __init__(self):
+        # token -> {message id: term frequency}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.lengths: Dict[int, int] = {}
+        self.texts: Dict[int, str] = {}
+        # Lowercased coin of the tagged messages
+        self.coins: Dict[int, str] = {}
+        self.total_length = 0
+
+    def add(self, message_id: int, text: str, coin: Optional[str] = None):
+        if message_id in self.texts:
+            return
+        if coin:
+            self.coins[message_id] = coin.lower()
+        tokens = tokenize(text)
+        for token, frequency in Counter(tokens).items():
+            self.postings.setdefault(token, {})[message_id] = frequency
+        self.lengths[message_id] = len(tokens)
+        self.texts[message_id] = text
+        self.total_length += len(tokens)
+
+
+class LexicalIndex(ChainMirror):
+
+    name = "lexical index"
+
+    def __init__(
+        self,
+        node_client: ChromiaNodeClient,
+        rid_resolver: BlockchainRidResolver,
+        context: int = 0,
+        refresh_interval: Optional[float] = None,
+        max_staleness: Optional[float] = None,
+        full_sync_interval: Optional[float] = None,
+        page_size: int = 1000,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        super().__init__(
+            node_client, rid_resolver, "LEXICAL_INDEX", context, refresh_interval, max_staleness, full_sync_interval, page_size
+        )
+        self.k1 = k1
+        self.b = b
+        self._index = _InvertedIndex()
+
+    @property
+    def size(self) -> int:
+        return len(self._index.texts)
+
+    async def _fetch_page(self, brid: str, after_id: int) -> List[Dict[str, Any]]:
+        return await self.node_client.get_message_texts(brid, after_id, self.page_size)
+
+    def _load(self, rows: List[Dict[str, Any]], full: bool):
+        # A full sync is built aside and swapped in, searches never see a partial index
+        index = _InvertedIndex() if full else self._index
+        for row in rows:
+            index.add(row["id"], row["text"], row.get("coin"))
+        self._index = index
+
+    def search(self, query: str, max_results: int, coin: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Best BM25 matches of the query as `{id, text, bm25}`, best first, only messages tagged with `coin` if given."""
+        index = self._index
+        if not index.texts:
+            return []
+        coin = coin.lower() if coin else None
+        count = len(index.texts)
+        average_length = index.total_length / count or 1.0
+        scores: Dict[int, float] = {}
+        for token in set(tokenize(query)):
+            postings = index.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1.0 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for message_id, frequency in postings.items():
+                if coin is not None and index.coins.get(message_id) != coin:
+                    continue
+                norm = self.k1 * (1.0 - self.b + self.b * index.lengths[message_id] / average_length)
+                scores[message_id] = scores.get(message_id, 0.0) + idf * frequency * (self.k1 + 1.0) / (frequency + norm)
+        best = heapq.nlargest(max_results, scores.items(), key=lambda item: item[1])
+        return [{"id": message_id, "text": index.texts[message_id], "bm25": score} for message_id, score in best]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": self.size, "terms": len(self._index.postings), "fresh": self.fresh}
+
+
+_lexical_index: Optional[LexicalIndex] = None
+
+
+def get_lexical_index() -> Optional[LexicalIndex]:
+    """Process-wide index, or None unless enabled with `LEXICAL_INDEX=1`."""
+    global _lexical_index
+    if os.environ.get("LEXICAL_INDEX", "0").lower() not in ("1", "true", "yes"):
+        return None
+    if _lexical_index is None:
+        _lexical_index = LexicalIndex(get_node_client(), get_rid_resolver())
+    return _lexical_index
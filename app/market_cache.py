@@ -0,0 +1,87 @@
+"""
+TTL cache for market data with single-flight loading and stale-while-revalidate.
+
+Each entry has its own TTL, so fast moving data (prices) and slow moving data
+(coin details) can share one cache. Concurrent misses for the same key share
+one upstream call. Once an entry is older than its TTL it is still served,
+up to `stale_factor` times the TTL, while a single background refresh
+replaces it, which keeps upstream latency out of the request path.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class MarketDataCache:
+
+    def __init__(self, stale_factor: float = 10.0, max_entries: int = 10000):
+        self.stale_factor = stale_factor
+        self.max_entries = max_entries
+        # key -> (value, fetched at)
+        self._entries: Dict[Hashable, Tuple[Any, float]] = {}
+        self._loading: Dict[Hashable, asyncio.Task] = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    async def get(self, key: Hashable, load: Callable[[], Awaitable[Any]], ttl: float) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age <= ttl:
+                self.hits += 1
+                return value
+            if age <= ttl * self.stale_factor:
+                self.stale_hits += 1
+                self._load(key, load)
+                return value
+
+        self.misses += 1
+        return await asyncio.shield(self._load(key, load, coalesce=True))
+
+    def _load(self, key: Hashable, load: Callable[[], Awaitable[Any]], coalesce: bool = False) -> asyncio.Task:
+        """The running load of the key, or a new one."""
+        task = self._loading.get(key)
+        if task is not None:
+            if coalesce:
+                self.coalesced += 1
+            return task
+        task = asyncio.ensure_future(self._fetch(key, load))
+        task.add_done_callback(self._loaded)
+        self._loading[key] = task
+        return task
+
+    async def _fetch(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await load()
+        finally:
+            self._loading.pop(key, None)
+        # Re-inserted so that the dict stays ordered by fetch time
+        self._entries.pop(key, None)
+        self._entries[key] = (value, time.monotonic())
+        if len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        return value
+
+    def _loaded(self, task: asyncio.Task):
+        # Failed background refreshes have no caller to raise to; the stale value keeps being served
+        # and the next request tries again
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+            print(f"Error loading market data: {str(task.exception())}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
@@ -1,5 +1,10 @@
+import os
+
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
+
+# Every text of a batch is embedded concurrently and kept in memory until stored
+EMBEDDING_BATCH_MAX_TEXTS = int(os.environ.get("EMBEDDING_BATCH_MAX_TEXTS", "1000"))
 
 class TextEmbeddingRequest(BaseModel):
     text: str = Field(..., description="Text to embed in the vector database")
@@ -9,9 +14,31 @@ class TextEmbeddingResponse(BaseModel):
     error: Optional[str] = None
 
 
+class TextEmbeddingBatchRequest(BaseModel):
+    texts: List[str] = Field(
+        ..., min_length=1, max_length=EMBEDDING_BATCH_MAX_TEXTS, description="Texts to embed in the vector database"
+    )
+
+
+class TextEmbeddingBatchItem(BaseModel):
+    text: str
+    success: bool
+    error: Optional[str] = None
+
+
+class TextEmbeddingBatchResponse(BaseModel):
+    results: List[TextEmbeddingBatchItem]
+
+
 class TextSearchRequest(BaseModel):
     text: str = Field(..., description="Text to search for in the vector database")
     max_results: int = Field(5, description="Maximum number of results to return")
+    mode: Literal["vector", "hybrid"] = Field(
+        "vector", description="vector: embedding similarity only, hybrid: fused with BM25 keyword matches"
+    )
+    coin: Optional[str] = Field(
+        None, description="Only search the texts tagged with this coin at ingestion, e.g. Bitcoin"
+    )
 
 
 class TextSearchResponse(BaseModel):
@@ -21,6 +48,7 @@ class TextSearchResponse(BaseModel):
 class TextConversationRequest(BaseModel):
     question: str = Field(..., description="Question about cryptocurrency")
     top_k: int = Field(3, description="Number of vector results to include in context")
+    stream: bool = Field(False, description="Stream the answer as server-sent events")
 
 
 class RelatedAnswer(BaseModel):
@@ -37,4 +65,7 @@ class TextConversationResponse(BaseModel):
     question: str
     answer: str
     related_answers: List[RelatedAnswer]
-    market_data: MarketDataSimple
\ No newline at end of file
+    market_data: MarketDataSimple
+    cached: bool = Field(False, description="Whether the answer came from the semantic answer cache")
+    timings: Dict[str, float] = Field(default_factory=dict, description="Duration of each pipeline stage in milliseconds")
+    degraded: Dict[str, str] = Field(default_factory=dict, description="Stages that timed out or failed and were skipped")
\ No newline at end of file
@@ -1,13 +1,37 @@
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-import os
-import json
-import asyncio
+from contextlib import asynccontextmanager
 from typing import List, Dict, Any, Optional
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-app = FastAPI(title="Chromia's Vector DB with Chat Completion")
+from app.chromia_client import TX_STATUS_CONFIRMED, get_node_client
+from app.blockchain_rid import get_rid_resolver
+from app.embeddings import get_embedding_batcher
+from app.openai_client import create_openai_client, get_openai_client
+from app.results import decode_search_results
+from app.vectors import encode_vector
+
+node_client = get_node_client()
+rid_resolver = get_rid_resolver()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        app.state.openai_client = create_openai_client()
+    except ValueError as e:
+        app.state.openai_client = None
+        print(str(e))
+    try:
+        await rid_resolver.get()
+    except Exception as e:
+        print(f"Could not resolve blockchain RID on startup: {str(e)}")
+    yield
+    await node_client.close()
+    if app.state.openai_client is not None:
+        await app.state.openai_client.close()
+
+app = FastAPI(title="Chromia's Vector DB with Chat Completion", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -47,68 +71,27 @@ class LlmQueryResponse(BaseModel):
     answer: str
     results: List[Dict[str, Any]]
 
-def get_openai_client():
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="OpenAI API key not found")
-    return OpenAI(api_key=api_key)
-
 async def get_embedding(client, text: str) -> List[float]:
     try:
-        response = await asyncio.to_thread(
-            lambda: client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
-            )
-        )
-        return response.data[0].embedding
+        return await get_embedding_batcher(client).embed(text)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating embedding: {str(e)}")
 
 async def query_vector_db(vector: List[float], max_results: int) -> List[Dict[str, Any]]:
     try:
-        process = await asyncio.create_subprocess_shell(
-            "pmc blockchains | jq -r '.[] | select(.Name == \"vector_blockchain\") | .Rid'",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            shell=True
-        )
-        stdout, stderr = await process.communicate()        
-        
-        cmd = (
-            f"chr query -brid {stdout.decode().strip()} query_closest_objects "
-            f"context=0 q_vector='{json.dumps(vector)}' max_distance=1.0 "
-            f"max_vectors={max_results} 'query_template=[\"type\":\"get_messages_with_distance\"]'"
-        )
-        
-        process = await asyncio.create_subprocess_shell(
-            cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            shell=True
+        vector_str = encode_vector(vector)
+        results = await rid_resolver.run(
+            lambda vector_brid: node_client.query_closest_objects(
+                vector_brid,
+                vector_str,
+                max_results,
+                max_distance=1.0,
+                query_template={"type": "get_messages_with_distance"},
+                decoder=decode_search_results
+            )
         )
-        stdout, stderr = await process.communicate()
         
-        results = stdout.decode().strip()
-        if not results or results == "[]":
-            return []
-        
-        valid_json = results.replace('[\n  [\n', '[\n  {\n')
-        valid_json = valid_json.replace('  ],\n  [\n', '  },\n  {\n')
-        valid_json = valid_json.replace('  ]\n]', '  }\n]')
-        valid_json = valid_json.replace('"distance":', '"distance":')
-        valid_json = valid_json.replace('"text":', '"text":')
-        
-        results_data = json.loads(valid_json)
-        
-        processed_results = []
-        for item in results_data:
-            processed_results.append({
-                "text": item.get("text", ""),
-                "distance": float(item.get("distance", 1.0))
-            })
-            
-        return processed_results
+        return [result.to_dict() for result in results]
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error querying vector database: {str(e)}")
@@ -124,15 +107,13 @@ async def generate_completion(client, question: str, context: List[Dict[str, Any
 
             If the information doesn't answer the question, say you don't know but avoid mentioning the internal details of the retrieval system."""
 
-        response = await asyncio.to_thread(
-            lambda: client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": question}
-                ],
-                temperature=temperature
-            )
+        response = await client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": question}
+            ],
+            temperature=temperature
         )
         
         return response.choices[0].message.content
@@ -141,38 +122,17 @@ async def generate_completion(client, question: str, context: List[Dict[str, Any
         raise HTTPException(status_code=500, detail=f"Error generating completion: {str(e)}")
 
 @app.post("/v1/text_embedding", response_model=AddTextResponse)
-async def add_text(request: AddTextRequest = Body(...)):
-    client = get_openai_client()
-    
+async def add_text(request: AddTextRequest = Body(...), client: AsyncOpenAI = Depends(get_openai_client)):
     try:
         embedding = await get_embedding(client, request.text)
         
-        vector_str = json.dumps(embedding)
+        vector_str = encode_vector(embedding)
         
-        process = await asyncio.create_subprocess_shell(
-            "pmc blockchains | jq -r '.[] | select(.Name == \"vector_blockchain\") | .Rid'",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            shell=True
+        result = await rid_resolver.run(
+            lambda vector_brid: node_client.add_message(vector_brid, request.text, vector_str)
         )
-        stdout, stderr = await process.communicate()
-        
-        vector_brid = stdout.decode().strip()
-        if not vector_brid:
-            raise HTTPException(status_code=500, detail="Brid not found")
         
-        cmd = f"chr tx -brid {vector_brid} add_message \"{request.text}\" '{vector_str}'"
-        
-        process = await asyncio.create_subprocess_shell(
-            cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            shell=True
-        )
-        stdout, stderr = await process.communicate()
-        result = stdout.decode()
-        
-        if "CONFIRMED" in result:                    
+        if result.get("status") == TX_STATUS_CONFIRMED:
             return AddTextResponse(
                 success=True,
             )
@@ -187,9 +147,7 @@ async def add_text(request: AddTextRequest = Body(...)):
         )
 
 @app.post("/v1/text_search", response_model=VectorSearchResponse)
-async def vector_search(request: VectorSearchRequest = Body(...)):
-    client = get_openai_client()
-    
+async def vector_search(request: VectorSearchRequest = Body(...), client: AsyncOpenAI = Depends(get_openai_client)):
     embedding = await get_embedding(client, request.text)
     
     results = await query_vector_db(embedding, request.max_results)
@@ -197,9 +155,7 @@ async def vector_search(request: VectorSearchRequest = Body(...)):
     return VectorSearchResponse(results=results)
 
 @app.post("/v1/text_conversation", response_model=LlmQueryResponse)
-async def conversation(request: LlmQueryRequest = Body(...)):
-    client = get_openai_client()
-    
+async def conversation(request: LlmQueryRequest = Body(...), client: AsyncOpenAI = Depends(get_openai_client)):
     embedding = await get_embedding(client, request.question)
     
     results = await query_vector_db(embedding, request.top_k)
@@ -217,15 +173,13 @@ async def conversation(request: LlmQueryRequest = Body(...)):
 
                         Format the answer in a way that is easy to understand and use"""
 
-        response = await asyncio.to_thread(
-            lambda: client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": request.question}
-                ],
-                temperature=0.7
-            )
+        response = await client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": request.question}
+            ],
+            temperature=0.7
         )
         
         return LlmQueryResponse(
@@ -0,0 +1,54 @@
+"""
+The OpenAI client shared by all requests of an app.
+
+One `AsyncOpenAI` client is created in the lifespan hook and handed to the
+handlers as a dependency, so requests reuse its pooled keep-alive
+connections, and calls are awaited on the event loop instead of occupying a
+thread of the default thread pool each.
+"""
+import os
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from openai import DEFAULT_CONNECTION_LIMITS, AsyncOpenAI, DefaultAsyncHttpxClient, Timeout
+
+
+def create_openai_client(
+    api_key: Optional[str] = None,
+    timeout: Optional[float] = None,
+    connect_timeout: Optional[float] = None,
+    max_retries: Optional[int] = None,
+    max_connections: Optional[int] = None,
+    max_keepalive_connections: Optional[int] = None,
+) -> AsyncOpenAI:
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.")
+    timeout = timeout if timeout is not None else float(os.environ.get("OPENAI_TIMEOUT_S", "60"))
+    connect_timeout = connect_timeout if connect_timeout is not None else float(os.environ.get("OPENAI_CONNECT_TIMEOUT_S", "5"))
+    max_retries = max_retries if max_retries is not None else int(os.environ.get("OPENAI_MAX_RETRIES", "2"))
+    max_connections = max_connections if max_connections is not None else int(os.environ.get("OPENAI_MAX_CONNECTIONS", "100"))
+    max_keepalive_connections = (
+        max_keepalive_connections if max_keepalive_connections is not None
+        else int(os.environ.get("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    )
+
+    # Built from the SDK's own types: depending on its version the SDK uses httpx or httpx2, whose types don't mix
+    limits = type(DEFAULT_CONNECTION_LIMITS)(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections)
+
+    return AsyncOpenAI(
+        api_key=api_key,
+        # Retried by the client with exponential backoff on connection errors, 408, 409, 429 and 5xx
+        max_retries=max_retries,
+        # A short connect timeout fails over to a retry quickly; generations may take much longer
+        timeout=Timeout(timeout, connect=connect_timeout),
+        http_client=DefaultAsyncHttpxClient(limits=limits),
+    )
+
+
+def get_openai_client(request: Request) -> AsyncOpenAI:
+    """Dependency returning the client the lifespan hook stored in `app.state.openai_client`."""
+    client = getattr(request.app.state, "openai_client", None)
+    if client is None:
+        raise HTTPException(status_code=500, detail="OpenAI API key not found")
+    return client
@@ -0,0 +1,103 @@
+"""
+Timed request pipeline stages with timeouts and graceful degradation.
+
+A stage that times out or fails yields a default value instead of failing the
+whole request, unless it is required. Every stage's duration is kept per
+request and in a process wide rolling window, so the latency percentiles of
+each stage can be compared.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, List, Optional
+
+
+class StageStats:
+    """Rolling latency samples and failure counts per stage."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._timeouts: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+
+    def record(self, stage: str, seconds: float, status: str = "ok"):
+        self._samples.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+        if status == "timeout":
+            self._timeouts[stage] = self._timeouts.get(stage, 0) + 1
+        elif status == "error":
+            self._errors[stage] = self._errors.get(stage, 0) + 1
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        summary = {}
+        for stage, samples in self._samples.items():
+            ordered = sorted(samples)
+            summary[stage] = {
+                "count": len(ordered),
+                "p50_ms": _percentile_ms(ordered, 0.50),
+                "p95_ms": _percentile_ms(ordered, 0.95),
+                "p99_ms": _percentile_ms(ordered, 0.99),
+                "timeouts": self._timeouts.get(stage, 0),
+                "errors": self._errors.get(stage, 0),
+            }
+        return summary
+
+
+def _percentile_ms(ordered: List[float], fraction: float) -> float:
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return round(ordered[index] * 1000, 1)
+
+
+class StageFailed(Exception):
+    def __init__(self, stage: str, reason: str):
+        super().__init__(f"{stage} {reason}")
+        self.stage = stage
+        self.reason = reason
+
+
+class StagePipeline:
+    """The stages of one request."""
+
+    def __init__(self, stats: Optional[StageStats] = None):
+        self.stats = stats
+        self.started = time.monotonic()
+        # Stage name -> milliseconds
+        self.timings: Dict[str, float] = {}
+        # Stage name -> why it produced its default value
+        self.degraded: Dict[str, str] = {}
+
+    async def run(self, stage: str, awaitable: Awaitable[Any], timeout: float, default: Any = None, required: bool = False) -> Any:
+        start = time.monotonic()
+        status = "ok"
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except asyncio.TimeoutError:
+            status = "timeout"
+            reason = f"timed out after {timeout:g}s"
+        except Exception as e:
+            status = "error"
+            reason = f"failed: {getattr(e, 'detail', None) or str(e)}"
+        finally:
+            elapsed = time.monotonic() - start
+            # A cancelled stage was not needed anymore and says nothing about its latency
+            if status != "cancelled":
+                self.timings[stage] = round(elapsed * 1000, 1)
+                if self.stats is not None:
+                    self.stats.record(stage, elapsed, status)
+
+        print(f"Stage {stage} {reason}")
+        if required:
+            raise StageFailed(stage, reason)
+        self.degraded[stage] = reason
+        return default
+
+    def finish(self) -> Dict[str, float]:
+        """Timings including the total, which is recorded as its own stage."""
+        elapsed = time.monotonic() - self.started
+        self.timings["total"] = round(elapsed * 1000, 1)
+        if self.stats is not None:
+            self.stats.record("total", elapsed)
+        return self.timings
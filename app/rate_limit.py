@@ -0,0 +1,41 @@
+"""
+Async token bucket rate limiter.
+
+Tokens are added continuously at `rate` per second up to `capacity`, so short
+bursts go through immediately while the long-term rate stays bounded. Waiters
+are served in arrival order.
+"""
+import asyncio
+import time
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0 or capacity < 1:
+            raise ValueError("TokenBucket needs a positive rate and a capacity of at least one token")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        """Wait until `tokens` are available and take them."""
+        # Holding the lock while sleeping keeps waiters in order
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+    def penalize(self, seconds: float):
+        """Take away the tokens of the next `seconds`, e.g. after the upstream reported a rate limit."""
+        self._refill()
+        self._tokens = min(self._tokens, -seconds * self.rate)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Migration of the vector database to another number of embedding dimensions.
+
+The extension creates its table with a fixed `halfvec(dimensions)` column, so
+other dimensions need a chain deployed with another
+`vector_db_extension.dimensions`:
+
+    python -m app.reembed config --dimensions 256
+    cd rell && chr build && pmc blockchain add -bc build/vector_example.xml -c dapp -n vector_blockchain_256
+    python -m app.reembed migrate --dimensions 256 --target-name vector_blockchain_256
+
+`migrate` copies every message of the current chain with its coin and chunk
+type tags into the new one. By default the stored vectors are shortened with
+`shorten_embedding` instead of embedding the texts again; that gives the
+embeddings the API returns for the new dimensions, up to the float16
+rounding of the stored vectors, without any API calls. `--reembed` embeds
+the texts with the API instead, which is needed to go to more dimensions.
+Progress is checkpointed like ingestion, so an interrupted run resumes.
+
+Afterwards the API is run with `EMBEDDING_DIMENSIONS` and the `VECTOR_BRID`
+of the new chain.
+"""
+import argparse
+import asyncio
+import os
+import re
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+from app.blockchain_rid import BlockchainRidResolver
+from app.chromia_client import ChromiaNodeClient
+from app.embedding_cache import get_embedding_cache
+from app.embeddings import EMBEDDING_MODEL, NATIVE_DIMENSIONS, EmbeddingBatcher, shorten_embedding
+from app.ingest import Checkpoint, Document, IngestionPipeline
+from app.openai_client import create_openai_client
+from app.vectors import unpack_vector
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rell", "chromia.yml")
+DEFAULT_CHECKPOINT_PATH = ".cache/reembed_checkpoint.txt"
+
+# Chunk type of the messages stored without tags
+UNTAGGED_CHUNK_TYPE = "message"
+
+_DIMENSIONS_SETTING = re.compile(r"(vector_db_extension:\s*\n\s*dimensions:\s*)\d+")
+
+
+def set_config_dimensions(path: str, dimensions: int):
+    """Set `vector_db_extension.dimensions` in a chromia.yml, keeping the rest of the file as it is."""
+    with open(path, "r") as file:
+        config = file.read()
+    config, count = _DIMENSIONS_SETTING.subn(rf"\g<1>{dimensions}", config)
+    if count == 0:
+        raise ValueError(f"No vector_db_extension.dimensions in {path}")
+    with open(path, "w") as file:
+        file.write(config)
+
+
+async def _read_all(
+    node_client: ChromiaNodeClient, rid_resolver: BlockchainRidResolver, template: str, page_size: int
+) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    after_id = -1
+    while True:
+        page = await rid_resolver.run(
+            lambda brid: node_client.get_vectors(brid, after_id, page_size, query_template={"type": template})
+        )
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        after_id = page[-1]["id"]
+
+
+async def read_messages(
+    node_client: ChromiaNodeClient, rid_resolver: BlockchainRidResolver, page_size: int = 1000
+) -> List[Dict[str, Any]]:
+    """Every message of the chain as `{id, text, vector, coin, chunk_type}`, the vector as stored (float32)."""
+    vectors = await _read_all(node_client, rid_resolver, "get_messages_with_vectors", page_size)
+    tags = {row["id"]: row for row in await _read_all(node_client, rid_resolver, "get_messages_with_ids", page_size)}
+    messages = []
+    for row in vectors:
+        if row["text"] is None:
+            continue
+        tag = tags.get(row["id"], {})
+        messages.append({
+            "id": row["id"],
+            "text": row["text"],
+            "vector": unpack_vector(row["vector"]),
+            "coin": tag.get("coin"),
+            "chunk_type": tag.get("chunk_type"),
+        })
+    return messages
+
+
+class StoredVectors:
+    """Stands in for the embedding batcher of the ingestion pipeline, with the shortened stored vectors."""
+
+    def __init__(self, messages: List[Dict[str, Any]], dimensions: int, max_batch_size: int = 256):
+        self.vectors = {message["text"]: message["vector"] for message in messages}
+        self.dimensions = dimensions
+        self.max_batch_size = max_batch_size
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        return [shorten_embedding(self.vectors[text], self.dimensions) for text in texts]
+
+
+async def _documents(messages: List[Dict[str, Any]]) -> AsyncIterator[Document]:
+    for message in messages:
+        yield Document(
+            id=str(message["id"]),
+            fields={"text": message["text"], "chunk_type": message["chunk_type"] or UNTAGGED_CHUNK_TYPE},
+            coin=message["coin"],
+        )
+
+
+def _chunk_message(document: Document) -> List[Tuple[str, str]]:
+    # Messages were chunked when they were first ingested
+    return [(document.fields["chunk_type"], document.fields["text"])]
+
+
+async def migrate(args):
+    source_client = ChromiaNodeClient(args.source_url)
+    target_client = ChromiaNodeClient(args.target_url) if args.target_url != args.source_url else source_client
+    source = BlockchainRidResolver(source_client)
+    target = BlockchainRidResolver(target_client, name=args.target_name, env_var="REEMBED_TARGET_BRID")
+    openai_client = None
+    try:
+        source_brid, target_brid = await source.get(), await target.get()
+        if (args.source_url, source_brid) == (args.target_url, target_brid):
+            raise ValueError("The target chain is the source chain; deploy a chain with the new dimensions first")
+        print(f"Migrating {source_brid} to {target_brid} with {args.dimensions} dimensions")
+
+        messages = await read_messages(source_client, source)
+        print(f"Read {len(messages)} messages")
+        if args.reembed:
+            openai_client = create_openai_client()
+            batcher = EmbeddingBatcher(openai_client, cache=get_embedding_cache(), dimensions=args.dimensions)
+        else:
+            stored = len(messages[0]["vector"]) if messages else args.dimensions
+            if stored < args.dimensions:
+                raise ValueError(f"Stored vectors have {stored} dimensions, use --reembed to get {args.dimensions}")
+            batcher = StoredVectors(messages, args.dimensions)
+
+        checkpoint = Checkpoint(args.checkpoint, target_brid)
+        if args.restart:
+            checkpoint.reset()
+        pipeline = IngestionPipeline(
+            target_client,
+            target,
+            batcher,
+            _chunk_message,
+            checkpoint=checkpoint,
+            embed_batch_size=batcher.max_batch_size,
+            tx_batch_size=args.tx_batch_size,
+            tx_concurrency=args.tx_concurrency,
+        )
+        stats = await pipeline.run(_documents(messages))
+        print(f"Migration complete! {stats.summary()}")
+        print(f"Run the API with EMBEDDING_DIMENSIONS={args.dimensions} VECTOR_BRID={target_brid}")
+    finally:
+        await source_client.close()
+        await target_client.close()
+        if openai_client is not None:
+            await openai_client.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Move the vector database to another number of embedding dimensions")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    config = commands.add_parser("config", help="Set vector_db_extension.dimensions in rell/chromia.yml")
+    config.add_argument("--dimensions", type=int, required=True)
+    config.add_argument("--config", default=DEFAULT_CONFIG_PATH, help="Path to chromia.yml")
+
+    node_url = os.environ.get("CHROMIA_NODE_URL", "http://localhost:7740")
+    migrate = commands.add_parser("migrate", help="Copy the messages into a chain with the new dimensions")
+    migrate.add_argument("--dimensions", type=int, required=True)
+    migrate.add_argument("--target-name", required=True, help="Name of the chain deployed with the new dimensions")
+    migrate.add_argument("--target-url", default=node_url, help="Node of the new chain")
+    migrate.add_argument("--source-url", default=node_url, help="Node of the current chain, found like the API does")
+    migrate.add_argument("--reembed", action="store_true", help="Embed the texts with the API instead of shortening the stored vectors")
+    migrate.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH, help="Checkpoint file used to resume interrupted runs")
+    migrate.add_argument("--restart", action="store_true", help="Ignore the checkpoint and copy everything again")
+    migrate.add_argument("--tx-concurrency", type=int, default=4, help="Concurrent transactions")
+    migrate.add_argument("--tx-batch-size", type=int, default=32, help="Messages stored per transaction")
+    return parser.parse_args()
+
+
+def main():
+    load_dotenv()
+    args = parse_args()
+    native = NATIVE_DIMENSIONS[EMBEDDING_MODEL]
+    if not 0 < args.dimensions <= native:
+        raise SystemExit(f"{EMBEDDING_MODEL} embeddings have 1 to {native} dimensions")
+    if args.command == "config":
+        set_config_dimensions(args.config, args.dimensions)
+        print(f"Set vector_db_extension.dimensions to {args.dimensions} in {args.config}")
+    else:
+        asyncio.run(migrate(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Exact re-ranking of vector search candidates.
+
+The node searches an HNSW index of `halfvec` vectors, which is approximate
+twice over: the index can miss neighbours, and float16 distances can order
+close candidates wrongly. `query_vector_db` therefore fetches
+`RERANK_FACTOR` times the requested results, and this stage re-scores them by
+the exact float32 cosine distance between the query and the candidates'
+full-precision embeddings, as kept by the embedding cache when the texts were
+embedded. Candidates without a cached embedding keep the distance of the
+search. Only the best k are returned, so a small `top_k` still puts the right
+texts into the prompt.
+"""
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.embedding_cache import EmbeddingCache, get_embedding_cache
+from app.embeddings import embedding_cache_key
+
+
+class Reranker:
+
+    def __init__(
+        self,
+        cache: EmbeddingCache,
+        factor: Optional[int] = None,
+        max_candidates: Optional[int] = None,
+        model_key: Optional[str] = None,
+    ):
+        self.cache = cache
+        self.factor = factor if factor is not None else int(os.environ.get("RERANK_FACTOR", "4"))
+        self.max_candidates = max_candidates if max_candidates is not None else int(os.environ.get("RERANK_MAX_CANDIDATES", "200"))
+        self.model_key = model_key or embedding_cache_key()
+
+        self.searches = 0
+        self.candidates_scored = 0
+        self.candidates_cached = 0
+        # Searches whose best k differ from the first k candidates of the search
+        self.reordered = 0
+
+    def candidates(self, k: int) -> int:
+        """Candidates to fetch for the best k, `k` when re-ranking is disabled with `RERANK_FACTOR=1`."""
+        return max(k, min(k * self.factor, self.max_candidates))
+
+    async def rerank(self, query: List[float], candidates: List[Dict[str, Any]], k: int) -> List[Dict[str, Any]]:
+        """The best k candidates, closest first, with exact distances where the embeddings are cached."""
+        if len(candidates) <= 1 or self.factor <= 1:
+            return candidates[:k]
+
+        # Not counted, the hit rate of the cache is about the texts sent to be embedded
+        vectors = await self.cache.aget_many(self.model_key, [candidate["text"] or "" for candidate in candidates], count=False)
+        cached = [i for i, vector in enumerate(vectors) if vector is not None and len(vector) == len(query)]
+        distances = [candidate["distance"] for candidate in candidates]
+        if cached:
+            matrix = np.asarray([vectors[i] for i in cached], dtype=np.float32)
+            query_vector = np.asarray(query, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector)
+            similarities = np.divide(matrix @ query_vector, norms, out=np.zeros(len(cached), dtype=np.float32), where=norms > 0)
+            # Clamped like pgvector does
+            for i, distance in zip(cached, 1.0 - np.clip(similarities, -1.0, 1.0)):
+                distances[i] = float(distance)
+
+        # Stable, candidates the search ranked higher win ties
+        best = sorted(range(len(candidates)), key=lambda i: distances[i])[:k]
+        self.searches += 1
+        self.candidates_scored += len(candidates)
+        self.candidates_cached += len(cached)
+        if best != list(range(len(best))):
+            self.reordered += 1
+        return [{**candidates[i], "distance": distances[i]} for i in best]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "factor": self.factor,
+            "searches": self.searches,
+            "candidate_cache_hit_rate": round(self.candidates_cached / self.candidates_scored, 4) if self.candidates_scored else 0.0,
+            "reordered": round(self.reordered / self.searches, 4) if self.searches else 0.0,
+        }
+
+
+_reranker: Optional[Reranker] = None
+
+
+def get_reranker() -> Reranker:
+    global _reranker
+    if _reranker is None:
+        _reranker = Reranker(get_embedding_cache())
+    return _reranker
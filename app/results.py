@@ -0,0 +1,88 @@
+"""
+Decoding of `query_closest_objects` results into typed records, and fusion
+of result rankings.
+
+The node answers with a GTV (or JSON) array of dicts, either `{id, distance}`
+without a query template or `{id, text, distance}` from the
+`get_messages_with_distance` template. The GTV decoder walks the encoded
+bytes once and builds the records directly, without an intermediate tree of
+dicts or any string rewriting.
+"""
+import json
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+
+from app import gtv
+from app.gtv import ASN_SEQUENCE, ASN_UTF8_STRING, GtvError, decode_value, read_header
+
+
+class SearchResult(NamedTuple):
+    id: Optional[int]
+    text: Optional[str]
+    distance: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "text": self.text, "distance": self.distance}
+
+
+def _from_item(item: Dict[str, Any]) -> SearchResult:
+    return SearchResult(item.get("id"), item.get("text"), float(item.get("distance", 1.0)))
+
+
+def _decode_gtv(data: bytes) -> List[SearchResult]:
+    view = memoryview(data)
+    tag, start, end = read_header(view, 0)
+    if tag != gtv.TAG_ARRAY:
+        raise GtvError(f"Expected a GTV array of results, got tag 0x{tag:02x}")
+    _, pos, end = read_header(view, start, ASN_SEQUENCE)
+
+    results = []
+    while pos < end:
+        tag, item_start, item_end = read_header(view, pos)
+        if tag != gtv.TAG_DICT:
+            raise GtvError(f"Expected a GTV dict per result, got tag 0x{tag:02x}")
+        _, field_pos, fields_end = read_header(view, item_start, ASN_SEQUENCE)
+
+        id = text = None
+        distance = 1.0
+        while field_pos < fields_end:
+            _, pair_start, pair_end = read_header(view, field_pos, ASN_SEQUENCE)
+            _, key_start, key_end = read_header(view, pair_start, ASN_UTF8_STRING)
+            key = bytes(view[key_start:key_end])
+            value, _ = decode_value(view, key_end)
+            if key == b"distance":
+                distance = float(value)
+            elif key == b"text":
+                text = value
+            elif key == b"id":
+                id = value
+            field_pos = pair_end
+
+        results.append(SearchResult(id, text, distance))
+        pos = item_end
+    return results
+
+
+def decode_search_results(payload: Union[bytes, str, List[Dict[str, Any]]]) -> List[SearchResult]:
+    """Decode a GTV encoded (bytes), JSON (str) or already decoded result list."""
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return _decode_gtv(bytes(payload))
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    return [_from_item(item) for item in payload]
+
+
+def fuse_rankings(rankings: List[List[Dict[str, Any]]], max_results: int, k: int = 60) -> List[Dict[str, Any]]:
+    """
+    Reciprocal rank fusion: a result scores 1 / (k + rank) in every ranking it appears in, so results ranked
+    well by several retrievers come first without comparing their incomparable scores. Results are matched by
+    `id` and keep the fields of each ranking they appear in, plus the fused `score`.
+    """
+    scores: Dict[Any, float] = {}
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking, start=1):
+            key = result["id"] if result.get("id") is not None else result["text"]
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            fused.setdefault(key, {}).update({name: value for name, value in result.items() if value is not None})
+    best = sorted(scores, key=lambda key: scores[key], reverse=True)[:max_results]
+    return [{**fused[key], "score": scores[key]} for key in best]
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the OpenAI and CoinGecko APIs.
+
+Together with `app.stub_node` they let the API run offline, e.g. for
+`app.benchmark_service`:
+
+    python -m app.stub_apis --openai-port 7741 --coingecko-port 7742
+    OPENAI_BASE_URL=http://127.0.0.1:7741/v1 COINGECKO_BASE_URL=http://127.0.0.1:7742/api/v3 uvicorn main:app
+
+Embeddings are hashed bags of words (`hash_embedding`): deterministic, and
+texts sharing words are close, so searches return sensible neighbours.
+Shortened embeddings are computed from them like the real API does. Chat
+completions return a fixed answer, streamed or not. CoinGecko serves the
+coins of data.yaml with made up market data. Every response can be delayed
+to model the latency of the real services.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import yaml
+from aiohttp import web
+
+from app.embed_crypto_data import DEFAULT_DATA_PATH
+from app.embeddings import NATIVE_DIMENSIONS, shorten_embedding
+from app.lexical_index import tokenize
+
+_SYMBOL = re.compile(r"\(([A-Z]{2,6})\)")
+
+STUB_ANSWER = (
+    "This answer comes from the stand-in OpenAI API. It has about the length of a short real answer, so the "
+    "prompt and response sizes of the benchmark are realistic, but it does not say anything about the question."
+)
+
+
+def hash_embedding(text: str, dimensions: int = 1536) -> List[float]:
+    """Unit vector of the word counts of the text, every word hashed to a signed component."""
+    vector = np.zeros(dimensions)
+    for token in tokenize(text):
+        digest = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+        vector[(digest >> 1) % dimensions] += 1.0 if digest & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        norm = 1.0
+    return (vector / norm).tolist()
+
+
+class StubOpenAI:
+
+    def __init__(self, embedding_latency: float = 0.0, completion_latency: float = 0.0):
+        self.embedding_latency = embedding_latency
+        self.completion_latency = completion_latency
+        self.requests = {"embeddings": 0, "chat_completions": 0}
+
+    def embed(self, text: str, model: str, dimensions: Optional[int] = None) -> List[float]:
+        native = NATIVE_DIMENSIONS.get(model, 1536)
+        vector = hash_embedding(text, native)
+        return shorten_embedding(vector, dimensions) if dimensions and dimensions != native else vector
+
+    async def handle_embeddings(self, request: web.Request) -> web.Response:
+        self.requests["embeddings"] += 1
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(self.embedding_latency)
+        data = []
+        for index, text in enumerate(texts):
+            vector = self.embed(text, body["model"], body.get("dimensions"))
+            if body.get("encoding_format") == "base64":
+                # What the OpenAI SDK asks for by default
+                vector = base64.b64encode(np.asarray(vector, dtype="<f4").tobytes()).decode()
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        tokens = sum(len(text.split()) for text in texts)
+        return web.json_response({
+            "object": "list",
+            "data": data,
+            "model": body["model"],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    async def handle_chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests["chat_completions"] += 1
+        body = await request.json()
+        completion = {"id": f"chatcmpl-stub{self.requests['chat_completions']}", "created": int(time.time()), "model": body["model"]}
+        if not body.get("stream"):
+            await asyncio.sleep(self.completion_latency)
+            return web.json_response({
+                **completion,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": STUB_ANSWER}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        words = STUB_ANSWER.split(" ")
+        # The answer is generated over the whole latency, a few words at a time
+        pieces = [" ".join(words[i:i + 4]) + " " for i in range(0, len(words), 4)]
+        for piece in pieces:
+            await asyncio.sleep(self.completion_latency / len(pieces))
+            chunk = {**completion, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        done = {**completion, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        await response.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode())
+        await response.write_eof()
+        return response
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/v1/embeddings", self.handle_embeddings),
+            web.post("/v1/chat/completions", self.handle_chat_completions),
+        ])
+        return app
+
+
+def load_stub_coins(path: str = DEFAULT_DATA_PATH) -> List[Dict[str, Any]]:
+    """CoinGecko coin list entries of the coins in data.yaml, ranked in file order."""
+    with open(path, "r") as file:
+        coins = yaml.safe_load(file)["cryptocurrencies"]
+    entries = []
+    for rank, coin in enumerate(coins, start=1):
+        symbol = _SYMBOL.search(coin["history"])
+        entries.append({
+            "id": coin["name"].lower().replace(" ", "-"),
+            "symbol": (symbol.group(1) if symbol else coin["name"][:3]).lower(),
+            "name": coin["name"],
+            "market_cap_rank": rank,
+        })
+    return entries
+
+
+class StubCoinGecko:
+
+    def __init__(self, coins: List[Dict[str, Any]], latency: float = 0.0):
+        self.coins = {coin["id"]: coin for coin in coins}
+        self.latency = latency
+        self.requests = 0
+
+    def _price(self, coin_id: str) -> float:
+        # Made up, but stable and different for every coin
+        return 1000.0 / self.coins[coin_id]["market_cap_rank"]
+
+    def _coin(self, request: web.Request) -> Dict[str, Any]:
+        coin = self.coins.get(request.match_info["id"])
+        if coin is None:
+            raise web.HTTPNotFound(text='{"error":"coin not found"}', content_type="application/json")
+        return coin
+
+    async def _delay(self):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+    async def handle_coin_list(self, request: web.Request) -> web.Response:
+        await self._delay()
+        return web.json_response([{key: coin[key] for key in ("id", "symbol", "name")} for coin in self.coins.values()])
+
+    async def handle_markets(self, request: web.Request) -> web.Response:
+        await self._delay()
+        page, per_page = int(request.query.get("page", "1")), int(request.query.get("per_page", "100"))
+        coins = list(self.coins.values())[(page - 1) * per_page:page * per_page]
+        return web.json_response([{**coin, "current_price": self._price(coin["id"])} for coin in coins])
+
+    async def handle_simple_price(self, request: web.Request) -> web.Response:
+        await self._delay()
+        prices = {}
+        for coin_id in request.query.get("ids", "").split(","):
+            if coin_id in self.coins:
+                price = self._price(coin_id)
+                prices[coin_id] = {
+                    "usd": price, "usd_market_cap": price * 1e7, "usd_24h_vol": price * 1e5, "usd_24h_change": 1.5,
+                    "btc": price / 50000, "eth": price / 3000, "last_updated_at": int(time.time()),
+                }
+        return web.json_response(prices)
+
+    async def handle_coin(self, request: web.Request) -> web.Response:
+        await self._delay()
+        coin = self._coin(request)
+        return web.json_response({
+            **coin,
+            "description": {"en": f"{coin['name']} served by the stand-in CoinGecko API."},
+            "asset_platform_id": None,
+            "genesis_date": None,
+            "links": {"homepage": [""], "repos_url": {"github": []}},
+            "sentiment_votes_up_percentage": 50.0,
+        })
+
+    async def handle_market_chart(self, request: web.Request) -> web.Response:
+        await self._delay()
+        coin = self._coin(request)
+        now, days = int(time.time() * 1000), int(request.query.get("days", "30"))
+        prices = [[now - day * 86400000, self._price(coin["id"])] for day in range(days, -1, -1)]
+        return web.json_response({"prices": prices, "market_caps": [], "total_volumes": []})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.get("/api/v3/coins/list", self.handle_coin_list),
+            web.get("/api/v3/coins/markets", self.handle_markets),
+            web.get("/api/v3/simple/price", self.handle_simple_price),
+            web.get("/api/v3/coins/{id}", self.handle_coin),
+            web.get("/api/v3/coins/{id}/market_chart", self.handle_market_chart),
+        ])
+        return app
+
+
+async def start_stub_app(app: web.Application, host: str = "127.0.0.1", port: int = 7741) -> web.AppRunner:
+    """Start a stand-in in the running event loop; call `runner.cleanup()` to stop it."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def _serve(args):
+    await start_stub_app(StubOpenAI(args.embedding_latency, args.completion_latency).make_app(), args.host, args.openai_port)
+    await start_stub_app(StubCoinGecko(load_stub_coins(args.data), args.coingecko_latency).make_app(), args.host, args.coingecko_port)
+    print(f"OPENAI_BASE_URL=http://{args.host}:{args.openai_port}/v1")
+    print(f"COINGECKO_BASE_URL=http://{args.host}:{args.coingecko_port}/api/v3")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run local stand-ins for the OpenAI and CoinGecko APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--openai-port", type=int, default=7741)
+    parser.add_argument("--coingecko-port", type=int, default=7742)
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH, help="Path to data.yaml, the coins served by CoinGecko")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Seconds every embeddings request takes")
+    parser.add_argument("--completion-latency", type=float, default=0.0, help="Seconds every chat completion takes")
+    parser.add_argument("--coingecko-latency", type=float, default=0.0, help="Seconds every CoinGecko request takes")
+    asyncio.run(_serve(parser.parse_args()))
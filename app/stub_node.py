@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a Chromia node running the vector_example dapp.
+
+Serves the subset of the node REST API used by `app.chromia_client` from
+memory, so the API and ingestion scripts can be run and tested offline:
+
+    python -m app.stub_node --port 7740
+
+Vector search is an exact cosine distance scan, matching the ordering of the
+`halfvec_cosine_ops` index used by the real extension. The scan runs over a
+matrix of each context's vectors, rebuilt after writes, so the stand-in keeps
+up with benchmarks over some thousands of vectors.
+"""
+import argparse
+import json
+import os
+import secrets
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from aiohttp import web
+
+from app import gtv
+from app.chromia_client import (
+    GTV_CONTENT_TYPE,
+    TX_STATUS_CONFIRMED,
+    TX_STATUS_REJECTED,
+    TX_STATUS_UNKNOWN,
+    VECTOR_BLOCKCHAIN_NAME,
+)
+from app.vectors import decode_vector, pack_vector
+
+
+# The extension's default `vector_db_extension.dimensions`
+DEFAULT_DIMENSIONS = 1536
+
+
+class StubNodeError(Exception):
+    pass
+
+
+class StubNode:
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+        self.directory_brid = secrets.token_bytes(32)
+        self.vector_brid = secrets.token_bytes(32)
+        self.messages: Dict[int, str] = {}
+        # coin -> context, and message rowid -> (coin, chunk type) of the tagged messages
+        self.coin_contexts: Dict[str, int] = {}
+        self.tags: Dict[int, Tuple[str, str]] = {}
+        self.vectors: Dict[Tuple[int, int], List[float]] = {}
+        self.tx_status: Dict[str, Dict[str, Any]] = {}
+        self._next_rowid = 1
+        # context -> (ids, unit vectors) scanned by searches, dropped when the context is written
+        self._matrices: Dict[int, Tuple[List[int], np.ndarray]] = {}
+
+        self.operations: Dict[str, Callable[..., None]] = {
+            "add_message": self._op_add_message,
+            "add_messages": self._op_add_messages,
+            "add_message_binary": self._op_add_message,
+            "add_messages_binary": self._op_add_messages,
+            "add_tagged_messages": self._op_add_tagged_messages,
+            "add_tagged_messages_binary": self._op_add_tagged_messages,
+            "delete_message": self._op_delete_message,
+            "nop": lambda *args: None,
+        }
+        self.queries: Dict[str, Callable[..., Any]] = {
+            "get_coin_context": self._query_get_coin_context,
+            "get_message_texts": self._query_get_message_texts,
+        }
+        self.query_templates: Dict[str, Callable[..., Any]] = {
+            "get_messages": self._template_get_messages,
+            "get_messages_with_distance": self._template_get_messages_with_distance,
+            "get_messages_with_filter": self._template_get_messages_with_filter,
+            "get_messages_with_vectors": self._template_get_messages_with_vectors,
+            "get_messages_with_ids": self._template_get_messages_with_ids,
+        }
+
+    # Vector storage, mirrors VectorDbDatabaseOperations
+
+    def store_vector(self, context: int, vector: Any, id: int):
+        values = self.parse_vector(vector)
+        if len(values) != self.dimensions:
+            raise StubNodeError(f"expected {self.dimensions} dimensions, not {len(values)}")
+        self.vectors[(context, id)] = values
+        self._matrices.pop(context, None)
+
+    def parse_vector(self, vector: Any) -> List[float]:
+        try:
+            return decode_vector(vector, self.dimensions)
+        except ValueError as e:
+            raise StubNodeError(str(e))
+
+    def delete_vector(self, context: int, id: int):
+        self.vectors.pop((context, id), None)
+        self._matrices.pop(context, None)
+
+    def _matrix(self, context: int) -> Tuple[List[int], np.ndarray]:
+        if context not in self._matrices:
+            ids = sorted(id for ctx, id in self.vectors if ctx == context)
+            matrix = np.array([self.vectors[(context, id)] for id in ids], dtype=np.float64).reshape(len(ids), self.dimensions)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            # A zero vector is at distance 1 of everything
+            self._matrices[context] = (ids, np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0))
+        return self._matrices[context]
+
+    def query_closest_objects(self, args: Dict[str, Any]) -> Any:
+        try:
+            context = args["context"]
+            query = self.parse_vector(args["q_vector"])
+            max_distance = float(args["max_distance"])
+        except KeyError as e:
+            raise StubNodeError(f"No {e.args[0]} argument supplied")
+        max_vectors = args.get("max_vectors", 10)
+
+        ids, matrix = self._matrix(context)
+        query = np.asarray(query, dtype=np.float64)
+        norm = np.linalg.norm(query)
+        distances = 1.0 - matrix @ (query / norm) if norm > 0 else np.ones(len(ids))
+        # Closest first, ties by id
+        order = np.lexsort((ids, distances))[:max_vectors]
+        closest = [{"id": ids[i], "distance": repr(float(distances[i]))} for i in order if distances[i] <= max_distance]
+
+        return self._apply_query_template(args.get("query_template"), closest)
+
+    def get_vectors(self, args: Dict[str, Any]) -> Any:
+        try:
+            context = args["context"]
+        except KeyError as e:
+            raise StubNodeError(f"No {e.args[0]} argument supplied")
+        after_id = args.get("after_id", -1)
+        max_vectors = args.get("max_vectors", 1000)
+
+        page = sorted(
+            (id, vector)
+            for (ctx, id), vector in self.vectors.items()
+            if ctx == context and id > after_id
+        )[:max_vectors]
+        vectors = [{"id": id, "vector": pack_vector(vector)} for id, vector in page]
+        return self._apply_query_template(args.get("query_template"), vectors)
+
+    def _apply_query_template(self, template: Optional[Dict[str, Any]], result: List[Dict[str, Any]]) -> Any:
+        if template is None:
+            return result
+        template_type = template.get("type")
+        if template_type not in self.query_templates:
+            raise StubNodeError(f"Unknown query: {template_type}")
+        return self.query_templates[template_type](result, **template.get("args", {}))
+
+    # vector_example dapp operations and queries
+
+    def _op_add_message(self, text: str, vector: Any):
+        rowid = self._next_rowid
+        self.store_vector(0, vector, rowid)
+        self._next_rowid += 1
+        self.messages[rowid] = text
+
+    def _op_add_messages(self, messages: List[List[Any]]):
+        for text, vector in messages:
+            self._op_add_message(text, vector)
+
+    def _op_add_tagged_messages(self, messages: List[List[Any]]):
+        for text, vector, coin, chunk_type in messages:
+            rowid = self._next_rowid
+            self._op_add_message(text, vector)
+            coin = coin.lower()
+            if coin not in self.coin_contexts:
+                # Contexts are coin_context rowids, from the same sequence as the messages
+                self.coin_contexts[coin] = self._next_rowid
+                self._next_rowid += 1
+            self.store_vector(self.coin_contexts[coin], vector, rowid)
+            self.tags[rowid] = (coin, chunk_type)
+
+    def _op_delete_message(self, text: str):
+        for rowid, message in list(self.messages.items()):
+            if message == text:
+                tag = self.tags.pop(rowid, None)
+                if tag is not None:
+                    self.delete_vector(self.coin_contexts[tag[0]], rowid)
+                self.delete_vector(0, rowid)
+                del self.messages[rowid]
+                return
+        raise StubNodeError(f"No message '{text}'")
+
+    def _query_get_coin_context(self, coin: str) -> Optional[int]:
+        return self.coin_contexts.get(coin.lower())
+
+    def _query_get_message_texts(self, after_id: int, max_messages: int) -> List[Dict[str, Any]]:
+        ids = sorted(rowid for rowid in self.messages if rowid > after_id)[:max_messages]
+        return self._template_get_messages_with_ids([{"id": rowid} for rowid in ids])
+
+    def _template_get_messages(self, closest_results: List[Dict[str, Any]]) -> List[str]:
+        return [self.messages[result["id"]] for result in closest_results]
+
+    def _template_get_messages_with_distance(self, closest_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [
+            {"id": result["id"], "text": self.messages[result["id"]], "distance": result["distance"]}
+            for result in closest_results
+        ]
+
+    def _template_get_messages_with_filter(self, closest_results: List[Dict[str, Any]], text_filter: str) -> List[str]:
+        return [text for text in self._template_get_messages(closest_results) if text_filter in text]
+
+    def _template_get_messages_with_vectors(self, vectors: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [
+            {"id": vector["id"], "text": self.messages.get(vector["id"]), "vector": vector["vector"]}
+            for vector in vectors
+        ]
+
+    def _template_get_messages_with_ids(self, vectors: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        results = []
+        for vector in vectors:
+            coin, chunk_type = self.tags.get(vector["id"], (None, None))
+            results.append({"id": vector["id"], "text": self.messages.get(vector["id"]), "coin": coin, "chunk_type": chunk_type})
+        return results
+
+    # REST API
+
+    def _check_brid(self, request: web.Request) -> bytes:
+        brid = bytes.fromhex(request.match_info["brid"])
+        if brid not in (self.directory_brid, self.vector_brid):
+            raise web.HTTPNotFound(text=json.dumps({"error": f"Can't find blockchain with blockchainRID: {brid.hex().upper()}"}))
+        return brid
+
+    async def handle_root(self, request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def handle_brid(self, request: web.Request) -> web.Response:
+        iids = {"iid_0": self.directory_brid, "iid_1": self.vector_brid}
+        brid = iids.get(request.match_info["iid"])
+        if brid is None:
+            raise web.HTTPNotFound(text=json.dumps({"error": "Unknown chain"}))
+        return web.Response(text=brid.hex().upper())
+
+    async def handle_query_gtv(self, request: web.Request) -> web.Response:
+        brid = self._check_brid(request)
+        name, args = gtv.decode(await request.read())
+        try:
+            if brid == self.directory_brid and name == "get_blockchains":
+                result = [{"rid": self.vector_brid, "name": VECTOR_BLOCKCHAIN_NAME, "system": 0, "state": "RUNNING"}]
+            elif brid == self.vector_brid and name == "query_closest_objects":
+                result = self.query_closest_objects(args)
+            elif brid == self.vector_brid and name == "get_vectors":
+                result = self.get_vectors(args)
+            elif brid == self.vector_brid and name in self.queries:
+                result = self.queries[name](**args)
+            else:
+                raise StubNodeError(f"Unknown query: {name}")
+        except StubNodeError as e:
+            return web.Response(status=400, body=gtv.encode(str(e)), content_type=GTV_CONTENT_TYPE)
+        return web.Response(body=gtv.encode(result), content_type=GTV_CONTENT_TYPE)
+
+    async def handle_tx(self, request: web.Request) -> web.Response:
+        brid = self._check_brid(request)
+        body, _ = gtv.decode(await request.read())
+        tx_rid = gtv.merkle_hash(body).hex()
+        if body[0] != brid:
+            raise web.HTTPBadRequest(text=json.dumps({"error": "Transaction is for a different blockchain"}))
+
+        # Operations are all-or-nothing like a real transaction
+        snapshot = (dict(self.messages), dict(self.coin_contexts), dict(self.tags), dict(self.vectors), self._next_rowid)
+        try:
+            for name, args in body[1]:
+                if name not in self.operations:
+                    raise StubNodeError(f"Unknown operation: {name}")
+                self.operations[name](*args)
+            self.tx_status[tx_rid] = {"status": TX_STATUS_CONFIRMED}
+        except (StubNodeError, TypeError, ValueError) as e:
+            self.messages, self.coin_contexts, self.tags, self.vectors, self._next_rowid = snapshot
+            self._matrices = {}
+            self.tx_status[tx_rid] = {"status": TX_STATUS_REJECTED, "rejectReason": str(e)}
+        return web.json_response({})
+
+    async def handle_tx_status(self, request: web.Request) -> web.Response:
+        self._check_brid(request)
+        return web.json_response(self.tx_status.get(request.match_info["tx_rid"].lower(), {"status": TX_STATUS_UNKNOWN}))
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.add_routes([
+            web.get("/", self.handle_root),
+            web.get("/brid/{iid}", self.handle_brid),
+            web.post("/query_gtv/{brid}", self.handle_query_gtv),
+            web.post("/tx/{brid}", self.handle_tx),
+            web.get("/tx/{brid}/{tx_rid}/status", self.handle_tx_status),
+        ])
+        return app
+
+
+async def start_stub_node(node: StubNode, host: str = "127.0.0.1", port: int = 7740) -> web.AppRunner:
+    """Start the stand-in node in the running event loop; call `runner.cleanup()` to stop it."""
+    runner = web.AppRunner(node.make_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stand-in Chromia node")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7740)
+    parser.add_argument("--dimensions", type=int, default=int(os.environ.get("EMBEDDING_DIMENSIONS", DEFAULT_DIMENSIONS)))
+    args = parser.parse_args()
+
+    stub = StubNode(args.dimensions)
+    print(f"Vector blockchain RID: {stub.vector_brid.hex().upper()}")
+    web.run_app(stub.make_app(), host=args.host, port=args.port)
@@ -0,0 +1,201 @@
+"""
+In-process mirror of the `message` vectors of the vector database.
+
+Read-heavy search traffic can be answered from memory instead of a node round
+trip. The index keeps a NumPy matrix of normalized float32 embeddings, synced
+from the chain like every `ChainMirror`.
+
+Distances are cosine distances of the vectors as stored in `halfvec`, so the
+query vector is rounded to float16 first, like `?::halfvec` in
+`VectorDbDatabaseOperations`. Small indexes are searched exhaustively; from
+`VECTOR_INDEX_IVF_MIN_SIZE` vectors an inverted file (spherical k-means lists)
+limits the scan to the `VECTOR_INDEX_NPROBE` lists closest to the query.
+
+`search` returns None while the index is stale (not synced within
+`VECTOR_INDEX_MAX_STALENESS_S`, or after a local write that has not been
+synced yet), and the caller falls back to the node.
+"""
+import asyncio
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.blockchain_rid import BlockchainRidResolver, get_rid_resolver
+from app.chain_mirror import ChainMirror
+from app.chromia_client import ChromiaNodeClient, get_node_client
+from app.results import SearchResult
+
+# Rows assigned to inverted lists per matrix multiplication, bounds the temporary memory
+_ASSIGN_CHUNK = 8192
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+class _InvertedLists:
+    """Rows grouped by their closest centroid of a spherical k-means clustering."""
+
+    def __init__(self, matrix: np.ndarray, n_lists: int, iterations: int = 10, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        sample = matrix[rng.choice(len(matrix), min(len(matrix), n_lists * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for list_no in range(n_lists):
+                members = sample[assignment == list_no]
+                if len(members):
+                    centroids[list_no] = members.sum(axis=0)
+            centroids = _normalize(centroids)
+        self.centroids = centroids
+        self.assignment = np.zeros(0, dtype=np.int32)
+        self.add(matrix)
+
+    def add(self, rows: np.ndarray):
+        assignment = [
+            np.argmax(rows[i:i + _ASSIGN_CHUNK] @ self.centroids.T, axis=1).astype(np.int32)
+            for i in range(0, len(rows), _ASSIGN_CHUNK)
+        ]
+        self.assignment = np.concatenate([self.assignment, *assignment])
+
+    def candidates(self, query: np.ndarray, n_probe: int, size: int) -> np.ndarray:
+        closest_lists = np.argsort(-(self.centroids @ query))[:n_probe]
+        return np.flatnonzero(np.isin(self.assignment[:size], closest_lists))
+
+
+class VectorIndex(ChainMirror):
+
+    query_template = {"type": "get_messages_with_vectors"}
+    name = "vector index"
+
+    def __init__(
+        self,
+        node_client: ChromiaNodeClient,
+        rid_resolver: BlockchainRidResolver,
+        context: int = 0,
+        refresh_interval: Optional[float] = None,
+        max_staleness: Optional[float] = None,
+        full_sync_interval: Optional[float] = None,
+        page_size: int = 1000,
+        ivf_min_size: Optional[int] = None,
+        n_probe: Optional[int] = None,
+    ):
+        super().__init__(
+            node_client, rid_resolver, "VECTOR_INDEX", context, refresh_interval, max_staleness, full_sync_interval, page_size
+        )
+        self.ivf_min_size = ivf_min_size if ivf_min_size is not None else int(os.environ.get("VECTOR_INDEX_IVF_MIN_SIZE", "50000"))
+        self.n_probe = n_probe if n_probe is not None else int(os.environ.get("VECTOR_INDEX_NPROBE", "8"))
+
+        # Rows below `_size` are never modified, so searches in a worker thread can use a snapshot
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._texts: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._size = 0
+        self._lists: Optional[_InvertedLists] = None
+
+        self.hits = 0
+        self.fallbacks = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _load(self, rows: List[Dict[str, Any]], full: bool):
+        ids = [row["id"] for row in rows]
+        texts = [row["text"] for row in rows]
+        matrix = _normalize(np.vstack([np.frombuffer(row["vector"], dtype="<f4") for row in rows])) if rows else None
+        if full:
+            self._replace(ids, texts, matrix)
+        elif matrix is not None:
+            self._append(ids, texts, matrix)
+
+    def _replace(self, ids: List[int], texts: List[str], rows: Optional[np.ndarray]):
+        lists = None
+        if rows is not None and len(rows) >= self.ivf_min_size:
+            lists = _InvertedLists(rows, max(1, int(np.sqrt(len(rows)))))
+        self._ids = np.asarray(ids, dtype=np.int64)
+        self._texts = texts
+        self._matrix = rows
+        self._lists = lists
+        self._size = len(ids)
+
+    def _append(self, ids: List[int], texts: List[str], rows: np.ndarray):
+        size = self._size + len(ids)
+        if self._matrix is None or self._matrix.shape[1] != rows.shape[1]:
+            self._replace(ids, texts, rows)
+            return
+        if size > len(self._matrix):
+            # Grow the capacity geometrically; searches keep using the old arrays
+            capacity = max(size, 2 * len(self._matrix))
+            matrix = np.empty((capacity, rows.shape[1]), dtype=np.float32)
+            matrix[:self._size] = self._matrix[:self._size]
+            id_array = np.empty(capacity, dtype=np.int64)
+            id_array[:self._size] = self._ids[:self._size]
+            self._matrix, self._ids = matrix, id_array
+        self._matrix[self._size:size] = rows
+        self._ids[self._size:size] = ids
+        self._texts.extend(texts)
+        if self._lists is not None:
+            self._lists.add(rows)
+        self._size = size
+
+    async def search(self, vector: List[float], max_results: int, max_distance: float = 1.0) -> Optional[List[SearchResult]]:
+        """Closest messages to the vector, or None if the index can not answer for the chain right now."""
+        if not self.fresh or self._matrix is None or len(vector) != self._matrix.shape[1]:
+            self.fallbacks += 1
+            return None
+        self.hits += 1
+        return await asyncio.to_thread(self._search, vector, max_results, max_distance)
+
+    def _search(self, vector: List[float], max_results: int, max_distance: float) -> List[SearchResult]:
+        ids, texts, matrix, size, lists = self._ids, self._texts, self._matrix, self._size, self._lists
+        query = _normalize(np.asarray(vector, dtype=np.float16).astype(np.float32))
+
+        rows = None
+        if lists is not None:
+            rows = lists.candidates(query, self.n_probe, size)
+            if len(rows) < max_results:
+                rows = None
+        # Similarity is clamped to [-1, 1] like pgvector does
+        distances = 1.0 - np.clip((matrix[rows] if rows is not None else matrix[:size]) @ query, -1.0, 1.0)
+
+        k = min(max_results, len(distances))
+        if k == 0:
+            return []
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top], kind="stable")]
+        if rows is not None:
+            positions, top_distances = rows[top], distances[top]
+        else:
+            positions, top_distances = top, distances[top]
+        return [
+            SearchResult(int(ids[position]), texts[position], float(distance))
+            for position, distance in zip(positions, top_distances)
+            if distance <= max_distance
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.fallbacks
+        return {
+            "size": self._size,
+            "fresh": self.fresh,
+            "ivf": self._lists is not None,
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_vector_index: Optional[VectorIndex] = None
+
+
+def get_vector_index() -> Optional[VectorIndex]:
+    """Process-wide index, or None unless enabled with `VECTOR_INDEX=1`."""
+    global _vector_index
+    if os.environ.get("VECTOR_INDEX", "0").lower() not in ("1", "true", "yes"):
+        return None
+    if _vector_index is None:
+        _vector_index = VectorIndex(get_node_client(), get_rid_resolver())
+    return _vector_index
@@ -0,0 +1,58 @@
+"""
+Wire formats of vectors sent to the vector database.
+
+Vectors are sent as a `byte_array` of packed little-endian floats, which is a
+fraction of the size of the decimal text form and needs no parsing on the
+node. float16 is the default as the extension stores vectors as `halfvec`
+anyway, so it loses no precision compared to what ends up in the index.
+The text form (`[0.1,0.2,...]`) is kept for nodes running older dapps.
+
+The format is chosen with the `VECTOR_FORMAT` environment variable:
+`float16` (default), `float32` or `text`.
+"""
+import json
+import os
+import struct
+from typing import List, Optional, Union
+
+VECTOR_FORMAT_TEXT = "text"
+
+_FORMATS = {"float32": "f", "float16": "e"}
+DTYPES = tuple(_FORMATS)
+
+
+def pack_vector(vector: List[float], dtype: str = "float32") -> bytes:
+    return struct.pack(f"<{len(vector)}{_FORMATS[dtype]}", *vector)
+
+
+def unpack_vector(blob: bytes, dtype: str = "float32") -> List[float]:
+    fmt = _FORMATS[dtype]
+    return list(struct.unpack(f"<{len(blob) // struct.calcsize(fmt)}{fmt}", blob))
+
+
+def vector_format() -> str:
+    fmt = os.environ.get("VECTOR_FORMAT", "float16")
+    if fmt != VECTOR_FORMAT_TEXT and fmt not in _FORMATS:
+        raise ValueError(f"Unsupported vector format: {fmt}")
+    return fmt
+
+
+def encode_vector(vector: List[float], fmt: Optional[str] = None) -> Union[str, bytes]:
+    """Encode a vector for `add_message(s)` and `query_closest_objects` in the configured format."""
+    fmt = fmt or vector_format()
+    if fmt == VECTOR_FORMAT_TEXT:
+        return json.dumps(vector)
+    return pack_vector(vector, fmt)
+
+
+def decode_vector(vector: Union[str, bytes], dimensions: Optional[int] = None) -> List[float]:
+    """Decode either wire format; the element size of a binary vector is derived from `dimensions`."""
+    if isinstance(vector, str):
+        return [float(value) for value in json.loads(vector)]
+    if dimensions is None:
+        raise ValueError("Cannot decode a binary vector without knowing its dimensions")
+    if len(vector) == dimensions * 2:
+        return unpack_vector(vector, "float16")
+    if len(vector) == dimensions * 4:
+        return unpack_vector(vector, "float32")
+    raise ValueError(f"Binary vector of {len(vector)} bytes is neither float16 nor float32 with {dimensions} dimensions")
@@ -1,18 +1,24 @@
-from fastapi import FastAPI, HTTPException, Body, Depends
+from fastapi import FastAPI, HTTPException, Body, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import os
 import json
 import asyncio
-import re
+import time
 import aiohttp
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
+from datetime import datetime
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Dict, Any, Optional
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 load_dotenv()
 from app.models import (
     TextEmbeddingResponse,
+    TextEmbeddingBatchRequest,
+    TextEmbeddingBatchItem,
+    TextEmbeddingBatchResponse,
     TextSearchRequest,
     TextSearchResponse,
     TextConversationRequest,
@@ -20,19 +26,106 @@ from app.models import (
     TextEmbeddingRequest,
 )
 
-from app.coingecko_api import get_coin_info
+from app.coingecko_api import get_coin_info, get_coin_registry, get_coingecko_client
+from app.coin_matcher import SYMBOL_TO_NAME, get_coin_matcher
+from app.chromia_client import CONTEXT_MESSAGE, TX_STATUS_CONFIRMED, get_node_client
+from app.blockchain_rid import get_rid_resolver
+from app.coin_contexts import get_coin_contexts
+from app.embeddings import embedding_dimensions, get_embedding_batcher
+from app.openai_client import create_openai_client, get_openai_client
+from app.embedding_cache import get_embedding_cache
+from app.results import decode_search_results, fuse_rankings
+from app.vectors import encode_vector
+from app.vector_index import get_vector_index
+from app.lexical_index import get_lexical_index
+from app.reranker import get_reranker
+from app.answer_cache import CachedAnswer, get_answer_cache
+from app.context import get_context_assembler
+from app.pipeline import StageFailed, StagePipeline, StageStats
 # Import database modules
-from app.database import init_db, get_db, store_embedding, store_conversation, get_recent_conversations
-
-app = FastAPI(title="Chromia Research Agent")
+from app.database import (
+    init_db,
+    close_db,
+    get_db,
+    get_write_queue,
+    store_embedding,
+    store_conversation,
+    get_conversations,
+    stream_conversations,
+    decode_cursor,
+)
 
-# Initialize database on startup
-@app.lifespan_events()
-async def startup_event():
-    init_db()
+node_client = get_node_client()
+rid_resolver = get_rid_resolver()
+# Optional in-process read-through index for searches, enabled with VECTOR_INDEX=1
+vector_index = get_vector_index()
+# Optional BM25 index of the messages for mode=hybrid searches, enabled with LEXICAL_INDEX=1
+lexical_index = get_lexical_index()
+# Exact re-scoring of the vector search candidates
+reranker = get_reranker()
+# Both mirror the messages of the chain and are told about local writes
+chain_mirrors = [mirror for mirror in (vector_index, lexical_index) if mirror is not None]
+answer_cache = get_answer_cache()
+# Contexts of the per coin vectors, for searches limited to one coin
+coin_contexts = get_coin_contexts()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Initialize database and the pooled node connection on startup
+    await init_db()
+    await node_client.start()
+    # One OpenAI client for all requests, handed to the handlers by get_openai_client
+    try:
+        app.state.openai_client = create_openai_client()
+    except ValueError as e:
+        app.state.openai_client = None
+        print(str(e))
+    try:
+        print(f"Using blockchain RID: {await rid_resolver.get()}")
+    except Exception as e:
+        # Resolved again on first use
+        print(f"Could not resolve blockchain RID on startup: {str(e)}")
+    for mirror in chain_mirrors:
+        await mirror.start()
+    # Served from the copy on disk while a fresh coin list is downloaded
+    get_coin_registry().start()
+    yield
+    await get_coin_registry().close()
+    await get_coingecko_client().close()
+    for mirror in chain_mirrors:
+        await mirror.close()
+    await node_client.close()
+    if app.state.openai_client is not None:
+        await app.state.openai_client.close()
+    get_embedding_cache().close()
+    # Commits the conversations still queued
+    await close_db()
+
+
+app = FastAPI(title="Chromia Research Agent", lifespan=lifespan)
 
 coingecko_api_key = os.environ.get("COINGECKO_API_KEY")
 
+# Number of messages stored per transaction by /v1/text_embedding/batch
+EMBEDDING_TX_BATCH_SIZE = int(os.environ.get("EMBEDDING_TX_BATCH_SIZE", "32"))
+
+# Candidates fetched from each retriever per requested result in mode=hybrid searches
+HYBRID_CANDIDATES_FACTOR = int(os.environ.get("HYBRID_CANDIDATES_FACTOR", "4"))
+
+# Timeouts in seconds of the /v1/text_conversation stages, e.g. CONVERSATION_MARKET_DATA_TIMEOUT_S
+CONVERSATION_STAGE_TIMEOUTS = {
+    stage: float(os.environ.get(f"CONVERSATION_{stage.upper()}_TIMEOUT_S", default))
+    for stage, default in (
+        ("embedding", "10"),
+        ("vector_search", "10"),
+        ("coin_extraction", "10"),
+        ("market_data", "10"),
+        ("answer", "60"),
+    )
+}
+conversation_stage_stats = StageStats()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -41,19 +134,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def get_openai_client():
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="OpenAI API key not found")
-    return OpenAI(api_key=api_key)
-
-
 async def get_embedding(client, text: str) -> List[float]:
     try:
-        response = await asyncio.to_thread(
-            lambda: client.embeddings.create(model="text-embedding-3-small", input=text)
-        )
-        return response.data[0].embedding
+        return await get_embedding_batcher(client).embed(text)
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error generating embedding: {str(e)}"
@@ -61,68 +144,73 @@ async def get_embedding(client, text: str) -> List[float]:
 
 
 async def get_blockchain_rid():
-    process = await asyncio.create_subprocess_shell(
-        "pmc blockchains | jq -r '.[] | select(.Name == \"vector_blockchain\") | .Rid'",
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        shell=True,
-    )
-    stdout, stderr = await process.communicate()
-
-    vector_brid = stdout.decode().strip()
-    if not vector_brid:
-        raise HTTPException(status_code=500, detail="Could not fetch blockchain RID")
-
-    return vector_brid
+    try:
+        return await rid_resolver.get()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Could not fetch blockchain RID: {str(e)}")
 
 
 async def query_vector_db(
-    vector: List[float], max_results: int
+    vector: List[float], max_results: int, context: int = CONTEXT_MESSAGE
 ) -> List[Dict[str, Any]]:
+    # Over-fetched and re-scored with the full-precision embeddings, see app.reranker
+    candidates = reranker.candidates(max_results)
     try:
-        vector_brid = await get_blockchain_rid()
-
-        vector_str = json.dumps(vector)
-
-        cmd = (
-            f"chr query -brid {vector_brid} query_closest_objects "
-            f"context=0 q_vector='{vector_str}' max_distance=1.0 "
-            f'max_vectors={max_results} \'query_template=["type":"get_messages_with_distance"]\''
+        # The in-process index mirrors all messages; the context of a coin is searched by the node
+        if vector_index is not None and context == CONTEXT_MESSAGE:
+            results = await vector_index.search(vector, candidates, max_distance=1.0)
+            if results is not None:
+                return await reranker.rerank(vector, [result.to_dict() for result in results], max_results)
+
+        vector_str = encode_vector(vector)
+
+        results = await rid_resolver.run(
+            lambda vector_brid: node_client.query_closest_objects(
+                vector_brid,
+                vector_str,
+                candidates,
+                max_distance=1.0,
+                context=context,
+                query_template={"type": "get_messages_with_distance"},
+                decoder=decode_search_results,
+            )
         )
 
-        process = await asyncio.create_subprocess_shell(
-            cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            shell=True,
+        return await reranker.rerank(vector, [result.to_dict() for result in results], max_results)
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error querying vector database: {str(e)}"
         )
-        stdout, _ = await process.communicate()
 
-        results = stdout.decode().strip()
-        if not results or results == "[]":
-            return []
 
-        text_pattern = re.compile(r'"text": "([^"]*)"')
-        distance_pattern = re.compile(r'"distance": "([^"]*)"')
+def question_coin(text: str) -> Optional[str]:
+    """
+    The one coin a text plainly names, None if it names several, none or possibly others. Words that may be registry
+    coins ("Core features of Bitcoin?") do not hide the coin that is named.
+    """
+    match = get_coin_matcher(get_coin_registry()).match(text)
+    if match.unclear or match.default or len(match.coins) != 1:
+        return None
+    return match.coins[0]
 
-        text_matches = text_pattern.findall(results)
-        distance_matches = distance_pattern.findall(results)
 
-        processed_results = []
-        for i in range(min(len(text_matches), len(distance_matches))):
-            processed_results.append(
-                {"text": text_matches[i], "distance": float(distance_matches[i])}
-            )
+async def query_coin_vector_db(vector: List[float], max_results: int, coin: Optional[str]) -> List[Dict[str, Any]]:
+    """Search the messages about the coin if any are tagged with it, all messages otherwise."""
+    context = await coin_contexts.get(coin) if coin else None
+    return await query_vector_db(vector, max_results, context if context is not None else CONTEXT_MESSAGE)
 
-        return processed_results
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"Error querying vector database: {str(e)}"
-        )
+async def extract_coin_names_from_text(client, text: str) -> List[str]:
+    # Most questions name their coins plainly, the model is only asked about the ambiguous ones
+    match = get_coin_matcher(get_coin_registry()).match(text)
+    if not match.ambiguous:
+        return match.coins
+    coins = await extract_coin_names_with_llm(client, text)
+    return coins or match.coins
 
 
-async def extract_coin_names_from_text(client, text: str) -> List[str]:
+async def extract_coin_names_with_llm(client, text: str) -> List[str]:
     try:
         system_prompt = """You are a cryptocurrency identification expert. 
                             Extract any cryptocurrency names mentioned in the user's text. 
@@ -131,19 +219,17 @@ async def extract_coin_names_from_text(client, text: str) -> List[str]:
                             Return multiple cryptos as a comma-separated list.
                             Only return the official names or symbols, nothing else."""
 
-        response = await asyncio.to_thread(
-            lambda: client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {
-                        "role": "user",
-                        "content": f"Extract the correct cryptocurrency symbol from this text: {text}",
-                    },
-                ],
-                temperature=0.0,
-                max_tokens=50,
-            )
+        response = await client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {
+                    "role": "user",
+                    "content": f"Extract the correct cryptocurrency symbol from this text: {text}",
+                },
+            ],
+            temperature=0.0,
+            max_tokens=50,
         )
 
         extracted_text = response.choices[0].message.content.strip()
@@ -158,33 +244,8 @@ async def extract_coin_names_from_text(client, text: str) -> List[str]:
         # Remove any that are empty strings
         coins = [coin for coin in coins if coin]
 
-        # For symbols, map common ones to their full names for better CoinGecko API matching
-        symbol_to_name = {
-            "BTC": "Bitcoin",
-            "ETH": "Ethereum",
-            "SOL": "Solana",
-            "CHR": "Chromia",
-            "NEAR": "NEAR Protocol",
-            "DOT": "Polkadot",
-            "ADA": "Cardano",
-            "XRP": "XRP",
-            "DOGE": "Dogecoin",
-            "SHIB": "Shiba Inu",
-            "CHR": "Chromia",
-            "AVAX": "Avalanche",
-            "TON": "Toncoin",
-            "MATIC": "Polygon",
-            "LINK": "Chainlink",
-            "UNI": "Uniswap",
-            "BCH": "Bitcoin Cash",
-            "LTC": "Litecoin",
-            "XLM": "Stellar",
-            "XMR": "Monero",
-            "XRP": "Ripple"
-        }
-
-        # Replace symbols with full names where possible
-        coins = [symbol_to_name.get(coin, coin) for coin in coins]
+        # Replace symbols with full names where possible, for better CoinGecko API matching
+        coins = [SYMBOL_TO_NAME.get(coin.upper(), coin) for coin in coins]
 
         return coins
 
@@ -193,6 +254,51 @@ async def extract_coin_names_from_text(client, text: str) -> List[str]:
         return []
 
 
+def build_answer_messages(
+    question: str,
+    context: List[Dict[str, Any]],
+    market_data: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, str]]:
+    # Format the context from vector DB, without near-duplicates and within the token budget
+    context = get_context_assembler().assemble(context)
+    context_text = "\n".join(
+        [
+            f"- {item['text']} (relevance: {1-item['distance']:.2f})"
+            for item in context
+        ]
+    )
+
+    # Format market data if available
+    market_info = ""
+    if market_data and not market_data.get("error"):
+        market_info = f"""
+                        Current Market Data for {market_data.get('name', '')} ({market_data.get('symbol', '')}):
+                        - Current Price: ${market_data.get('current_price', 'Unknown')}
+                        - 24h Change: {market_data.get('price_change_24h', 'Unknown')}%
+                        """
+    # Create the system prompt
+    system_prompt = f"""You are a cryptocurrency research assistant with extensive knowledge about blockchain and digital assets.
+
+                    Use the following historical information from your knowledge base:
+                    {context_text}
+
+                    This is the latest market data for the cryptocurrency:
+                    {market_info if market_info else ''}
+
+                    Answer the user's question about cryptocurrencies based on both historical information and current market data if provided.
+
+                    Do not provide any speculative investment advice or additional information outside the scope of the question or the historical information above.
+
+                    Provide factual, balanced responses without speculative investment advice.
+                    If the knowledge base doesn't have relevant information, acknowledge the limitations.
+                    """
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": question},
+    ]
+
+
 async def generate_crypto_response(
     client,
     question: str,
@@ -200,49 +306,13 @@ async def generate_crypto_response(
     market_data: Optional[Dict[str, Any]] = None,
 ) -> str:
     try:
-        # Format the context from vector DB
-        context_text = "\n".join(
-            [
-                f"- {item['text']} (relevance: {1-item['distance']:.2f})"
-                for item in context
-            ]
-        )
-
-        # Format market data if available
-        market_info = ""
-        if market_data and not market_data.get("error"):
-            market_info = f"""
-                            Current Market Data for {market_data.get('name', '')} ({market_data.get('symbol', '')}):
-                            - Current Price: ${market_data.get('current_price', 'Unknown')}
-                            - 24h Change: {market_data.get('price_change_24h', 'Unknown')}%
-                            """
-        # Create the system prompt
-        system_prompt = f"""You are a cryptocurrency research assistant with extensive knowledge about blockchain and digital assets.
-
-                        Use the following historical information from your knowledge base:
-                        {context_text}
-
-                        This is the latest market data for the cryptocurrency:
-                        {market_info if market_info else ''}
-                        
-                        Answer the user's question about cryptocurrencies based on both historical information and current market data if provided.
-                        
-                        Do not provide any speculative investment advice or additional information outside the scope of the question or the {context_text}
-                        
-                        Provide factual, balanced responses without speculative investment advice.
-                        If the knowledge base doesn't have relevant information, acknowledge the limitations.
-                        """
+        messages = build_answer_messages(question, context, market_data)
 
         # Generate the response
-        response = await asyncio.to_thread(
-            lambda: client.chat.completions.create(
-                model="gpt-4o-mini",  # You can use a more advanced model if needed
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": question},
-                ],
-                temperature=0.4,
-            )
+        response = await client.chat.completions.create(
+            model="gpt-4o-mini",  # You can use a more advanced model if needed
+            messages=messages,
+            temperature=0.4,
         )
 
         return response.choices[0].message.content
@@ -253,120 +323,362 @@ async def generate_crypto_response(
         )
 
 
+async def stream_crypto_response(
+    client,
+    question: str,
+    context: List[Dict[str, Any]],
+    market_data: Optional[Dict[str, Any]] = None,
+) -> AsyncIterator[str]:
+    """The answer of generate_crypto_response, in pieces as the model generates them."""
+    messages = build_answer_messages(question, context, market_data)
+    stream = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=0.4,
+        stream=True,
+    )
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await stream.close()
+
+
 @app.post("/v1/text_embedding", response_model=TextEmbeddingResponse)
 async def embed_text(
     request: TextEmbeddingRequest = Body(...), 
-    db: Session = Depends(get_db)
+    client: AsyncOpenAI = Depends(get_openai_client),
 ):
-    client = get_openai_client()
-
     try:
         embedding = await get_embedding(client, request.text)
 
-        vector_brid = await get_blockchain_rid()
+        vector_str = encode_vector(embedding)
 
-        vector_str = json.dumps(embedding)
-        escaped_text = request.text.replace('"', '\\"')
-
-        cmd = (
-            f"chr tx -brid {vector_brid} add_message \"{escaped_text}\" '{vector_str}'"
-        )
-
-        process = await asyncio.create_subprocess_shell(
-            cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            shell=True,
+        result = await rid_resolver.run(
+            lambda vector_brid: node_client.add_message(vector_brid, request.text, vector_str)
         )
-        stdout, stderr = await process.communicate()
-        print(stdout.decode())
+        for mirror in chain_mirrors:
+            mirror.mark_dirty()
 
-        result = stdout.decode()
-        if "CONFIRMED" in result:
+        if result.get("status") == TX_STATUS_CONFIRMED:
             # Store in SQLite database
-            await store_embedding(db, request.text)
+            await store_embedding(request.text)
             return TextEmbeddingResponse(success=True)
         else:
-            return TextEmbeddingResponse(success=False, error=result)
+            return TextEmbeddingResponse(success=False, error=result.get("rejectReason", result.get("status")))
 
     except Exception as e:
         return TextEmbeddingResponse(success=False, error=str(e))
 
 
+@app.post("/v1/text_embedding/batch", response_model=TextEmbeddingBatchResponse)
+async def embed_text_batch(
+    request: TextEmbeddingBatchRequest = Body(...),
+    client: AsyncOpenAI = Depends(get_openai_client),
+):
+    results = [TextEmbeddingBatchItem(text=text, success=False) for text in request.texts]
+
+    # Embeddings are requested together; a failed text does not fail the others
+    embeddings = await asyncio.gather(
+        *(get_embedding(client, text) for text in request.texts), return_exceptions=True
+    )
+
+    pending = []
+    for item, embedding in zip(results, embeddings):
+        if isinstance(embedding, Exception):
+            item.error = getattr(embedding, "detail", str(embedding))
+        else:
+            pending.append((item, encode_vector(embedding)))
+
+    async def store_batch(batch):
+        messages = [(item.text, vector_str) for item, vector_str in batch]
+        try:
+            result = await rid_resolver.run(
+                lambda vector_brid: node_client.add_messages(vector_brid, messages)
+            )
+        except Exception as e:
+            result = {"status": "error", "rejectReason": str(e)}
+
+        for item, _ in batch:
+            if result.get("status") == TX_STATUS_CONFIRMED:
+                item.success = True
+            else:
+                item.error = result.get("rejectReason", result.get("status"))
+
+    # Many messages per transaction, transactions submitted concurrently
+    await asyncio.gather(*(
+        store_batch(pending[i:i + EMBEDDING_TX_BATCH_SIZE])
+        for i in range(0, len(pending), EMBEDDING_TX_BATCH_SIZE)
+    ))
+    if pending:
+        for mirror in chain_mirrors:
+            mirror.mark_dirty()
+
+    for item in results:
+        if item.success:
+            await store_embedding(item.text)
+
+    return TextEmbeddingBatchResponse(results=results)
+
+
 @app.post("/v1/text_search", response_model=TextSearchResponse)
-async def search_text(request: TextSearchRequest = Body(...)):
-    client = get_openai_client()
+async def search_text(
+    request: TextSearchRequest = Body(...),
+    client: AsyncOpenAI = Depends(get_openai_client),
+):
+    if request.mode == "hybrid" and lexical_index is None:
+        raise HTTPException(status_code=400, detail="Hybrid search needs the lexical index, enable it with LEXICAL_INDEX=1")
+
+    context = CONTEXT_MESSAGE
+    if request.coin:
+        # The filter is applied by the node, which only searches the vectors in the coin's context
+        context = await coin_contexts.get(request.coin)
+        if context is None:
+            return TextSearchResponse(results=[])
 
     embedding = await get_embedding(client, request.text)
 
-    results = await query_vector_db(embedding, request.max_results)
+    if request.mode != "hybrid":
+        results = await query_vector_db(embedding, request.max_results, context)
+        return TextSearchResponse(results=results)
+
+    # Both retrievers over-fetch, a result ranked low by one of them can still be fused into the top
+    candidates = request.max_results * HYBRID_CANDIDATES_FACTOR
+    vector_results = await query_vector_db(embedding, candidates, context)
+    lexical_results = lexical_index.search(request.text, candidates, coin=request.coin)
+    results = fuse_rankings([vector_results, lexical_results], request.max_results)
+    for result in results:
+        # Results only found lexically have no distance
+        result.setdefault("distance", None)
 
     return TextSearchResponse(results=results)
 
 
+async def gather_conversation_context(client, question: str, top_k: int, pipeline: StagePipeline):
+    """(embedding, cached answer, search results, coin name, market data) for a question."""
+
+    # Two independent branches run concurrently: embedding -> answer cache / vector search, and
+    # coin extraction -> market data. Only the answer needs both.
+    async def context_branch():
+        embedding = await pipeline.run(
+            "embedding", get_embedding(client, question), CONVERSATION_STAGE_TIMEOUTS["embedding"]
+        )
+        if embedding is None:
+            return None, None, []
+        cached = answer_cache.lookup(embedding, top_k)
+        if cached is not None:
+            return embedding, cached, []
+        # Questions about one coin only search its messages; the coin is matched locally so the search does not
+        # wait for the coin extraction of the market branch, which may ask the model
+        results = await pipeline.run(
+            "vector_search", query_coin_vector_db(embedding, top_k, question_coin(question)),
+            CONVERSATION_STAGE_TIMEOUTS["vector_search"], default=[]
+        )
+        return embedding, None, results
+
+    async def market_branch():
+        detected_coins = await pipeline.run(
+            "coin_extraction", extract_coin_names_from_text(client, question),
+            CONVERSATION_STAGE_TIMEOUTS["coin_extraction"], default=[]
+        )
+        coin_name = detected_coins[0] if detected_coins else None
+        market_data = None
+        if coin_name:
+            market_data = await pipeline.run(
+                "market_data", get_coin_info(coin_name), CONVERSATION_STAGE_TIMEOUTS["market_data"]
+            )
+        return coin_name, market_data
+
+    market_task = asyncio.ensure_future(market_branch())
+    try:
+        embedding, cached, results = await context_branch()
+    except BaseException:
+        market_task.cancel()
+        raise
+
+    if cached is not None:
+        # Returned with the market data its answer was written from, which is younger than the market TTL
+        market_task.cancel()
+        return embedding, cached, results, cached.coin_name, cached.market_data
+
+    coin_name, market_data = await market_task
+    return embedding, None, results, coin_name, market_data
+
+
+def market_data_summary(market_data: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "symbol": market_data.get("symbol") if market_data else None,
+        "current_price": market_data.get("current_price") if market_data else None,
+    }
+
+
+async def save_conversation(question: str, answer: str, related_answers, market_data):
+    # Queued for the background writer, the response does not wait for the disk
+    db_embedding = await store_embedding(question)
+    await store_conversation(
+        question=question,
+        answer=answer,
+        related_answers=related_answers,
+        market_data=market_data_summary(market_data),
+        embedding=db_embedding,
+    )
+
+
+def cache_conversation_answer(pipeline: StagePipeline, embedding, question: str, answer: str, related_answers, top_k: int, coin_name, market_data):
+    # Degraded answers (missing context or market data) are not worth reusing
+    if embedding is not None and not pipeline.degraded:
+        answer_cache.add(embedding, CachedAnswer(
+            question=question,
+            answer=answer,
+            related_answers=related_answers,
+            top_k=top_k,
+            coin_name=coin_name,
+            market_data=market_data,
+            latency=time.monotonic() - pipeline.started,
+        ))
+
+
 @app.post("/v1/text_conversation", response_model=TextConversationResponse)
 async def conversation(
     request: TextConversationRequest = Body(...),
-    db: Session = Depends(get_db)
+    client: AsyncOpenAI = Depends(get_openai_client),
 ):
-    client = get_openai_client()
-    
-    print('Generating embedding...')
-    embedding = await get_embedding(client, request.question)
-
-    print('Querying vector database...')
-    results = await query_vector_db(embedding, request.top_k)
-
-    coin_name = None
-    detected_coins = await extract_coin_names_from_text(client, request.question)
-    if detected_coins:
-        coin_name = detected_coins[0]
-
-    market_data = None
-    if coin_name:
-        market_data = await get_coin_info(coin_name)
-        
-    print(market_data)
-    print(detected_coins)
-
-    answer = await generate_crypto_response(
-        client, request.question, results, market_data
-    )
+    pipeline = StagePipeline(conversation_stage_stats)
 
-    # Store embedding first
-    db_embedding = await store_embedding(db, request.question)
-    
-    # Create related answers in format for database
-    related_answers = [
-        {"answer": item["text"], "distance": item["distance"]} for item in results
-    ]
-    
-    # Store conversation response
-    await store_conversation(
-        db,
-        embedding_id=db_embedding.id,
-        question=request.question,
-        answer=answer,
-        related_answers=related_answers,
-        market_data={
-            "symbol": market_data.get("symbol") if market_data else None,
-            "current_price": market_data.get("current_price") if market_data else None,
-        },
+    embedding, cached, results, coin_name, market_data = await gather_conversation_context(
+        client, request.question, request.top_k, pipeline
     )
 
+    if request.stream:
+        return StreamingResponse(
+            stream_conversation(client, request, pipeline, embedding, cached, results, coin_name, market_data),
+            media_type="text/event-stream",
+            # Proxies must pass the events on as they come
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    if cached is not None:
+        print('Answering from the semantic answer cache...')
+        answer = cached.answer
+        related_answers = cached.related_answers[:request.top_k]
+        answer_cache.record_hit(cached, time.monotonic() - pipeline.started)
+    else:
+        try:
+            answer = await pipeline.run(
+                "answer", generate_crypto_response(client, request.question, results, market_data),
+                CONVERSATION_STAGE_TIMEOUTS["answer"], required=True
+            )
+        except StageFailed as e:
+            raise HTTPException(status_code=500, detail=f"Error generating response: {e.reason}")
+
+        # Create related answers in format for database
+        related_answers = [
+            {"answer": item["text"], "distance": item["distance"]} for item in results
+        ]
+        cache_conversation_answer(
+            pipeline, embedding, request.question, answer, related_answers, request.top_k, coin_name, market_data
+        )
+
+    await save_conversation(request.question, answer, related_answers, market_data)
+
+    timings = pipeline.finish()
+    print(f"Conversation stage timings (ms): {timings}")
+
     formatted_response = {
         "question": request.question,
         "answer": answer,
         "related_answers": related_answers,
-        "market_data": {
-            "symbol": market_data.get("symbol") if market_data else None,
-            "current_price": market_data.get("current_price") if market_data else None,
-        },
+        "market_data": market_data_summary(market_data),
+        "cached": cached is not None,
+        "timings": timings,
+        "degraded": pipeline.degraded,
     }
 
     return formatted_response
 
 
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_conversation(
+    client, request: TextConversationRequest, pipeline: StagePipeline,
+    embedding, cached: Optional[CachedAnswer], results, coin_name, market_data,
+) -> AsyncIterator[str]:
+    """
+    Server-sent events of a conversation: `context` with the related answers and market data,
+    `token` events with pieces of the answer as they are generated, then `done` with the timings,
+    or `error` if the answer could not be generated.
+    """
+    if cached is not None:
+        related_answers = cached.related_answers[:request.top_k]
+    else:
+        related_answers = [
+            {"answer": item["text"], "distance": item["distance"]} for item in results
+        ]
+    yield sse_event("context", {
+        "question": request.question,
+        "related_answers": related_answers,
+        "market_data": market_data_summary(market_data),
+        "cached": cached is not None,
+    })
+
+    if cached is not None:
+        answer = cached.answer
+        answer_cache.record_hit(cached, time.monotonic() - pipeline.started)
+        yield sse_event("token", {"text": answer})
+    else:
+        pieces = []
+        start = time.monotonic()
+        deadline = start + CONVERSATION_STAGE_TIMEOUTS["answer"]
+        tokens = stream_crypto_response(client, request.question, results, market_data)
+        try:
+            while True:
+                try:
+                    piece = await asyncio.wait_for(tokens.__anext__(), max(deadline - time.monotonic(), 0))
+                except StopAsyncIteration:
+                    break
+                if not pieces:
+                    # Time to first token is what a streaming client waits for
+                    first_token = time.monotonic() - start
+                    pipeline.timings["answer_first_token"] = round(first_token * 1000, 1)
+                    conversation_stage_stats.record("answer_first_token", first_token)
+                pieces.append(piece)
+                yield sse_event("token", {"text": piece})
+        except asyncio.TimeoutError:
+            conversation_stage_stats.record("answer", time.monotonic() - start, "timeout")
+            reason = f"timed out after {CONVERSATION_STAGE_TIMEOUTS['answer']:g}s"
+        except Exception as e:
+            conversation_stage_stats.record("answer", time.monotonic() - start, "error")
+            reason = f"failed: {str(e)}"
+        else:
+            reason = None
+        finally:
+            await tokens.aclose()
+
+        if reason is not None:
+            # The context was sent already, the client learns about the failure in the stream
+            print(f"Stage answer {reason}")
+            yield sse_event("error", {"detail": f"Error generating response: {reason}"})
+            return
+
+        elapsed = time.monotonic() - start
+        pipeline.timings["answer"] = round(elapsed * 1000, 1)
+        conversation_stage_stats.record("answer", elapsed)
+        answer = "".join(pieces)
+        cache_conversation_answer(
+            pipeline, embedding, request.question, answer, related_answers, request.top_k, coin_name, market_data
+        )
+
+    # Persisted once the whole answer is known
+    await save_conversation(request.question, answer, related_answers, market_data)
+
+    timings = pipeline.finish()
+    print(f"Conversation stage timings (ms): {timings}")
+    yield sse_event("done", {"timings": timings, "degraded": pipeline.degraded})
+
+
 @app.get("/health", response_model=Dict[str, Any])
 async def health_check():
     """Health check endpoint that verifies the API and Docker container status."""
@@ -378,12 +690,11 @@ async def health_check():
     
     # Check Docker container running on port 7740
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get("http://localhost:7740", timeout=2) as response:
-                if response.status == 200:
-                    status["docker_status"] = "healthy"
-                else:
-                    status["docker_status"] = f"unhealthy - status code: {response.status}"
+        async with node_client.session.get(node_client.base_url, timeout=aiohttp.ClientTimeout(total=2)) as response:
+            if response.status == 200:
+                status["docker_status"] = "healthy"
+            else:
+                status["docker_status"] = f"unhealthy - status code: {response.status}"
     except asyncio.TimeoutError:
         status["docker_status"] = "unhealthy - timeout"
     except aiohttp.ClientError as e:
@@ -396,30 +707,83 @@ async def health_check():
             status["vector_blockchain"] = "available"
     except Exception as e:
         status["vector_blockchain"] = f"unavailable - {str(e)}"
+
+    # Must match vector_db_extension.dimensions of the chain
+    status["embedding_dimensions"] = embedding_dimensions()
+    status["embedding_cache"] = get_embedding_cache().stats()
+    status["answer_cache"] = answer_cache.stats()
+    status["reranker"] = reranker.stats()
+    status["coin_registry"] = get_coin_registry().stats()
+    status["market_data_cache"] = get_coingecko_client().cache.stats()
+    status["conversation_stages"] = conversation_stage_stats.summary()
+    status["database_writes"] = get_write_queue().stats()
+    if vector_index is not None:
+        status["vector_index"] = vector_index.stats()
+    if lexical_index is not None:
+        status["lexical_index"] = lexical_index.stats()
     
     return status
 
 
+# Fields of a history item -> the columns they are made of; id and created_at are always included
+HISTORY_FIELDS = {
+    "question": ("question",),
+    "answer": ("answer",),
+    "related_answers": ("related_answers",),
+    "market_data": ("coin_symbol", "coin_price"),
+}
+DEFAULT_HISTORY_FIELDS = "question,answer,market_data"
+
+
+def format_history_item(row: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    item = {"id": row["id"], "created_at": row["created_at"].isoformat()}
+    for field in fields:
+        if field == "market_data":
+            item["market_data"] = {
+                "symbol": row["coin_symbol"],
+                "price": row["coin_price"]
+            } if row["coin_symbol"] else None
+        else:
+            item[field] = row[field]
+    return item
+
+
 @app.get("/v1/conversation_history")
-async def get_conversation_history(limit: int = 10, db: Session = Depends(get_db)):
-    """Retrieve recent conversation history from the database"""
-    conversations = await get_recent_conversations(db, limit)
-    
-    # Format the response
-    history = []
-    for conv in conversations:
-        history.append({
-            "id": conv.id,
-            "question": conv.question,
-            "answer": conv.answer,
-            "created_at": conv.created_at.isoformat(),
-            "market_data": {
-                "symbol": conv.coin_symbol,
-                "price": conv.coin_price
-            } if conv.coin_symbol else None
-        })
-    
-    return {"history": history, "count": len(history)}
+async def get_conversation_history(
+    limit: int = Query(10, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    coin_symbol: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    fields: str = DEFAULT_HISTORY_FIELDS,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Retrieve conversation history from the database, newest first, a page at a time.
+    With format=ndjson all matching conversations are streamed, one JSON object per line.
+    """
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in HISTORY_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    columns = [column for field in requested for column in HISTORY_FIELDS[field]]
+    try:
+        position = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "ndjson":
+        async def export():
+            async for row in stream_conversations(db, position, coin_symbol, since, until, columns):
+                yield json.dumps(format_history_item(row, requested)) + "\n"
+
+        return StreamingResponse(export(), media_type="application/x-ndjson")
+
+    rows, next_cursor = await get_conversations(db, limit, position, coin_symbol, since, until, columns)
+    history = [format_history_item(row, requested) for row in rows]
+
+    return {"history": history, "count": len(history), "next_cursor": next_cursor}
 
 
 if __name__ == "__main__":
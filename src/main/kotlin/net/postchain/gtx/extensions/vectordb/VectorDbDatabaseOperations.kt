@@ -63,16 +63,16 @@ class VectorDbDatabaseOperations {
         }
     }
 
-    fun storeVector(ctx: TxEContext, id: Long, context: Long, vector: String) {
+    fun storeVector(ctx: TxEContext, id: Long, context: Long, vector: SqlVector) {
         DatabaseAccess.of(ctx).apply {
             val tableName = getVectorDbTableName(ctx)
             ctx.conn.prepareStatement("""
-                    INSERT INTO $tableName ($VECTOR_DB_COLUMN_CONTEXT, $VECTOR_DB_COLUMN_ID, $VECTOR_DB_COLUMN_EMBEDDING) VALUES (?, ?, ?::vector)
+                    INSERT INTO $tableName ($VECTOR_DB_COLUMN_CONTEXT, $VECTOR_DB_COLUMN_ID, $VECTOR_DB_COLUMN_EMBEDDING) VALUES (?, ?, ${vector.placeholder})
                     """.trimIndent()
             ).use { stmt ->
                 stmt.setLong(1, context)
                 stmt.setLong(2, id)
-                stmt.setString(3, vector)
+                vector.bind(stmt, 3)
                 stmt.execute()
             }
         }
@@ -93,20 +93,20 @@ class VectorDbDatabaseOperations {
         }
     }
 
-    fun queryClosestObjects(ctx: EContext, context: Long, vectorQuery: String, maxDistance: BigDecimal, maxVectors: Long): GtvArray {
+    fun queryClosestObjects(ctx: EContext, context: Long, vectorQuery: SqlVector, maxDistance: BigDecimal, maxVectors: Long): GtvArray {
         DatabaseAccess.of(ctx).apply {
             val tableName = getVectorDbTableName(ctx)
             ctx.conn.prepareStatement(
                     """
                     WITH nearest_results AS MATERIALIZED (
-                        SELECT $VECTOR_DB_COLUMN_ID, $VECTOR_DB_COLUMN_EMBEDDING <=> ?::halfvec AS distance 
+                        SELECT $VECTOR_DB_COLUMN_ID, $VECTOR_DB_COLUMN_EMBEDDING <=> ${vectorQuery.placeholder} AS distance
                         FROM $tableName
                         WHERE $VECTOR_DB_COLUMN_CONTEXT = ? ORDER BY distance
                         LIMIT ?
                     ) SELECT $VECTOR_DB_COLUMN_ID, distance FROM nearest_results WHERE distance <= ? ORDER BY distance
                     """.trimIndent()
             ).use { stmt ->
-                stmt.setString(1, vectorQuery)
+                vectorQuery.bind(stmt, 1)
                 stmt.setLong(2, context)
                 stmt.setLong(3, maxVectors)
                 stmt.setBigDecimal(4, maxDistance)
@@ -123,6 +123,34 @@ class VectorDbDatabaseOperations {
             }
         }
     }
+
+    /** Vectors of a context with id greater than [afterId] in id order, as little-endian float32 */
+    fun getVectors(ctx: EContext, context: Long, afterId: Long, maxVectors: Long): GtvArray {
+        DatabaseAccess.of(ctx).apply {
+            val tableName = getVectorDbTableName(ctx)
+            ctx.conn.prepareStatement(
+                    """
+                    SELECT $VECTOR_DB_COLUMN_ID, $VECTOR_DB_COLUMN_EMBEDDING::text FROM $tableName
+                    WHERE $VECTOR_DB_COLUMN_CONTEXT = ? AND $VECTOR_DB_COLUMN_ID > ? ORDER BY $VECTOR_DB_COLUMN_ID
+                    LIMIT ?
+                    """.trimIndent()
+            ).use { stmt ->
+                stmt.setLong(1, context)
+                stmt.setLong(2, afterId)
+                stmt.setLong(3, maxVectors)
+                val rs = stmt.executeQuery()
+
+                val result = mutableListOf<Gtv>()
+                while (rs.next()) {
+                    result.add(gtv(
+                            "id" to gtv(rs.getLong(1)),
+                            "vector" to gtv(VectorDbVectorCodec.encodeFloat32(VectorDbVectorCodec.parseText(rs.getString(2))))
+                    ))
+                }
+                return gtv(result)
+            }
+        }
+    }
 }
 
 fun DatabaseAccess.getVectorDbTableName(ctx: EContext): String {
@@ -14,7 +14,9 @@ const val EVENT_STORE_VECTOR_NAME = "store_vector"
 const val EVENT_DELETE_VECTOR_NAME = "delete_vector"
 
 class VectorDbEventProcessor(
-        private val databaseOperations: VectorDbDatabaseOperations
+        private val databaseOperations: VectorDbDatabaseOperations,
+        /** Configured number of dimensions, needed to decode binary vectors */
+        private val dimensions: () -> Long,
 ) : BaseBlockBuilderExtension, TxEventSink {
 
     override fun init(blockEContext: BlockEContext, baseBB: BaseBlockBuilder) {
@@ -32,7 +34,8 @@ class VectorDbEventProcessor(
 
     private fun storeVectorEvent(ctxt: TxEContext, args: Map<String, Gtv>) {
         val context = args["context"]?.asInteger() ?: throw UserMistake("No context argument supplied")
-        val vector = args["vector"]?.asString() ?: throw UserMistake("No vector argument supplied")
+        val vector = args["vector"]?.let { VectorDbVectorCodec.toSqlVector(it, dimensions) }
+                ?: throw UserMistake("No vector argument supplied")
         val id = args["id"]?.asInteger() ?: throw UserMistake("No id argument supplied")
 
         databaseOperations.storeVector(ctxt, id, context, vector)
@@ -17,11 +17,13 @@ import net.postchain.gtx.special.GTXSpecialTxExtension
 import java.math.BigDecimal
 
 const val VECTOR_DB_QUERY_CLOSEST_OBJECTS = "query_closest_objects"
+const val VECTOR_DB_QUERY_GET_VECTORS = "get_vectors"
 
 class VectorDbGTXModuleContext(
         val databaseOperations: VectorDbDatabaseOperations,
 ) {
     lateinit var module: GTXModule
+    lateinit var config: VectorDbConfig
 }
 
 class VectorDbGTXModule(
@@ -29,6 +31,7 @@ class VectorDbGTXModule(
 ) : SimpleGTXModule<VectorDbGTXModuleContext>(
         VectorDbGTXModuleContext(databaseOperations), mapOf(), mapOf(
         VECTOR_DB_QUERY_CLOSEST_OBJECTS to Companion::queryClosestObjects,
+        VECTOR_DB_QUERY_GET_VECTORS to Companion::getVectors,
     )
 ), PostchainContextAware {
 
@@ -37,21 +40,39 @@ class VectorDbGTXModule(
     companion object : KLogging() {
         fun queryClosestObjects(moduleContext: VectorDbGTXModuleContext, ctx: EContext, args: Gtv): Gtv {
             val context = args["context"]?.asInteger() ?: throw UserMistake("No context argument supplied")
-            val vectorQuery = args["q_vector"]?.asString() ?: throw UserMistake("No q_vector argument supplied")
+            val vectorQuery = args["q_vector"]?.let { VectorDbVectorCodec.toSqlVector(it) { moduleContext.config.dimensions } }
+                    ?: throw UserMistake("No q_vector argument supplied")
             val maxDistance = BigDecimal(args["max_distance"]?.asString() ?: throw UserMistake("No max_distance argument supplied"))
             val maxVectors = args["max_vectors"]?.asInteger() ?: 10L
             val queryTemplate = args["query_template"]?.asDict()
 
             val vectorResult = moduleContext.databaseOperations.queryClosestObjects(ctx, context, vectorQuery, maxDistance, maxVectors)
 
-            return if (queryTemplate == null) {
-                vectorResult
-            } else {
-                val queryTemplateType = queryTemplate["type"]?.asString() ?: throw UserMistake("No type argument supplied to query_template")
-                val queryTemplateArgs = queryTemplate["args"]?.asDict() ?: mapOf()
-                return moduleContext.module.query(ctx, queryTemplateType,
-                        gtv(mapOf("closest_results" to vectorResult) + queryTemplateArgs))
-            }
+            return applyQueryTemplate(moduleContext, ctx, queryTemplate, "closest_results", vectorResult)
+        }
+
+        /**
+         * Pages through the stored vectors of a context in id order, e.g. to mirror them in a client side index.
+         * A query template gets the page as `vectors: list<object_vector>`.
+         */
+        fun getVectors(moduleContext: VectorDbGTXModuleContext, ctx: EContext, args: Gtv): Gtv {
+            val context = args["context"]?.asInteger() ?: throw UserMistake("No context argument supplied")
+            val afterId = args["after_id"]?.asInteger() ?: -1L
+            val maxVectors = args["max_vectors"]?.asInteger() ?: 1000L
+            val queryTemplate = args["query_template"]?.asDict()
+
+            val vectors = moduleContext.databaseOperations.getVectors(ctx, context, afterId, maxVectors)
+
+            return applyQueryTemplate(moduleContext, ctx, queryTemplate, "vectors", vectors)
+        }
+
+        private fun applyQueryTemplate(moduleContext: VectorDbGTXModuleContext, ctx: EContext, queryTemplate: Map<String, Gtv>?,
+                                       resultArgName: String, result: Gtv): Gtv {
+            if (queryTemplate == null) return result
+
+            val queryTemplateType = queryTemplate["type"]?.asString() ?: throw UserMistake("No type argument supplied to query_template")
+            val queryTemplateArgs = queryTemplate["args"]?.asDict() ?: mapOf()
+            return moduleContext.module.query(ctx, queryTemplateType, gtv(mapOf(resultArgName to result) + queryTemplateArgs))
         }
     }
 
@@ -60,6 +81,7 @@ class VectorDbGTXModule(
 
         val vectorDbConfig = configuration.rawConfig["vector_db_extension"]?.toObject<VectorDbConfig>()
                 ?: throw UserMistake("No vector db extension config present")
+        conf.config = vectorDbConfig
 
         if (chainId != null) {
 
@@ -79,6 +101,6 @@ class VectorDbGTXModule(
     override fun getSpecialTxExtensions() = emptyList<GTXSpecialTxExtension>()
 
     override fun makeBlockBuilderExtensions(): List<BaseBlockBuilderExtension>  {
-        return listOf(VectorDbEventProcessor(databaseOperations))
+        return listOf(VectorDbEventProcessor(databaseOperations) { conf.config.dimensions })
     }
 }
@@ -0,0 +1,80 @@
+package net.postchain.gtx.extensions.vectordb
+
+import net.postchain.common.exception.UserMistake
+import net.postchain.gtv.Gtv
+import net.postchain.gtv.GtvType
+import java.nio.ByteBuffer
+import java.nio.ByteOrder
+import java.sql.PreparedStatement
+
+/**
+ * A vector argument bound to a statement parameter and cast to `halfvec` by its [placeholder].
+ */
+sealed class SqlVector {
+
+    abstract val placeholder: String
+
+    abstract fun bind(stmt: PreparedStatement, index: Int)
+
+    /** Text on format [1.0,2.0,...], parsed by postgres */
+    class Text(val text: String) : SqlVector() {
+        override val placeholder = "?::halfvec"
+
+        override fun bind(stmt: PreparedStatement, index: Int) = stmt.setString(index, text)
+    }
+
+    /**
+     * A decoded binary vector. The JDBC driver sends a float[] in the binary format of `real[]`, which pgvector
+     * casts to `halfvec` element by element, so the values are never formatted or parsed as decimal text. pgvector's
+     * own binary `halfvec` format would need the extension's type OID registered for binary transfer with the driver.
+     */
+    class Floats(val values: FloatArray) : SqlVector() {
+        override val placeholder = "?::real[]::halfvec"
+
+        override fun bind(stmt: PreparedStatement, index: Int) = stmt.setObject(index, values)
+    }
+}
+
+/**
+ * Vectors are accepted either as text on format [1.0,2.0,...] or as a byte_array of little-endian float16 or
+ * float32 values. The element size of a byte_array is given by its length and the configured number of dimensions.
+ */
+object VectorDbVectorCodec {
+
+    /** Converts a vector argument to a statement parameter, text stays text and binary vectors stay binary */
+    fun toSqlVector(vector: Gtv, dimensions: () -> Long): SqlVector {
+        return when (vector.type) {
+            GtvType.STRING -> SqlVector.Text(vector.asString())
+            GtvType.BYTEARRAY -> SqlVector.Floats(decode(vector.asByteArray(), dimensions()))
+            else -> throw UserMistake("Vector must be text or byte_array, got ${vector.type}")
+        }
+    }
+
+    fun decode(bytes: ByteArray, dimensions: Long): FloatArray {
+        val buffer = ByteBuffer.wrap(bytes).order(ByteOrder.LITTLE_ENDIAN)
+        return when (bytes.size.toLong()) {
+            dimensions * 2 -> FloatArray(dimensions.toInt()) { java.lang.Float.float16ToFloat(buffer.getShort()) }
+            dimensions * 4 -> FloatArray(dimensions.toInt()) { buffer.getFloat() }
+            else -> throw UserMistake("Binary vector of ${bytes.size} bytes is neither float16 nor float32 with $dimensions dimensions")
+        }
+    }
+
+    /** Parses the text representation [1.0,2.0,...], as also returned by postgres for `vector` and `halfvec` */
+    fun parseText(text: String): FloatArray {
+        val values = text.trim().removePrefix("[").removeSuffix("]")
+        if (values.isBlank()) return FloatArray(0)
+        return values.split(',').map { it.trim().toFloat() }.toFloatArray()
+    }
+
+    fun encodeFloat32(vector: FloatArray): ByteArray {
+        val buffer = ByteBuffer.allocate(vector.size * 4).order(ByteOrder.LITTLE_ENDIAN)
+        vector.forEach { buffer.putFloat(it) }
+        return buffer.array()
+    }
+
+    fun encodeFloat16(vector: FloatArray): ByteArray {
+        val buffer = ByteBuffer.allocate(vector.size * 2).order(ByteOrder.LITTLE_ENDIAN)
+        vector.forEach { buffer.putShort(java.lang.Float.floatToFloat16(it)) }
+        return buffer.array()
+    }
+}
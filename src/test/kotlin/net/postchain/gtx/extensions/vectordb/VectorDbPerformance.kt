@@ -113,7 +113,7 @@ class VectorDbPerformance {
                         val vectorDbDatabaseOperations = VectorDbDatabaseOperations()
 
                         while (run.get()) {
-                            val result = vectorDbDatabaseOperations.queryClosestObjects(ctx, 0L, vectorProvider(), BigDecimal(maxDistance), 10)
+                            val result = vectorDbDatabaseOperations.queryClosestObjects(ctx, 0L, SqlVector.Text(vectorProvider()), BigDecimal(maxDistance), 10)
                             requests.incrementAndGet()
                             if (result.asArray().isNotEmpty()) {
                                 hits.incrementAndGet()
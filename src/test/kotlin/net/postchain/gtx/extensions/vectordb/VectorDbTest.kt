@@ -86,6 +86,12 @@ class VectorDbIT : IntegrationTestSetup() {
                 mapOf("text" to "alpha", "distance" to "0"),
                 mapOf("text" to "eve", "distance"  to "0.015675861711910488"),
         ))
+
+        assertThat(
+                queryClosestObjects(engine, VECTOR_DB_QUERY_CLOSEST_OBJECTS, 0, "[1, 2, 3]", 1.0, 3,
+                        buildQueryTemplateOrNull("get_messages_with_distance")
+                ).asArray().map { it.asDict()["id"]!!.asInteger() }
+        ).isEqualTo(listOf(1L, 5L, 2L))
     }
 
     @Test
@@ -130,6 +136,134 @@ class VectorDbIT : IntegrationTestSetup() {
         ))
     }
 
+    @Test
+    fun `add messages - batch in one operation`() {
+        val node = createNodes(1, "/net/postchain/gtx/extensions/vectordb/vector_example_3d.xml")[0]
+        val engine = node.getBlockchainInstance().blockchainEngine
+
+        addMessages(engine, listOf(
+                "alpha" to "[1, 2, 3]",
+                "beta" to "[1, 4, 3]",
+                "charlie" to "[7, 4, 3]",
+        ))
+        addMessage(engine, "eve", "[2, 3, 7]")
+        buildBlock(DEFAULT_CHAIN_IID)
+
+        assertThat(getVectors(engine, DEFAULT_CHAIN_IID)).hasSize(4)
+        assertThat(
+                queryClosestObjectsGetStrings(engine, 0, "[1, 2, 3]", 1.0, 3, "get_messages")
+        ).isEqualTo(listOf("alpha", "eve", "beta"))
+    }
+
+    @Test
+    fun `add messages - binary vectors give the same distances as text`() {
+        val node = createNodes(1, "/net/postchain/gtx/extensions/vectordb/vector_example_3d.xml")[0]
+        val engine = node.getBlockchainInstance().blockchainEngine
+
+        addMessageBinary(engine, "alpha", VectorDbVectorCodec.encodeFloat16(floatArrayOf(1f, 2f, 3f)))
+        addMessagesBinary(engine, listOf(
+                "beta" to VectorDbVectorCodec.encodeFloat32(floatArrayOf(1f, 4f, 3f)),
+                "charlie" to VectorDbVectorCodec.encodeFloat16(floatArrayOf(7f, 4f, 3f)),
+        ))
+        addMessage(engine, "eve", "[2, 3, 7]")
+        buildBlock(DEFAULT_CHAIN_IID)
+
+        assertThat(getVectors(engine, DEFAULT_CHAIN_IID)).hasSize(4)
+        val expected = listOf(
+                mapOf("text" to "alpha", "distance" to "0"),
+                mapOf("text" to "eve", "distance"  to "0.015675861711910488"),
+                mapOf("text" to "beta", "distance"  to "0.056543646950273474")
+        )
+        assertThat(
+                queryClosestObjectsGetTextAndDistance(engine, 0, "[1, 2, 3]", 1.0, 3, "get_messages_with_distance")
+        ).isEqualTo(expected)
+        assertThat(
+                queryClosestObjects(engine, VECTOR_DB_QUERY_CLOSEST_OBJECTS, 0,
+                        gtv(VectorDbVectorCodec.encodeFloat16(floatArrayOf(1f, 2f, 3f))), 1.0, 3,
+                        buildQueryTemplateOrNull("get_messages_with_distance")
+                ).asArray().map { mapOf("text" to it.asDict()["text"]!!.asString(), "distance" to it.asDict()["distance"]!!.asString()) }
+        ).isEqualTo(expected)
+    }
+
+    @Test
+    fun `get vectors - paging in id order`() {
+        val node = createNodes(1, "/net/postchain/gtx/extensions/vectordb/vector_example_3d.xml")[0]
+        val engine = node.getBlockchainInstance().blockchainEngine
+
+        addMessage(engine, "alpha", "[1, 2, 3]")
+        addMessage(engine, "beta", "[1, 4, 3]")
+        addMessage(engine, "charlie", "[7, 4, 3]")
+        buildBlock(DEFAULT_CHAIN_IID)
+
+        val firstPage = getVectorsPage(engine, 0, -1, 2).asArray()
+        assertThat(firstPage.map { it.asDict()["id"]!!.asInteger() }).isEqualTo(listOf(1L, 2L))
+        assertThat(firstPage.map { VectorDbVectorCodec.decode(it.asDict()["vector"]!!.asByteArray(), 3).toList() })
+                .isEqualTo(listOf(listOf(1f, 2f, 3f), listOf(1f, 4f, 3f)))
+        assertThat(getVectorsPage(engine, 0, 2, 2).asArray().map { it.asDict()["id"]!!.asInteger() }).isEqualTo(listOf(3L))
+        assertThat(getVectorsPage(engine, 0, 3, 2).asArray()).hasSize(0)
+
+        assertThat(
+                getVectorsPage(engine, 0, -1, 10, buildQueryTemplateOrNull("get_messages_with_vectors"))
+                        .asArray().map { it.asDict()["text"]!!.asString() }
+        ).isEqualTo(listOf("alpha", "beta", "charlie"))
+
+        val texts = getVectorsPage(engine, 0, -1, 10, buildQueryTemplateOrNull("get_messages_with_ids")).asArray()
+        assertThat(texts.map { it.asDict()["text"]!!.asString() }).isEqualTo(listOf("alpha", "beta", "charlie"))
+        assertThat(texts.map { it.asDict().containsKey("vector") }).isEqualTo(listOf(false, false, false))
+    }
+
+    @Test
+    fun `tagged messages - search within the context of a coin`() {
+        val node = createNodes(1, "/net/postchain/gtx/extensions/vectordb/vector_example_3d.xml")[0]
+        val engine = node.getBlockchainInstance().blockchainEngine
+
+        addTaggedMessages(engine, listOf(
+                TaggedMessage("alpha", "[1, 2, 3]", "Bitcoin", "name"),
+                TaggedMessage("beta", "[1, 4, 3]", "Ethereum", "name"),
+                TaggedMessage("charlie", "[7, 4, 3]", "Bitcoin", "chunk"),
+        ))
+        addMessage(engine, "eve", "[2, 3, 7]")
+        buildBlock(DEFAULT_CHAIN_IID)
+
+        // Every tagged vector is stored in CONTEXT_MESSAGE and in the context of its coin
+        assertThat(getVectors(engine, DEFAULT_CHAIN_IID)).hasSize(7)
+        assertThat(
+                queryClosestObjectsGetStrings(engine, 0, "[1, 2, 3]", 1.0, 4, "get_messages")
+        ).isEqualTo(listOf("alpha", "eve", "beta", "charlie"))
+
+        val bitcoin = getCoinContext(engine, "BITCOIN")!!
+        assertThat(getCoinContext(engine, "bitcoin")).isEqualTo(bitcoin)
+        assertThat(getCoinContext(engine, "Solana")).isEqualTo(null)
+        assertThat(
+                queryClosestObjectsGetStrings(engine, bitcoin, "[1, 2, 3]", 1.0, 3, "get_messages")
+        ).isEqualTo(listOf("alpha", "charlie"))
+
+        val tags = getVectorsPage(engine, 0, -1, 10, buildQueryTemplateOrNull("get_messages_with_ids")).asArray()
+        assertThat(tags.map { it.asDict()["coin"]!!.let { coin -> if (coin.isNull()) null else coin.asString() } })
+                .isEqualTo(listOf("bitcoin", "ethereum", "bitcoin", null))
+        assertThat(tags.map { it.asDict()["chunk_type"]!!.let { type -> if (type.isNull()) null else type.asString() } })
+                .isEqualTo(listOf("name", "name", "chunk", null))
+
+        // The same texts and tags, paged without reading the vectors
+        val firstPage = getMessageTexts(engine, -1, 2)
+        assertThat(firstPage.map { it["text"]!!.asString() }).isEqualTo(listOf("alpha", "beta"))
+        val secondPage = getMessageTexts(engine, firstPage.last()["id"]!!.asInteger(), 2)
+        assertThat(secondPage.map { it["text"]!!.asString() }).isEqualTo(listOf("charlie", "eve"))
+        assertThat((firstPage + secondPage).map { it["id"]!!.asInteger() })
+                .isEqualTo(tags.map { it.asDict()["id"]!!.asInteger() })
+        assertThat(secondPage.map { it["coin"]!!.let { coin -> if (coin.isNull()) null else coin.asString() } })
+                .isEqualTo(listOf("bitcoin", null))
+
+        deleteMessage(engine, "charlie")
+        buildBlock(DEFAULT_CHAIN_IID)
+        await().atMost(Duration.TEN_SECONDS).untilAsserted {
+            assertThat(getVectors(engine, DEFAULT_CHAIN_IID)).hasSize(5)
+        }
+        assertThat(
+                queryClosestObjectsGetStrings(engine, bitcoin, "[1, 2, 3]", 1.0, 3, "get_messages")
+        ).isEqualTo(listOf("alpha"))
+    }
+
     @Test
     fun `test add and delete`() {
         val node = createNodes(1, "/net/postchain/gtx/extensions/vectordb/vector_example_3d.xml")[0]
@@ -53,9 +53,13 @@ fun queryClosestObjectsGetTextAndDistance(engine: BlockchainEngine, context: Lon
 }
 
 fun queryClosestObjects(engine: BlockchainEngine, queryName: String, context: Long, vector: String, maxDistance: Double, maxVectors: Long, queryTemplate: GtvDictionary? = null): Gtv {
+    return queryClosestObjects(engine, queryName, context, gtv(vector), maxDistance, maxVectors, queryTemplate)
+}
+
+fun queryClosestObjects(engine: BlockchainEngine, queryName: String, context: Long, vector: Gtv, maxDistance: Double, maxVectors: Long, queryTemplate: GtvDictionary? = null): Gtv {
     val args = mutableListOf<Pair<String, Gtv>>(
             "context" to gtv(context),
-            "q_vector" to gtv(vector),
+            "q_vector" to vector,
             "max_distance" to gtv(maxDistance.toString()),
             "max_vectors" to gtv(maxVectors),
     )
@@ -65,6 +69,18 @@ fun queryClosestObjects(engine: BlockchainEngine, queryName: String, context: Lo
     return engine.getBlockQueries().query(queryName, gtv(mapOf(*args.toTypedArray()))).get()
 }
 
+fun getVectorsPage(engine: BlockchainEngine, context: Long, afterId: Long, maxVectors: Long, queryTemplate: GtvDictionary? = null): Gtv {
+    val args = mutableListOf<Pair<String, Gtv>>(
+            "context" to gtv(context),
+            "after_id" to gtv(afterId),
+            "max_vectors" to gtv(maxVectors),
+    )
+    if (queryTemplate != null) {
+        args.add("query_template" to queryTemplate)
+    }
+    return engine.getBlockQueries().query(VECTOR_DB_QUERY_GET_VECTORS, gtv(mapOf(*args.toTypedArray()))).get()
+}
+
 fun buildQueryTemplateOrNull(type: String?, args: Gtv? = null): GtvDictionary? {
     if (type != null) {
         val dict: MutableMap<String, Gtv> = mutableMapOf(
@@ -86,6 +102,48 @@ fun addMessage(engine: BlockchainEngine, message: String, vector: String) {
     engine.getTransactionQueue().enqueue(tx)
 }
 
+fun addMessages(engine: BlockchainEngine, messages: List<Pair<String, String>>) {
+    val op = GtxOp("add_messages", gtv(messages.map { (message, vector) -> gtv(gtv(message), gtv(vector)) }))
+    val tx = engine.getConfiguration().getTransactionFactory().decodeTransaction(
+            Gtx(GtxBody(engine.getConfiguration().blockchainRid, listOf(op), listOf()), listOf()).encode()
+    )
+    engine.getTransactionQueue().enqueue(tx)
+}
+
+fun addMessageBinary(engine: BlockchainEngine, message: String, vector: ByteArray) {
+    val op = GtxOp("add_message_binary", gtv(message), gtv(vector))
+    val tx = engine.getConfiguration().getTransactionFactory().decodeTransaction(
+            Gtx(GtxBody(engine.getConfiguration().blockchainRid, listOf(op), listOf()), listOf()).encode()
+    )
+    engine.getTransactionQueue().enqueue(tx)
+}
+
+fun addMessagesBinary(engine: BlockchainEngine, messages: List<Pair<String, ByteArray>>) {
+    val op = GtxOp("add_messages_binary", gtv(messages.map { (message, vector) -> gtv(gtv(message), gtv(vector)) }))
+    val tx = engine.getConfiguration().getTransactionFactory().decodeTransaction(
+            Gtx(GtxBody(engine.getConfiguration().blockchainRid, listOf(op), listOf()), listOf()).encode()
+    )
+    engine.getTransactionQueue().enqueue(tx)
+}
+
+fun addTaggedMessages(engine: BlockchainEngine, messages: List<TaggedMessage>) {
+    val op = GtxOp("add_tagged_messages", gtv(messages.map { gtv(gtv(it.text), gtv(it.vector), gtv(it.coin), gtv(it.chunkType)) }))
+    val tx = engine.getConfiguration().getTransactionFactory().decodeTransaction(
+            Gtx(GtxBody(engine.getConfiguration().blockchainRid, listOf(op), listOf()), listOf()).encode()
+    )
+    engine.getTransactionQueue().enqueue(tx)
+}
+
+fun getCoinContext(engine: BlockchainEngine, coin: String): Long? {
+    val context = engine.getBlockQueries().query("get_coin_context", gtv(mapOf("coin" to gtv(coin)))).get()
+    return if (context.isNull()) null else context.asInteger()
+}
+
+fun getMessageTexts(engine: BlockchainEngine, afterId: Long, maxMessages: Long): List<Map<String, Gtv>> {
+    val args = gtv(mapOf("after_id" to gtv(afterId), "max_messages" to gtv(maxMessages)))
+    return engine.getBlockQueries().query("get_message_texts", args).get().asArray().map { it.asDict() }
+}
+
 fun deleteMessage(engine: BlockchainEngine, message: String) {
     val op = GtxOp("delete_message", gtv(message))
     val tx = engine.getConfiguration().getTransactionFactory().decodeTransaction(
@@ -95,3 +153,5 @@ fun deleteMessage(engine: BlockchainEngine, message: String) {
 }
 
 data class Vector(val context: Long, val id: Long, val embedding: String)
+
+data class TaggedMessage(val text: String, val vector: String, val coin: String, val chunkType: String)
@@ -0,0 +1,66 @@
+package net.postchain.gtx.extensions.vectordb
+
+import assertk.assertThat
+import assertk.assertions.isCloseTo
+import assertk.assertions.isEqualTo
+import net.postchain.common.exception.UserMistake
+import net.postchain.gtv.GtvFactory.gtv
+import org.junit.jupiter.api.Test
+import org.junit.jupiter.api.assertThrows
+import kotlin.random.Random
+
+class VectorDbVectorCodecTest {
+
+    private val vector = Random(42).let { random -> FloatArray(1536) { random.nextFloat() * 0.2f - 0.1f } }
+
+    @Test
+    fun `float32 round-trip is exact`() {
+        val bytes = VectorDbVectorCodec.encodeFloat32(vector)
+
+        assertThat(bytes.size).isEqualTo(1536 * 4)
+        assertThat(VectorDbVectorCodec.decode(bytes, 1536).toList()).isEqualTo(vector.toList())
+    }
+
+    @Test
+    fun `float16 round-trip is within half precision`() {
+        val bytes = VectorDbVectorCodec.encodeFloat16(vector)
+        val decoded = VectorDbVectorCodec.decode(bytes, 1536)
+
+        assertThat(bytes.size).isEqualTo(1536 * 2)
+        vector.zip(decoded).forEach { (expected, actual) ->
+            // float16 has 11 significant bits, values below 2^-14 are subnormal with a fixed step of 2^-24
+            assertThat(actual).isCloseTo(expected, maxOf(Math.abs(expected) / 2048f, 1f / (1 shl 24)))
+        }
+    }
+
+    @Test
+    fun `sql vector from text is passed through`() {
+        val sqlVector = VectorDbVectorCodec.toSqlVector(gtv("[1, 2, 3]")) { 3 }
+
+        assertThat((sqlVector as SqlVector.Text).text).isEqualTo("[1, 2, 3]")
+        assertThat(sqlVector.placeholder).isEqualTo("?::halfvec")
+    }
+
+    @Test
+    fun `sql vector from byte array stays binary`() {
+        val bytes = VectorDbVectorCodec.encodeFloat16(floatArrayOf(1f, -2.5f, 3f))
+        val sqlVector = VectorDbVectorCodec.toSqlVector(gtv(bytes)) { 3 }
+
+        assertThat((sqlVector as SqlVector.Floats).values.toList()).isEqualTo(listOf(1f, -2.5f, 3f))
+        assertThat(sqlVector.placeholder).isEqualTo("?::real[]::halfvec")
+    }
+
+    @Test
+    fun `parse text representation`() {
+        assertThat(VectorDbVectorCodec.parseText("[1,-2.5,3e-3]").toList()).isEqualTo(listOf(1f, -2.5f, 0.003f))
+        assertThat(VectorDbVectorCodec.parseText("[]").toList()).isEqualTo(emptyList<Float>())
+    }
+
+    @Test
+    fun `byte array of wrong size is rejected`() {
+        val bytes = VectorDbVectorCodec.encodeFloat16(floatArrayOf(1f, 2f))
+
+        assertThrows<UserMistake> { VectorDbVectorCodec.decode(bytes, 3) }
+        assertThrows<UserMistake> { VectorDbVectorCodec.toSqlVector(gtv(1)) { 3 } }
+    }
+}